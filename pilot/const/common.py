@@ -49,7 +49,13 @@ IGNORE_PATHS = DEFAULT_IGNORE_PATHS + [
     if folder
 ]
 IGNORE_SIZE_THRESHOLD = 50000  # 50K+ files are ignored by default
-PROMPT_DATA_TO_IGNORE = {'directory_tree', 'name'}
+PROMPT_DATA_TO_IGNORE = {'directory_tree', 'name', 'files'}  # `files` are already in the saved messages
+# Run without anybody at the keyboard: questions are answered from ANSWERS_FILE and failed LLM requests
+# are retried according to the retry policy instead of asking the user
+HEADLESS = os.getenv('HEADLESS', 'false').lower() in ['true', '1', 'yes']
+ANSWERS_FILE = os.getenv('ANSWERS_FILE')  # JSON file with scripted answers, see ScriptedAnswers
+PROMPT_CACHE_DIR = os.getenv('PROMPT_CACHE_DIR')  # compiled prompt templates, defaults to `prompt_cache` in the config directory
+PROMPT_COMPONENT_CACHE_SIZE = 256  # number of memoized rendered prompt components
 
 
 EXAMPLE_PROJECT_DESCRIPTION = (
@@ -1,7 +1,78 @@
 import os
 MAX_GPT_MODEL_TOKENS = int(os.getenv('MAX_TOKENS', 8192))
 MIN_TOKENS_FOR_GPT_RESPONSE = 600
+# Context window sizes (in tokens) of known models, matched by the longest model name prefix
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-3.5-turbo': 16385,
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-turbo': 128000,
+    'gpt-4-1106-preview': 128000,
+    'gpt-4-0125-preview': 128000,
+    'gpt-4-vision-preview': 128000,
+    'gpt-4o': 128000,
+    'claude-2': 100000,
+    'claude-3': 200000,
+}
+TOKENS_PER_MESSAGE = 4  # approximate per-message overhead of the chat format
+MIN_TRUNCATED_FILE_LINES = 20  # files are never truncated below this many lines to fit the token budget
+FILE_CONTEXT_RANKING = os.getenv('FILE_CONTEXT_RANKING', 'true').lower() in ['true', '1', 'yes']  # only send the files relevant to the task
+FILE_CONTEXT_MAX_TOKENS = int(os.getenv('FILE_CONTEXT_MAX_TOKENS', 0))  # token budget for file contents, 0: half of the request budget
+FILE_CONTEXT_MAX_FILES = int(os.getenv('FILE_CONTEXT_MAX_FILES', 30))  # max number of files sent with their content, 0: no limit
+FILE_RESOLVER_ENABLED = os.getenv('FILE_RESOLVER', 'true').lower() in ['true', '1', 'yes']  # find the file to change without the LLM
+FILE_RESOLVER_MIN_CONFIDENCE = float(os.getenv('FILE_RESOLVER_MIN_CONFIDENCE', 0.6))  # ask the LLM below this confidence (0 - 1)
+CONVO_COMPACTION_ENABLED = os.getenv('CONVO_COMPACTION', 'false').lower() in ['true', '1', 'yes']  # summarize old turns of long conversations
+CONVO_COMPACTION_THRESHOLD = float(os.getenv('CONVO_COMPACTION_THRESHOLD', 0.75))  # compact above this fraction of the token budget
+CONVO_COMPACTION_KEEP_TURNS = int(os.getenv('CONVO_COMPACTION_KEEP_TURNS', 4))  # number of latest turns never compacted
 MAX_QUESTIONS = 5
 END_RESPONSE = "EVERYTHING_CLEAR"
 API_CONNECT_TIMEOUT = 30  # timeout for connecting to the API and sending the request (seconds)
 API_READ_TIMEOUT = 300  # timeout for receiving the response (seconds)
+LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', 10))  # max pooled connections per LLM endpoint
+LLM_KEEP_ALIVE = os.getenv('LLM_KEEP_ALIVE', 'true').lower() in ['true', '1', 'yes']
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))  # max number of LLM requests running in parallel
+LLM_POOL_IDLE_TIMEOUT = float(os.getenv('LLM_POOL_IDLE_TIMEOUT', 60))  # discard connection pools unused for this long (seconds)
+LLM_STREAM_USAGE = os.getenv('LLM_STREAM_USAGE')  # request usage stats (OpenAI endpoint), by default only from api.openai.com
+TOKEN_COUNT_CACHE_SIZE = 10000  # number of memoized per-message token counts
+TOKEN_COUNT_BATCH_THRESHOLD = 100000  # uncached characters above which messages are encoded in a batch on a thread pool
+TOKEN_COUNT_THREADS = 4
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE', 'false').lower() in ['true', '1', 'yes']
+LLM_CACHE_DIR = os.getenv('LLM_CACHE_DIR')  # defaults to `llm_cache` in the config directory
+LLM_CACHE_MAX_SIZE = int(os.getenv('LLM_CACHE_MAX_SIZE', 256)) * 1024 * 1024  # max size of cached responses (MB)
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', 7 * 24 * 3600))  # cached responses expire after this long (seconds)
+LLM_CACHE_NONDETERMINISTIC = os.getenv('LLM_CACHE_NONDETERMINISTIC', 'false').lower() in ['true', '1', 'yes']
+RATE_LIMITER_ENABLED = os.getenv('RATE_LIMITER', 'true').lower() in ['true', '1', 'yes']  # pace requests using rate limit headers
+RATE_LIMIT_BACKOFF_BASE = float(os.getenv('RATE_LIMIT_BACKOFF_BASE', 1))  # backoff after the first rate limit error (seconds)
+RATE_LIMIT_BACKOFF_MAX = float(os.getenv('RATE_LIMIT_BACKOFF_MAX', 60))  # max backoff after rate limit errors (seconds)
+LLM_ENDPOINTS = os.getenv('LLM_ENDPOINTS')  # JSON list of LLM endpoints to route requests to, see LLMRouter
+LLM_ROUTER_EWMA_ALPHA = 0.3  # weight of the latest measurement in the endpoint latency averages
+LLM_ROUTER_COOLDOWN = float(os.getenv('LLM_ROUTER_COOLDOWN', 30))  # don't use a failed endpoint for this long (seconds)
+LLM_ROUTER_MAX_COOLDOWN = 600  # max cooldown after consecutive failures (seconds)
+LLM_ROUTER_EXPECTED_TOKENS = 500  # typical response size, used to compare endpoint latency
+LLM_HEDGING_ENABLED = os.getenv('LLM_HEDGING', 'false').lower() in ['true', '1', 'yes']  # hedge slow LLM requests
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', 95))  # hedge after this percentile of recent first token times
+LLM_HEDGE_MIN_SAMPLES = 10  # number of first token times needed before hedging
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', 2))  # never hedge earlier than this (seconds)
+LLM_HEDGE_WINDOW = 100  # number of recent first token times used for the percentile
+LLM_HEDGE_MAX_PER_TYPE = int(os.getenv('LLM_HEDGE_MAX_PER_TYPE', 10))  # max hedged requests per request type
+LLM_HEDGE_CAPS = os.getenv('LLM_HEDGE_CAPS')  # JSON object with per-request-type limits, eg. {"coding": 20}
+LLM_STREAM_CHUNK_SIZE = 512  # max bytes read from the streamed response at once
+LLM_LATENCY_LOG = os.getenv('LLM_LATENCY_LOG')  # JSON lines file to append the latency breakdown of each LLM request to
+LLM_LATENCY_MAX_TIMINGS = 10000  # number of latest LLM request timings kept in memory for the report and telemetry
+# Tokenizer encodings of known models, matched by the longest model name prefix (others use DEFAULT_ENCODING)
+MODEL_ENCODINGS = {
+    'gpt-4o': 'o200k_base',
+}
+DEFAULT_ENCODING = 'cl100k_base'
+TOKENIZER_CACHE_DIR = os.getenv('TOKENIZER_CACHE_DIR')  # defaults to TIKTOKEN_CACHE_DIR or `tokenizers` in the config directory
+TOKENIZER_OFFLINE = os.getenv('TOKENIZER_OFFLINE', 'false').lower() in ['true', '1', 'yes']  # never download encodings
+TOKENIZER_DOWNLOAD_TIMEOUT = 10  # timeout for downloading an encoding (seconds)
+APPROXIMATE_BYTES_PER_TOKEN = 3.5  # used to estimate token counts when no encoding is available
+LLM_MAX_ATTEMPTS = int(os.getenv('LLM_MAX_ATTEMPTS', 5))  # max attempts of a failed LLM request in headless mode
+LLM_RETRY_BACKOFF_BASE = float(os.getenv('LLM_RETRY_BACKOFF_BASE', 2))  # wait before the first retry (seconds), doubles with each retry
+LLM_RETRY_BACKOFF_MAX = float(os.getenv('LLM_RETRY_BACKOFF_MAX', 60))  # max wait between retries (seconds)
+# Comma-separated exception class names, HTTP status codes or error message substrings of retryable errors
+LLM_RETRYABLE_ERRORS = os.getenv(
+    'LLM_RETRYABLE_ERRORS',
+    'ConnectionError,Timeout,ChunkedEncodingError,408,409,500,502,503,504,529,overloaded',
+)
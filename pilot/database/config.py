@@ -6,3 +6,20 @@ DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
+# Store modified file versions as compressed deltas against the previous version (see `FileBlob`)
+FILE_DELTA_STORAGE = os.getenv("FILE_DELTA_STORAGE", "false").lower() in ["true", "1", "yes"]
+FILE_DELTA_KEYFRAME_INTERVAL = int(os.getenv("FILE_DELTA_KEYFRAME_INTERVAL", "10"))
+# Max total size of the file contents rebuilt from deltas kept in memory (MB)
+FILE_BLOB_CACHE_SIZE = int(os.getenv("FILE_BLOB_CACHE_SIZE", "32")) * 1024 * 1024
+# SQLite connection settings, applied (as pragmas) to each connection. The WAL journal lets the
+# readers (eg. `--get-created-apps-with-steps`) read the database while a build is writing to it
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "wal")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "normal")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", str(-64 * 1024)))  # pages, or KiB if negative
+# Seconds to wait for a lock held by another connection before failing with "database is locked"
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "10"))
+# PostgreSQL connection pool settings
+DB_POOL_MAX_CONNECTIONS = int(os.getenv("DB_POOL_MAX_CONNECTIONS", "8"))
+DB_POOL_STALE_TIMEOUT = int(os.getenv("DB_POOL_STALE_TIMEOUT", "300"))  # seconds, connections idle longer are recycled
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
@@ -0,0 +1,29 @@
+from contextlib import contextmanager
+
+from peewee import Database
+
+
+@contextmanager
+def thread_connection(database: Database):
+    """
+    Close the database connection the current thread opens in the block, when the block ends.
+
+    Connections are per thread (peewee keeps the connection state thread-local), and
+    they're opened implicitly on the first query, but never closed. Work done on worker
+    threads (eg. the `llm_executor` pool) should be wrapped in this, so their connection
+    is closed (or returned to the pool, for PostgreSQL) when they're done:
+
+    >>> with thread_connection(database):
+    ...     save_user_input(project, question, answer, hint)
+
+    No connection is opened if the block doesn't query the database. A connection the
+    thread already had before the block (eg. in nested blocks) is left open.
+
+    :param database: database the block may query
+    """
+    was_closed = database.is_closed()
+    try:
+        yield database
+    finally:
+        if was_closed and not database.is_closed():
+            database.close()
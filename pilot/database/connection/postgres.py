@@ -1,11 +1,30 @@
-from peewee import PostgresqlDatabase
-from database.config import DB_NAME, DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DATABASE_TYPE
+from playhouse.pool import PooledPostgresqlDatabase
+from database.config import (
+    DB_NAME,
+    DB_HOST,
+    DB_PORT,
+    DB_USER,
+    DB_PASSWORD,
+    DATABASE_TYPE,
+    DB_POOL_MAX_CONNECTIONS,
+    DB_POOL_STALE_TIMEOUT,
+    DB_POOL_TIMEOUT,
+)
 if DATABASE_TYPE == "postgres":
     import psycopg2
     from psycopg2.extensions import quote_ident
 
 def get_postgres_database():
-    return PostgresqlDatabase(DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+    return PooledPostgresqlDatabase(
+        DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT,
+        max_connections=DB_POOL_MAX_CONNECTIONS,
+        stale_timeout=DB_POOL_STALE_TIMEOUT,
+        timeout=DB_POOL_TIMEOUT,
+    )
 
 def create_postgres_database():
     conn = psycopg2.connect(
@@ -1,5 +1,22 @@
 from peewee import SqliteDatabase
-from database.config import DB_NAME
+from database.config import (
+    DB_NAME,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_SYNCHRONOUS,
+    SQLITE_MMAP_SIZE,
+    SQLITE_CACHE_SIZE,
+    SQLITE_BUSY_TIMEOUT,
+)
 
-def get_sqlite_database():
-    return SqliteDatabase(DB_NAME)
+
+def get_sqlite_pragmas():
+    return {
+        'journal_mode': SQLITE_JOURNAL_MODE,
+        'synchronous': SQLITE_SYNCHRONOUS,
+        'mmap_size': SQLITE_MMAP_SIZE,
+        'cache_size': SQLITE_CACHE_SIZE,
+    }
+
+
+def get_sqlite_database(name=DB_NAME):
+    return SqliteDatabase(name, pragmas=get_sqlite_pragmas(), timeout=SQLITE_BUSY_TIMEOUT)
@@ -1,9 +1,14 @@
+import io
+from datetime import datetime
+from uuid import uuid4
 from playhouse.shortcuts import model_to_dict
 from utils.style import color_yellow, color_red
-from peewee import DoesNotExist, IntegrityError
+from peewee import DoesNotExist, IntegrityError, chunked, fn
+from playhouse.migrate import SchemaMigrator, migrate
 from functools import reduce
 import operator
-from database.config import DB_NAME, DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DATABASE_TYPE
+from database.config import DB_NAME, DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DATABASE_TYPE, \
+    FILE_DELTA_STORAGE, FILE_DELTA_KEYFRAME_INTERVAL
 if DATABASE_TYPE == "postgres":
     import psycopg2
     from psycopg2.extensions import quote_ident
@@ -22,6 +27,7 @@ from database.models.development_planning import DevelopmentPlanning
 from database.models.development_steps import DevelopmentSteps
 from database.models.environment_setup import EnvironmentSetup
 from database.models.development import Development
+from database.models.file_blob import FileBlob, get_blob_bytes, make_delta
 from database.models.file_snapshot import FileSnapshot
 from database.models.command_runs import CommandRuns
 from database.models.user_apps import UserApps
@@ -29,6 +35,9 @@ from database.models.user_inputs import UserInputs
 from database.models.files import File
 from database.models.feature import Feature
 
+# Rows per multi-row INSERT, keeps the number of bound variables within SQLite's limit
+INSERT_BATCH_SIZE = 100
+
 TABLES = [
             User,
             App,
@@ -40,6 +49,7 @@ TABLES = [
             DevelopmentSteps,
             EnvironmentSetup,
             Development,
+            FileBlob,
             FileSnapshot,
             CommandRuns,
             UserApps,
@@ -406,6 +416,7 @@ def save_user_input(project, query, user_input, hint):
 def delete_all_subsequent_steps(project):
     app = get_app(project.args['app_id'])
     delete_subsequent_steps(DevelopmentSteps, app, project.checkpoints['last_development_step'])
+    delete_unused_file_blobs()
     # after implementation of backwards compatibility, we don't need to delete subsequent steps for CommandRuns and UserInputs
     # delete_subsequent_steps(CommandRuns, app, project.checkpoints['last_command_run'])
     # delete_subsequent_steps(UserInputs, app, project.checkpoints['last_user_input'])
@@ -446,6 +457,7 @@ def delete_all_app_development_data(app):
     models = [DevelopmentSteps, CommandRuns, UserInputs, UserApps, File, FileSnapshot]
     for model in models:
         model.delete().where(model.app == app).execute()
+    delete_unused_file_blobs()
 
 
 def delete_unconnected_steps_from(step, previous_step_field_name):
@@ -473,6 +485,179 @@ def save_file_description(project, path, name, description):
      .execute())
 
 
+def save_file_snapshots(app, development_step, files):
+    """
+    Save snapshots of the project files for a development step, in a single transaction.
+
+    Files not yet in the `file` table are added (existing ones are left as they are), file
+    contents not yet in the `file_blob` table are added, and the step manifest (the blob of
+    each file) is saved with multi-row inserts (`COPY` on PostgreSQL), replacing the snapshots
+    of the same files already saved for the step.
+
+    :param app: app the files belong to
+    :param development_step: development step to save the snapshots for
+    :param files: files as returned by `get_directory_contents()`
+    """
+    if not files:
+        return
+
+    with FileSnapshot._meta.database.atomic():
+        file_rows = [
+            {'app': app, 'name': file['name'], 'path': file['path'], 'full_path': file['full_path']}
+            for file in files
+        ]
+        for batch in chunked(file_rows, INSERT_BATCH_SIZE):
+            File.insert_many(batch).on_conflict_ignore().execute()
+
+        file_ids = {
+            (path, name): file_id
+            for file_id, path, name in File.select(File.id, File.path, File.name).where(File.app == app).tuples()
+        }
+        now = datetime.now()
+        blobs = {}  # hash -> (content, file id)
+        snapshot_rows = []
+        for file in files:
+            content = file['content'].encode('utf-8') if isinstance(file['content'], str) else file['content']
+            blob_hash = FileBlob.get_hash(content)
+            file_id = file_ids[(file['path'], file['name'])]
+            blobs[blob_hash] = (content, file_id)
+            snapshot_rows.append({
+                'id': uuid4(),
+                'created_at': now,
+                'updated_at': now,
+                'app': app,
+                'development_step': development_step,
+                'file': file_id,
+                'blob': blob_hash,
+            })
+
+        # Only the contents that aren't stored yet are sent to the database
+        for batch in chunked(list(blobs), INSERT_BATCH_SIZE):
+            blobs_in_db = FileBlob.select(FileBlob.hash).where(FileBlob.hash.in_(batch)).tuples()
+            for blob_hash, in blobs_in_db:
+                del blobs[blob_hash]
+
+        previous_blobs = {}
+        if FILE_DELTA_STORAGE and blobs:
+            previous_blobs = get_previous_file_blobs(app, development_step, [file_id for _, file_id in blobs.values()])
+        blob_rows = []
+        for blob_hash, (content, file_id) in blobs.items():
+            row = {'id': uuid4(), 'created_at': now, 'updated_at': now, 'hash': blob_hash,
+                   'content': content, 'base': None, 'delta': None, 'depth': 0}
+            base = previous_blobs.get(file_id)
+            if base is not None and base.depth + 1 < FILE_DELTA_KEYFRAME_INTERVAL:
+                delta = make_delta(get_blob_bytes(base.hash), content)
+                if delta is not None and len(delta) < len(content):
+                    row.update(content=None, base=base.hash, delta=delta, depth=base.depth + 1)
+            blob_rows.append(row)
+
+        if DATABASE_TYPE == 'postgres':
+            copy_rows(FileBlob, blob_rows, [FileBlob.hash])
+            copy_rows(FileSnapshot, snapshot_rows, [FileSnapshot.development_step, FileSnapshot.file], FileSnapshot.blob)
+        else:
+            for batch in chunked(blob_rows, INSERT_BATCH_SIZE):
+                FileBlob.insert_many(batch).on_conflict_ignore().execute()
+            for batch in chunked(snapshot_rows, INSERT_BATCH_SIZE):
+                (FileSnapshot.insert_many(batch)
+                 .on_conflict(
+                    conflict_target=[FileSnapshot.development_step, FileSnapshot.file],
+                    preserve=[FileSnapshot.blob])
+                 .execute())
+
+
+def get_previous_file_blobs(app, development_step, file_ids):
+    """
+    Get the blobs the files had in the last snapshot saved before the development step.
+
+    :param app: app the files belong to
+    :param development_step: development step the snapshot is saved for
+    :param file_ids: ids of the files
+    :return: file id -> FileBlob (without the content), for the files in the previous snapshot
+    """
+    previous_step = (FileSnapshot
+                     .select(fn.MAX(FileSnapshot.development_step))
+                     .where((FileSnapshot.app == app) & (FileSnapshot.development_step < development_step))
+                     .scalar())
+    if previous_step is None:
+        return {}
+
+    previous_blobs = {}
+    for batch in chunked(file_ids, INSERT_BATCH_SIZE):
+        snapshots = (FileSnapshot
+                     .select(FileSnapshot.file, FileBlob.hash, FileBlob.depth)
+                     .join(FileBlob)
+                     .where((FileSnapshot.development_step == previous_step) & FileSnapshot.file.in_(batch)))
+        for snapshot in snapshots:
+            previous_blobs[snapshot.file_id] = snapshot.blob
+    return previous_blobs
+
+
+def copy_rows(Model, rows, conflict_target, update=None):
+    """
+    Insert rows on PostgreSQL, with `COPY` to a temporary table and from there to the
+    table (`COPY` itself can't handle conflicts).
+
+    :param Model: model of the table
+    :param rows: rows to insert, values by field name, all with the same fields
+    :param conflict_target: fields of the unique index to check for conflicts
+    :param update: field to update on conflict (default: conflicting rows are skipped)
+    """
+    if not rows:
+        return
+    fields = [Model._meta.fields[name] for name in rows[0]]
+    columns = ', '.join(f'"{field.column_name}"' for field in fields)
+    table = Model._meta.table_name
+    copy_table = f'{table}_copy'
+
+    data = io.StringIO()
+    for row in rows:
+        values = []
+        for field in fields:
+            value = row[field.name]
+            if value is None:
+                values.append('\\N')
+            elif isinstance(value, bytes):
+                # bytea in hex format, with the backslash escaped for COPY
+                values.append('\\\\x' + value.hex())
+            else:
+                # text, with the delimiters and backslashes escaped for COPY
+                value = str(field.db_value(value))
+                values.append(value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r'))
+        data.write('\t'.join(values) + '\n')
+    data.seek(0)
+
+    conflict_columns = ', '.join(f'"{field.column_name}"' for field in conflict_target)
+    if update is None:
+        on_conflict = 'DO NOTHING'
+    else:
+        on_conflict = f'DO UPDATE SET "{update.column_name}" = EXCLUDED."{update.column_name}"'
+
+    cursor = Model._meta.database.cursor()
+    cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS "{copy_table}" (LIKE "{table}") ON COMMIT DELETE ROWS')
+    cursor.execute(f'TRUNCATE "{copy_table}"')
+    cursor.copy_expert(f'COPY "{copy_table}" ({columns}) FROM STDIN', data)
+    cursor.execute(
+        f'INSERT INTO "{table}" ({columns}) SELECT {columns} FROM "{copy_table}" '
+        f'ON CONFLICT ({conflict_columns}) {on_conflict}'
+    )
+
+
+def delete_unused_file_blobs():
+    """
+    Delete the file contents no file snapshot has anymore (and no other content is a delta against).
+    """
+    DeltaBlob = FileBlob.alias()
+    while True:
+        deleted = (FileBlob
+                   .delete()
+                   .where(
+                       ~fn.EXISTS(FileSnapshot.select().where(FileSnapshot.blob == FileBlob.hash)) &
+                       ~fn.EXISTS(DeltaBlob.select(DeltaBlob.id).where(DeltaBlob.base == FileBlob.hash)))
+                   .execute())
+        if not deleted:
+            break
+
+
 def save_feature(app_id, summary, messages, previous_step):
     try:
         app = get_app(app_id)
@@ -502,6 +687,52 @@ def create_tables():
         database.create_tables(TABLES)
 
 
+def migrate_tables():
+    """
+    Update the tables created by older versions, before the missing tables are created.
+
+    File snapshots used to store the file content, now they reference the content in
+    the `file_blob` table, so each distinct content is only stored once.
+    """
+    db = FileSnapshot._meta.database
+    table = FileSnapshot._meta.table_name
+    with db.atomic():
+        if table not in db.get_tables():
+            return
+        columns = [column.name for column in db.get_columns(table)]
+        if 'content' not in columns:
+            return
+
+        logger.info('Migrating file snapshots to file blobs')
+        db.create_tables([FileBlob])
+        migrator = SchemaMigrator.from_database(db)
+        if FileSnapshot.blob.column_name not in columns:
+            # also adds the index of the foreign key
+            migrate(migrator.add_column(table, FileSnapshot.blob.column_name, FileSnapshot.blob))
+
+        while True:
+            rows = db.execute_sql(
+                f'SELECT id, content FROM "{table}" '
+                f'WHERE "{FileSnapshot.blob.column_name}" IS NULL LIMIT {INSERT_BATCH_SIZE}'
+            ).fetchall()
+            if not rows:
+                break
+            now = datetime.now()
+            hashes = {}
+            for snapshot_id, content in rows:
+                content = content.encode('utf-8') if isinstance(content, str) else bytes(content)
+                blob_hash = FileBlob.get_hash(content)
+                hashes[snapshot_id] = blob_hash
+                (FileBlob
+                 .insert(id=uuid4(), created_at=now, updated_at=now, hash=blob_hash, content=content)
+                 .on_conflict_ignore()
+                 .execute())
+            for snapshot_id, blob_hash in hashes.items():
+                FileSnapshot.update(blob=blob_hash).where(FileSnapshot.id == snapshot_id).execute()
+
+        migrate(migrator.drop_column(table, 'content'))
+
+
 def drop_tables():
     with database.atomic():
         for table in TABLES:
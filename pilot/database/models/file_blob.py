@@ -0,0 +1,189 @@
+import difflib
+import hashlib
+import json
+import logging
+import zlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional, Union
+
+from peewee import BlobField, CharField, IntegerField
+
+from database.config import FILE_BLOB_CACHE_SIZE
+from database.models.components.base_models import BaseModel
+
+log = logging.getLogger(__name__)
+
+
+class SmartBlobField(BlobField):
+    """
+    A binary blob field that can also accept/return utf-8 strings.
+
+    This is a temporary workaround for the fact that we're passing either binary
+    or string contents to the database. Once this is cleaned up, we should only
+    accept binary content and explcitily convert from/to strings as needed.
+    """
+
+    def db_value(self, value):
+        if isinstance(value, str):
+            log.warning("FileBlob content is a string, expected bytes, working around it.")
+            value = value.encode("utf-8")
+        return super().db_value(value)
+
+    def python_value(self, value):
+        if value is None:
+            return None
+        val = bytes(super().python_value(value))
+        try:
+            return val.decode("utf-8")
+        except UnicodeDecodeError:
+            return val
+
+
+def decode_content(content: bytes) -> Union[str, bytes]:
+    """
+    Decode file content the way `SmartBlobField` does: utf-8 text as a string, other content as bytes.
+    """
+    try:
+        return content.decode("utf-8")
+    except UnicodeDecodeError:
+        return content
+
+
+def make_delta(base: bytes, content: bytes) -> Optional[bytes]:
+    """
+    Make a compressed line-based delta that turns the base content into the content.
+
+    :param base: previous content of the file
+    :param content: new content of the file
+    :return: compressed delta, or None if either content isn't text
+    """
+    try:
+        base_lines = base.decode("utf-8").splitlines(keepends=True)
+        lines = content.decode("utf-8").splitlines(keepends=True)
+    except UnicodeDecodeError:
+        return None
+
+    # Operations: [start, end] copies base lines, a string inserts new text
+    operations = []
+    matcher = difflib.SequenceMatcher(None, base_lines, lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            operations.append([i1, i2])
+        elif j2 > j1:
+            operations.append("".join(lines[j1:j2]))
+    return zlib.compress(json.dumps(operations, separators=(",", ":")).encode("utf-8"))
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """
+    Rebuild content from the base content and a delta made by `make_delta()`.
+    """
+    base_lines = base.decode("utf-8").splitlines(keepends=True)
+    parts = []
+    for operation in json.loads(zlib.decompress(delta)):
+        parts.append("".join(base_lines[operation[0]:operation[1]]) if isinstance(operation, list) else operation)
+    return "".join(parts).encode("utf-8")
+
+
+class FileBlob(BaseModel):
+    """
+    File content, stored once no matter how many file snapshots have it.
+
+    The content is stored in full (a keyframe), or, with FILE_DELTA_STORAGE, as a compressed
+    delta against the previous version of the file. Chains of deltas are limited to
+    FILE_DELTA_KEYFRAME_INTERVAL, so rebuilding the content applies at most that many deltas.
+    Use `get_content()` to get the content either way.
+    """
+    hash = CharField(max_length=64, unique=True)  # see `get_hash()`, of the full content
+    content = SmartBlobField(null=True)  # full content, None for deltas
+    base = CharField(max_length=64, null=True, index=True)  # hash of the blob the delta is against
+    delta = BlobField(null=True)  # see `make_delta()`
+    depth = IntegerField(default=0)  # number of deltas from the nearest keyframe
+
+    class Meta:
+        table_name = 'file_blob'
+
+    @staticmethod
+    def get_hash(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def get_content(self) -> Union[str, bytes]:
+        if self.delta is None:
+            return self.content
+        return decode_content(get_blob_bytes(self.hash))
+
+
+class BlobCache:
+    """
+    LRU cache of blob contents by their hash, bounded by the total size of the contents.
+
+    >>> cache = BlobCache(max_size=1024)
+    >>> cache.set(blob_hash, content)
+    >>> cache.get(blob_hash)
+    """
+
+    def __init__(self, max_size: int = FILE_BLOB_CACHE_SIZE):
+        self.max_size = max_size
+        self.contents = OrderedDict()
+        self.size = 0
+        self.lock = Lock()
+
+    def get(self, blob_hash: str) -> Optional[bytes]:
+        with self.lock:
+            content = self.contents.get(blob_hash)
+            if content is not None:
+                self.contents.move_to_end(blob_hash)
+            return content
+
+    def set(self, blob_hash: str, content: bytes):
+        if len(content) > self.max_size:
+            return
+        with self.lock:
+            if blob_hash in self.contents:
+                return
+            self.contents[blob_hash] = content
+            self.size += len(content)
+            while self.size > self.max_size:
+                _, evicted = self.contents.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.contents.clear()
+            self.size = 0
+
+
+blob_cache = BlobCache()
+
+
+def get_blob_bytes(blob_hash: str) -> bytes:
+    """
+    Get the full content of a blob, rebuilt from its keyframe and deltas if needed.
+
+    The blob and its bases are read in a single (recursive) query. Blobs are content-addressed
+    (never change), so the contents are cached by their hash (see `blob_cache`).
+    """
+    content = blob_cache.get(blob_hash)
+    if content is not None:
+        return content
+
+    chain = (FileBlob
+             .select(FileBlob.hash, FileBlob.base, FileBlob.depth, FileBlob.content, FileBlob.delta)
+             .where(FileBlob.hash == blob_hash)
+             .cte('chain', recursive=True))
+    Base = FileBlob.alias()
+    chain = chain.union_all(
+        Base
+        .select(Base.hash, Base.base, Base.depth, Base.content, Base.delta)
+        .join(chain, on=(Base.hash == chain.c.base))
+    )
+    # from the keyframe to the blob
+    rows = sorted(chain.select_from(chain.c.depth, chain.c.content, chain.c.delta).tuples())
+
+    _, content, _ = rows[0]
+    content = content.encode("utf-8") if isinstance(content, str) else bytes(content)
+    for _, _, delta in rows[1:]:
+        content = apply_delta(content, bytes(delta))
+    blob_cache.set(blob_hash, content)
+    return content
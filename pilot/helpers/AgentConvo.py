@@ -1,21 +1,43 @@
+import asyncio
+import hashlib
 import json
-import re
+import os
 import subprocess
 import uuid
+import weakref
 from os.path import sep
+from typing import Optional
 
 from utils.style import color_yellow, color_yellow_bold, color_red_bold
 from database.database import save_development_step
 from helpers.exceptions import TokenLimitError, ApiError
 from utils.function_calling import parse_agent_response, FunctionCallSet
-from utils.llm_connection import create_gpt_chat_completion
+from utils.llm_connection import create_gpt_chat_completion, async_create_gpt_chat_completion, get_token_counter
+from utils.message_history import MessageHistory
+from utils.file_relevance import select_relevant_files
+from utils.token_budget import get_request_token_budget, get_file_context_budget, OTHER_FILES_NOTE_START
 from utils.utils import get_prompt, get_sys_message, capitalize_first_word_with_underscores
 from logger.logger import logger
 from prompts.prompts import ask_user
-from const.llm import END_RESPONSE
+from const.llm import END_RESPONSE, TOKENS_PER_MESSAGE, CONVO_COMPACTION_ENABLED, CONVO_COMPACTION_THRESHOLD, \
+    CONVO_COMPACTION_KEEP_TURNS, FILE_CONTEXT_RANKING, FILE_CONTEXT_MAX_FILES
 from helpers.cli import running_processes
 from utils.telemetry import telemetry
 
+# Markers of the files block in user messages, these need to EXACTLY match the formatting in `files_list.prompt`
+FILES_BLOCK_START = "\n---START_OF_FILES---\n"
+FILES_BLOCK_END = "\n---END_OF_FILES---\n"
+# Start of the message replacing the compacted turns of the conversation, see compact()
+COMPACTED_MESSAGE_START = "Here is a summary of our conversation so far:\n\n"
+
+
+class BranchName(str):
+    """
+    Name of a conversation branch, as returned by `AgentConvo.save_branch()`.
+
+    Holds the snapshot of the branch's messages, so the branch lives as long as its name is referenced.
+    """
+
 
 class AgentConvo:
     """
@@ -23,16 +45,31 @@ class AgentConvo:
 
     Args:
         agent: An instance of the agent participating in the conversation.
+        temperature: Sampling temperature of the LLM requests.
+        files_query: Text the project files sent in the conversation should be relevant to
+            (eg. the task or issue description), see `get_files_block()`.
     """
 
-    def __init__(self, agent, temperature: float = 0.7):
+    def __init__(self, agent, temperature: float = 0.7, files_query: Optional[str] = None):
         # [{'role': 'system'|'user'|'assistant', 'content': ''}, ...]
-        self.messages: list[dict] = []
-        self.branches = {}
+        self.messages = []
+        # Saved branches, unnamed ones are dropped once their name isn't referenced anymore (see save_branch())
+        self.branches = weakref.WeakValueDictionary()
+        self.named_branches = {}
         self.log_to_user = True
         self.agent = agent
         self.high_level_step = self.agent.project.current_step
         self.temperature = temperature
+        # Files block rendered from the current project files, and the files it was rendered from
+        self.files_block = None
+        self.files_block_key = None
+        # Query the files in the block were selected by, None if all the files are included
+        self.files_block_query = None
+        # Files block embedded in each user message content (None if it has none), see replace_files()
+        self.embedded_files_blocks = {}
+        self.files_query = files_query
+        # Summaries of compacted turns, by the hash of the turns (see compact())
+        self.summaries = {}
 
         # add system message
         system_message = get_sys_message(self.agent.role, self.agent.project.args)
@@ -40,6 +77,14 @@ class AgentConvo:
                     system_message['content'])
         self.messages.append(system_message)
 
+    @property
+    def messages(self) -> MessageHistory:
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages: list[dict]):
+        self._messages = messages if isinstance(messages, MessageHistory) else MessageHistory(messages)
+
     def send_message(self, prompt_path=None, prompt_data=None, function_calls: FunctionCallSet = None, should_log_message=True):
         """
         Sends a message in the conversation.
@@ -64,9 +109,10 @@ class AgentConvo:
 
         try:
             self.replace_files()
+            self.compact()
             response = create_gpt_chat_completion(self.messages, self.high_level_step, self.agent.project,
                                                   function_calls=function_calls, prompt_data=prompt_data,
-                                                  temperature=self.temperature)
+                                                  temperature=self.temperature, prompt_path=prompt_path)
         except TokenLimitError as e:
             save_development_step(self.agent.project, prompt_path, prompt_data, self.messages, {"text": ""}, str(e))
             raise e
@@ -75,6 +121,33 @@ class AgentConvo:
         if hasattr(self.agent, 'save_dev_steps') and self.agent.save_dev_steps:
             save_development_step(self.agent.project, prompt_path, prompt_data, self.messages, response)
 
+        response = self.parse_response(response, prompt_path, function_calls, self.messages)
+        message_content = self.format_message_content(response, function_calls)
+
+        # TODO we need to specify the response when there is a function called
+        # TODO maybe we can have a specific function that creates the GPT response from the function call
+        logger.info('\n>>>>>>>>>> Assistant Prompt >>>>>>>>>>\n%s\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>',
+                    message_content)
+        self.messages.append({"role": "assistant", "content": message_content})
+        if should_log_message:
+            self.log_message(message_content)
+
+        if self.agent.project.check_ipc():
+            telemetry.output_project_stats()
+        return response
+
+    def parse_response(self, response, prompt_path, function_calls, messages):
+        """
+        Checks the raw LLM response and parses it according to the requested function calls.
+
+        Args:
+            response: Raw response returned by `create_gpt_chat_completion()`.
+            prompt_path: The path to the prompt the response is for.
+            function_calls: Optional function calls that were included in the request.
+            messages: Messages that were sent in the request.
+        Returns:
+            The parsed response.
+        """
         # TODO handle errors from OpenAI
         # It's complicated because calling functions are expecting different types of responses - string or tuple
         # https://github.com/Pythagora-io/gpt-pilot/issues/165 & #91
@@ -83,29 +156,75 @@ class AgentConvo:
             # Leaving this in place in case there's a case where this can still happen
             logger.error('Aborting with "OpenAI API error happened"')
             print(color_red_bold('There was an error talking to OpenAI API. Please try again later.'))
-            payload_size_kb = len(json.dumps(self.messages)) // 1000
+            payload_size_kb = len(json.dumps(messages)) // 1000
             raise ApiError(f"Unknown API error (prompt: {prompt_path}, request size: {payload_size_kb}KB)")
 
         try:
-            response = parse_agent_response(response, function_calls)
+            return parse_agent_response(response, function_calls)
         except (KeyError, json.JSONDecodeError) as err:
             logger.error("Error while parsing LLM response: {err.__class__.__name__}: {err}")
             print(color_red_bold(f'There was an error parsing LLM response: \"{err.__class__.__name__}: {err}\". Please try again later.'))
             raise ApiError(f"Error parsing LLM response: {err.__class__.__name__}: {err}: Response text: {response}") from err
 
-        message_content = self.format_message_content(response, function_calls)
+    async def async_send_message(self, prompt_path=None, prompt_data=None, function_calls: FunctionCallSet = None):
+        """
+        Sends an independent message on a branch of the conversation.
 
-        # TODO we need to specify the response when there is a function called
-        # TODO maybe we can have a specific function that creates the GPT response from the function call
-        logger.info('\n>>>>>>>>>> Assistant Prompt >>>>>>>>>>\n%s\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>',
-                    message_content)
-        self.messages.append({"role": "assistant", "content": message_content})
-        if should_log_message:
-            self.log_message(message_content)
+        The message is sent with the current conversation as context, but neither the
+        message nor the response are added to the conversation (or saved as a development
+        step), so several of these can be awaited concurrently.
 
-        if self.agent.project.check_ipc():
-            telemetry.output_project_stats()
-        return response
+        Args:
+            prompt_path: The path to a prompt.
+            prompt_data: Data associated with the prompt.
+            function_calls: Optional function calls to be included in the message.
+        Returns:
+            The response from the agent.
+        """
+        messages, response = await self._async_request(prompt_path, prompt_data, function_calls)
+        return self.parse_response(response, prompt_path, function_calls, messages)
+
+    async def _async_request(self, prompt_path, prompt_data, function_calls):
+        messages = self.messages.copy()
+        if prompt_path is not None and prompt_data is not None:
+            messages.append({"role": "user", "content": get_prompt(prompt_path, prompt_data)})
+
+        response = await async_create_gpt_chat_completion(messages, self.high_level_step, self.agent.project,
+                                                          function_calls=function_calls, prompt_data=prompt_data,
+                                                          temperature=self.temperature, prompt_path=prompt_path)
+        return messages, response
+
+    def send_messages_concurrently(self, requests: list[dict]) -> list:
+        """
+        Sends several independent messages concurrently (see `async_send_message()`).
+
+        Development steps are saved in the order of the requests once all of them finish.
+
+        Args:
+            requests: [{'prompt_path': str, 'prompt_data': dict, 'function_calls': FunctionCallSet}, ...]
+        Returns:
+            List of responses from the agent, in the same order as requests.
+        """
+        self.agent.project.finish_loading()
+        self.replace_files()
+        self.compact()
+
+        async def gather():
+            return await asyncio.gather(*[
+                self._async_request(request.get('prompt_path'), request.get('prompt_data'),
+                                    request.get('function_calls'))
+                for request in requests
+            ])
+
+        responses = []
+        for request, (messages, response) in zip(requests, asyncio.run(gather())):
+            prompt_path = request.get('prompt_path')
+            if hasattr(self.agent, 'save_dev_steps') and self.agent.save_dev_steps:
+                self.agent.project.llm_req_num += 1
+                save_development_step(self.agent.project, prompt_path, request.get('prompt_data'), messages, response)
+            responses.append(self.parse_response(response, prompt_path, request.get('function_calls'), messages))
+
+        return responses
 
     def format_message_content(self, response, function_calls):
         # TODO remove this once the database is set up properly
@@ -167,40 +286,248 @@ class AgentConvo:
         return accepted_messages
 
     def save_branch(self, branch_name=None):
-        if branch_name is None:
-            branch_name = str(uuid.uuid4())
-        self.branches[branch_name] = self.messages.copy()
-        return branch_name
+        """
+        Saves the current messages as a branch that can be loaded later.
+
+        Saving is O(1), as branches share the messages they have in common. Branches
+        saved without a name are freed once the returned name isn't referenced
+        anymore (nobody can load them then), named ones are kept until `delete_branch()`.
+
+        Args:
+            branch_name: Optional name of the branch.
+        Returns:
+            The name of the branch.
+        """
+        branch = BranchName(branch_name if branch_name is not None else uuid.uuid4())
+        branch.snapshot = self.messages.snapshot()
+        self.branches[str(branch)] = branch
+        if branch_name is not None:
+            self.named_branches[str(branch)] = branch
+        return branch
 
     def load_branch(self, branch_name, reload_files=True):
-        self.messages = self.branches[branch_name].copy()
+        """
+        Restores the messages saved in a branch.
+
+        Only the messages added since the branch was saved are removed, unless the
+        conversation went back before the branch point in the meantime.
+
+        Args:
+            branch_name: Name of the branch, as returned by `save_branch()`.
+            reload_files: Update the files in the messages to their current content.
+        """
+        self.messages.restore(self.branches[branch_name].snapshot)
         if reload_files:
             # TODO make this more flexible - with every message, save metadata so every time we load a branch, reconstruct all messages from scratch
             self.replace_files()
 
+    def delete_branch(self, branch_name):
+        """
+        Deletes a saved branch.
+        """
+        self.branches.pop(branch_name, None)
+        self.named_branches.pop(branch_name, None)
+
     def replace_files(self):
-        files = self.agent.project.get_all_coded_files()
+        """
+        Updates the files blocks in user messages to the current content of all coded files.
+
+        If the files don't fit in the file context budget, only the ones most relevant to
+        `files_query` are included, the others are listed by path (see `get_files_block()`).
+
+        The files block is only rendered again when the project files change, and only
+        the messages embedding an outdated files block are rewritten.
+        """
+        files_block = self.get_files_block(self.agent.project.get_all_coded_files(), self.files_query)
+
+        embedded_files_blocks = {}
         for msg in self.messages:
-            if msg['role'] == 'user':
-                new_content = self.replace_files_in_one_message(files, msg["content"])
-                if new_content != msg["content"]:
-                    msg["content"] = new_content
+            if msg['role'] != 'user':
+                continue
+            content = msg['content']
+            if content in self.embedded_files_blocks:
+                embedded_block = self.embedded_files_blocks[content]
+            else:
+                # new message, rewrite it if it has a files block
+                embedded_block = '' if FILES_BLOCK_START in content else None
+
+            if embedded_block is not None and embedded_block != files_block:
+                content = self.replace_files_blocks(content, files_block)
+                msg['content'] = content
+                embedded_block = files_block
+            embedded_files_blocks[content] = embedded_block
+
+        self.embedded_files_blocks = embedded_files_blocks
+
+    def get_files_block(self, files, query=None) -> str:
+        """
+        Gets the files block for the files, memoized while the files and the query don't change.
 
-    def replace_files_in_one_message(self, files, message):
+        If the files don't fit in FILE_CONTEXT_MAX_TOKENS or there are more than
+        FILE_CONTEXT_MAX_FILES of them, only the files most relevant to the query are
+        included with their content, the others are listed by path only.
+
+        Args:
+            files: Files with content, as returned by `Project.get_all_coded_files()`.
+            query: Text the files should be relevant to (eg. the task description).
+        Returns:
+            The rendered files block.
+        """
+        # Unchanged files are cached by the project, so comparing contents is mostly comparing identities
+        files_block_key = tuple((file['path'], file['name'], file['lines_of_code'], file['content']) for file in files)
+        # The query only matters if some files were left out
+        if files_block_key != self.files_block_key or \
+                (self.files_block_query is not None and query != self.files_block_query):
+            other_files = []
+            if FILE_CONTEXT_RANKING and query:
+                files, other_files = select_relevant_files(
+                    self.agent.project.file_index, files, query, get_token_counter().count,
+                    max_tokens=get_file_context_budget(os.getenv('MODEL_NAME', 'gpt-4')),
+                    max_files=FILE_CONTEXT_MAX_FILES or None,
+                )
+                if other_files:
+                    logger.info(f'Files block: {len(files)} most relevant files included, '
+                                f'{len(other_files)} listed by path only')
+            self.files_block = self.render_files_block(files, other_files)
+            self.files_block_key = files_block_key
+            self.files_block_query = query if other_files else None
+        return self.files_block
+
+    @staticmethod
+    def render_files_block(files, other_files=()) -> str:
         # This needs to EXACTLY match the formatting in `files_list.prompt`
         replacement_lines = ["\n---START_OF_FILES---"]
         for file in files:
             path = f"{file['path']}{sep}{file['name']}"
             content = file['content']
             replacement_lines.append(f"**{path}** ({ file['lines_of_code'] } lines of code):\n```\n{content}\n```\n")
+        if other_files:
+            paths = ', '.join(f"{file['path']}{sep}{file['name']}" for file in other_files)
+            replacement_lines.append(f"{OTHER_FILES_NOTE_START}{paths})\n")
         replacement_lines.append("---END_OF_FILES---\n")
-        replacement = "\n".join(replacement_lines)
+        return "\n".join(replacement_lines)
 
-        def replace_cb(_m):
-            return replacement
+    @staticmethod
+    def replace_files_blocks(message: str, files_block: str) -> str:
+        """
+        Replaces all files blocks in the message with the given files block.
+        """
+        parts = []
+        position = 0
+        while True:
+            start = message.find(FILES_BLOCK_START, position)
+            if start == -1:
+                break
+            end = message.find(FILES_BLOCK_END, start + len(FILES_BLOCK_START))
+            if end == -1:
+                break
+            parts.append(message[position:start])
+            parts.append(files_block)
+            position = end + len(FILES_BLOCK_END)
+
+        if not parts:
+            return message
+        parts.append(message[position:])
+        return "".join(parts)
+
+    def replace_files_in_one_message(self, files, message):
+        return self.replace_files_blocks(message, self.render_files_block(files))
+
+    def compact(self):
+        """
+        Compacts the conversation if it's getting close to the model's context window.
+
+        Once the messages take more than CONVO_COMPACTION_THRESHOLD of the request token
+        budget, the turns (user messages and the assistant's response to them) before the
+        latest CONVO_COMPACTION_KEEP_TURNS are replaced with their summary, at the start of the
+        first kept user message. System messages at the start of the conversation are always kept.
+
+        Compaction is off unless enabled with CONVO_COMPACTION, as it adds summary requests and
+        changes what the LLM sees of the conversation.
+
+        The summary is requested from the LLM once per compacted turns and cached, so going
+        back to a branch saved before compaction doesn't summarize the same turns again.
+        If the summary request fails, the conversation is left as is.
+        """
+        if not CONVO_COMPACTION_ENABLED:
+            return
+
+        token_budget = get_request_token_budget(os.getenv('MODEL_NAME', 'gpt-4'))
+        n_tokens = get_token_counter().count_messages(self.messages) + TOKENS_PER_MESSAGE * len(self.messages)
+        if n_tokens <= token_budget * CONVO_COMPACTION_THRESHOLD:
+            return
+
+        start = 0
+        while start < len(self.messages) and self.messages[start]['role'] == 'system':
+            start += 1
+        turn_starts = [
+            i for i in range(start, len(self.messages))
+            if self.messages[i]['role'] == 'user' and (i == start or self.messages[i - 1]['role'] != 'user')
+        ]
+        if len(turn_starts) <= CONVO_COMPACTION_KEEP_TURNS:
+            return
+        end = turn_starts[-CONVO_COMPACTION_KEEP_TURNS] if CONVO_COMPACTION_KEEP_TURNS > 0 else len(self.messages)
+
+        compacted = self.messages[start:end]
+        summary = self.get_summary(compacted)
+        if summary is None:
+            return
+
+        content = COMPACTED_MESSAGE_START + summary
+        embedded_block = None
+        # Keep the project files in the conversation if they were only in the compacted turns
+        if any(FILES_BLOCK_START in msg['content'] for msg in compacted if msg['role'] == 'user') and \
+                not any(FILES_BLOCK_START in msg['content'] for msg in self.messages[end:] if msg['role'] == 'user'):
+            embedded_block = self.get_files_block(self.agent.project.get_all_coded_files(), self.files_query)
+            content += f"\n\nThese are the current project files:\n{embedded_block}"
+
+        if end < len(self.messages):
+            # The summary goes at the start of the first kept user message, so user and
+            # assistant messages keep alternating
+            kept_message = self.messages[end]
+            embedded_block = self.embedded_files_blocks.get(kept_message['content'], embedded_block)
+            content += "\n\n" + kept_message['content']
+            self.messages[start:end + 1] = [{**kept_message, "content": content}]
+        else:
+            self.messages[start:end] = [{"role": "user", "content": content}]
+        if embedded_block is not None:
+            self.embedded_files_blocks[content] = embedded_block
+        telemetry.inc("num_convo_compactions")
+        logger.info(f'Compacted {len(compacted)} messages ({n_tokens} tokens in the conversation, '
+                    f'budget: {token_budget} tokens)')
+
+    def get_summary(self, messages):
+        """
+        Gets the summary of the messages, memoized by their content.
+
+        Args:
+            messages: Messages to summarize.
+        Returns:
+            The summary, or None if it couldn't be created.
+        """
+        key = hashlib.blake2b(json.dumps([[msg['role'], msg['content']] for msg in messages]).encode('utf-8'),
+                              digest_size=16).digest()
+        if key in self.summaries:
+            return self.summaries[key]
+
+        # The files change anyway, the summary shouldn't be about their (old) content
+        conversation = "\n\n".join(
+            f"{msg['role'].upper()}: {self.replace_files_blocks(msg['content'], ' (project files) ')}"
+            for msg in messages
+        )
+        prompt_path = 'utils/compact_conversation.prompt'
+        summary_messages = [{"role": "user", "content": get_prompt(prompt_path, {'conversation': conversation})}]
+        try:
+            response = create_gpt_chat_completion(summary_messages, self.high_level_step, self.agent.project,
+                                                  temperature=0, prompt_path=prompt_path)
+        except (TokenLimitError, ApiError) as err:
+            logger.warning(f'Error compacting the conversation: {err}')
+            return None
+        if not response or not response.get('text'):
+            return None
 
-        pattern = r"\n---START_OF_FILES---\n(.*?)\n---END_OF_FILES---\n"
-        return re.sub(pattern, replace_cb, message, flags=re.MULTILINE|re.DOTALL)
+        self.summaries[key] = response['text'].strip()
+        return self.summaries[key]
 
     @staticmethod
     def escape_specials(s):
@@ -265,7 +592,7 @@ class AgentConvo:
 
     def remove_last_x_messages(self, x):
         logger.info('removing last %d messages: %s', x, self.messages[-x:])
-        self.messages = self.messages[:-x]
+        del self.messages[-x:]
 
     def construct_and_add_message_from_prompt(self, prompt_path, prompt_data):
         if prompt_path is not None and prompt_data is not None:
@@ -1,5 +1,4 @@
 import platform
-import uuid
 import re
 import traceback
 
@@ -47,8 +46,7 @@ class Debugger:
             # it does not retry initial step but instead calls dev_help_needed()
             raise TooDeepRecursionError()
 
-        function_uuid = str(uuid.uuid4())
-        convo.save_branch(function_uuid)
+        function_uuid = convo.save_branch()
         success = False
 
         for i in range(MAX_COMMAND_DEBUG_TRIES):
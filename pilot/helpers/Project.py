@@ -4,13 +4,12 @@ from pathlib import Path
 from typing import Tuple
 
 import peewee
-from playhouse.shortcuts import model_to_dict
 
 from const.messages import CHECK_AND_CONTINUE, AFFIRMATIVE_ANSWERS, NEGATIVE_ANSWERS, STUCK_IN_LOOP
 from utils.style import color_yellow_bold, color_cyan, color_white_bold, color_red_bold
 from const.common import STEPS
 from database.database import delete_unconnected_steps_from, delete_all_app_development_data, \
-    get_all_app_development_steps, delete_all_subsequent_steps, get_features_by_app_id
+    get_all_app_development_steps, delete_all_subsequent_steps, get_features_by_app_id, save_file_snapshots
 from const.ipc import MESSAGE_TYPE
 from prompts.prompts import ask_user
 from helpers.exceptions import TokenLimitError, GracefulExit
@@ -25,10 +24,13 @@ from helpers.agents.TechnicalWriter import TechnicalWriter
 from helpers.agents.SpecWriter import SpecWriter
 
 from database.models.development_steps import DevelopmentSteps
+from database.models.file_blob import FileBlob
 from database.models.file_snapshot import FileSnapshot
 from database.models.files import File
 from logger.logger import logger
 from utils.dot_gpt_pilot import DotGptPilot
+from utils.file_relevance import FileIndex
+from utils.file_resolver import SymbolIndex
 from utils.llm_connection import test_api_access
 from utils.ignore import IgnoreMatcher
 
@@ -73,6 +75,12 @@ class Project:
         self.skip_steps = False
         self.main_prompt = None
         self.files = []
+        # File contents read from disk, by full path: ((mtime, size), file data), see get_cached_file_contents()
+        self.file_contents_cache = {}
+        # Relevance and symbol indexes of the coded files, see AgentConvo.get_files_block() and
+        # CodeMonkey.identify_file_to_change()
+        self.file_index = FileIndex()
+        self.symbol_index = SymbolIndex()
         self.continuing_project = args.get('continuing_project', False)
 
         self.ipc_client_instance = ipc_client_instance
@@ -317,15 +325,33 @@ class Project:
         if step_id is None:
             return []
 
-        file_snapshots = FileSnapshot.select().where(FileSnapshot.development_step_id == step_id)
+        file_snapshots = self.get_file_snapshots(FileSnapshot.development_step_id == step_id)
 
         return [{
-            "name": item['file']['name'],
-            "path": item['file']['path'],
-            "full_path": item['file']['full_path'],
-            'content': item['content'],
-            "lines_of_code": len(item['content'].splitlines()),
-        } for item in [model_to_dict(file) for file in file_snapshots]]
+            "name": file_snapshot.file.name,
+            "path": file_snapshot.file.path,
+            "full_path": file_snapshot.file.full_path,
+            'content': file_snapshot.content,
+            "lines_of_code": len(file_snapshot.content.splitlines()),
+        } for file_snapshot in file_snapshots]
+
+    @staticmethod
+    def get_file_snapshots(condition):
+        """
+        Get file snapshots with their files and contents (in a single query).
+
+        Args:
+            condition: Query condition, e.g. `FileSnapshot.development_step == step`.
+
+        Returns:
+            peewee.ModelSelect: File snapshots.
+        """
+        return (FileSnapshot
+                .select(FileSnapshot, File, FileBlob)
+                .join(File)
+                .switch(FileSnapshot)
+                .join(FileBlob)
+                .where(condition))
 
     def get_all_coded_files(self):
         """
@@ -361,7 +387,7 @@ class Project:
             try:
                 # TODO path is sometimes relative and sometimes absolute - fix at one point
                 _, full_path = self.get_full_file_path(file_path, file_path)
-                file_data = get_file_contents(full_path, self.root_path)
+                file_data = self.get_cached_file_contents(full_path)
             except ValueError:
                 full_path = None
                 file_data = {"path": file_path, "name": os.path.basename(file_path), "content": ''}
@@ -371,6 +397,30 @@ class Project:
 
         return files_with_content
 
+    def get_cached_file_contents(self, full_path: str) -> dict:
+        """
+        Get file content and metadata (see `get_file_contents()`), only reading
+        the file again if its modification time or size changed since the last read.
+
+        Args:
+            full_path (str): Full path to the file.
+
+        Returns:
+            dict: File data, a copy callers may modify.
+        """
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            self.file_contents_cache.pop(full_path, None)
+            return get_file_contents(full_path, self.root_path)
+
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self.file_contents_cache.get(full_path)
+        if cached is None or cached[0] != signature:
+            cached = (signature, get_file_contents(full_path, self.root_path))
+            self.file_contents_cache[full_path] = cached
+        return dict(cached[1])
+
     def find_input_required_lines(self, file_content):
         """
         Parses the provided string (representing file content) and returns a list of tuples containing
@@ -401,6 +451,9 @@ class Project:
 
         path, full_path = self.get_full_file_path(path, name)
         update_file(full_path, data['content'], project=self)
+        self.file_contents_cache.pop(full_path, None)
+        self.file_index.update(full_path, os.path.join(path, name), data['content'])
+        self.symbol_index.update(full_path, name, data['content'])
         if full_path not in self.files:
             self.files.append(full_path)
 
@@ -539,34 +592,21 @@ class Project:
         for file in files:
             if not self.check_ipc():
                 print(color_cyan(f'Saving file {file["full_path"]}'))
-            # TODO this can be optimized so we don't go to the db each time
-            file_in_db, created = File.get_or_create(
-                app=self.app,
-                name=file['name'],
-                path=file['path'],
-                defaults={'full_path': file['full_path']},
-            )
-
-            file_snapshot, created = FileSnapshot.get_or_create(
-                app=self.app,
-                development_step=development_step,
-                file=file_in_db,
-                defaults={'content': file.get('content', '')}
-            )
-            file_snapshot.content = file['content']
-            file_snapshot.save()
             total_files += 1
             if isinstance(file['content'], str):
                 total_lines += file['content'].count('\n') + 1
 
+        save_file_snapshots(self.app, development_step, files)
+
         telemetry.set("num_files", total_files)
         telemetry.set("num_lines", total_lines)
 
     def restore_files(self, development_step_id):
         development_step = DevelopmentSteps.get(DevelopmentSteps.id == development_step_id)
-        file_snapshots = FileSnapshot.select().where(FileSnapshot.development_step == development_step)
+        file_snapshots = self.get_file_snapshots(FileSnapshot.development_step == development_step)
 
         clear_directory(self.root_path, ignore=self.files)
+        self.file_contents_cache = {}
         for file_snapshot in file_snapshots:
             try:
                 update_file(file_snapshot.file.full_path, file_snapshot.content, project=self)
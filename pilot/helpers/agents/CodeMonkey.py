@@ -1,5 +1,6 @@
 import os.path
 import re
+import time
 from typing import Optional
 from traceback import format_exc
 from difflib import unified_diff
@@ -8,9 +9,11 @@ from helpers.AgentConvo import AgentConvo
 from helpers.Agent import Agent
 from helpers.files import get_file_contents
 from const.function_calls import GET_FILE_TO_MODIFY, REVIEW_CHANGES
+from const.llm import FILE_RESOLVER_ENABLED, FILE_RESOLVER_MIN_CONFIDENCE
 from logger.logger import logger
 
 from utils.exit import trace_code_event
+from utils.file_resolver import resolve_file
 from utils.telemetry import telemetry
 
 # Constant for indicating missing new line at the end of a file in a unified diff
@@ -183,15 +186,30 @@ class CodeMonkey(Agent):
         """
         Identify file to change based on the code changes description
 
+        The file is looked up locally first (see `utils.file_resolver.resolve_file()`),
+        the LLM is only asked if that isn't confident enough.
+
         :param code_changes_description: description of the code changes
         :param files: list of files to send to the LLM
         :return: file to change
         """
+        start_time = time.time()
+        if FILE_RESOLVER_ENABLED:
+            resolution = resolve_file(code_changes_description, files, self.project.file_index,
+                                      self.project.symbol_index)
+            if resolution.path is not None and resolution.confidence >= FILE_RESOLVER_MIN_CONFIDENCE:
+                logger.info(f'File to change resolved locally: {resolution}')
+                telemetry.record_file_resolution(True, time.time() - start_time)
+                return resolution.path
+            logger.info(f'File to change not resolved locally, asking the LLM: {resolution}')
+
         convo = AgentConvo(self)
         llm_response = convo.send_message('development/identify_files_to_change.prompt', {
             "code_changes_description": code_changes_description,
             "files": files,
         }, GET_FILE_TO_MODIFY)
+        if FILE_RESOLVER_ENABLED:
+            telemetry.record_file_resolution(False, time.time() - start_time)
         return llm_response["file"]
 
     def review_change(
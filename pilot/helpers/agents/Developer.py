@@ -1,5 +1,4 @@
 import platform
-import uuid
 import re
 import json
 
@@ -126,7 +125,7 @@ class Developer(Agent):
         print(f'Starting task #{i + 1} implementation...', type='verbose', category='agent:developer')
         self.project.dot_pilot_gpt.chat_log_folder(i + 1)
 
-        convo_dev_task = AgentConvo(self)
+        convo_dev_task = AgentConvo(self, files_query=development_task['description'])
         # we get here only after all tasks but last one are loaded, so this must be final task
         if self.project.dev_steps_to_load and 'breakdown.prompt' in self.project.dev_steps_to_load[0]['prompt_path']:
             instructions = self.project.dev_steps_to_load[0]['llm_response']['text']
@@ -497,8 +496,7 @@ class Developer(Agent):
 
         :return: The result of the task execution.
         """
-        function_uuid = str(uuid.uuid4())
-        convo.save_branch(function_uuid)
+        function_uuid = convo.save_branch()
         agent_map = {
             'app': 'agent:developer',
             'feature': 'agent:developer',
@@ -673,7 +671,9 @@ class Developer(Agent):
                     user_feedback, user_feedback_qa = self.bug_report_generator(user_feedback, user_description)
 
                 print_task_progress(1, 1, development_task['description'], 'troubleshooting', 'in_progress', len(llm_solutions) + 1)
-                iteration_convo = AgentConvo(self)
+                iteration_convo = AgentConvo(self, files_query="\n".join(filter(None, [
+                    development_task['description'], user_feedback, next_solution_to_try
+                ])))
                 iteration_description = iteration_convo.send_message('development/iteration.prompt', {
                     "name": self.project.args['name'],
                     "app_type": self.project.args['app_type'],
@@ -725,9 +725,7 @@ class Developer(Agent):
         :param task_review_description: The task review description.
         :return: The user feedback and the questions and answers.
         """
-        bug_report_convo = AgentConvo(self)
-        function_uuid = str(uuid.uuid4())
-        bug_report_convo.save_branch(function_uuid)
+        bug_report_convo = AgentConvo(self, files_query="\n".join(filter(None, [user_feedback, task_review_description])))
         questions_and_answers = []
 
         llm_response = bug_report_convo.send_message('development/bug_report.prompt', {
@@ -962,7 +960,7 @@ class Developer(Agent):
         pass
 
     def get_alternative_solutions(self, development_task, user_feedback, previous_solutions, tried_alternative_solutions_to_current_issue):
-        convo = AgentConvo(self)
+        convo = AgentConvo(self, files_query="\n".join(filter(None, [development_task['description'], user_feedback])))
         response = convo.send_message('development/get_alternative_solutions.prompt', {
             "name": self.project.args['name'],
             "app_type": self.project.args['app_type'],
@@ -0,0 +1,44 @@
+import builtins
+from unittest.mock import patch
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from main import get_custom_print
+from helpers.agents.CodeMonkey import CodeMonkey
+from helpers.test_Project import create_project
+
+FILES = [
+    {'path': 'routes', 'name': 'users.js', 'full_path': '/app/routes/users.js', 'lines_of_code': 1,
+     'content': 'router.post("/login", login);'},
+    {'path': '', 'name': 'server.js', 'full_path': '/app/server.js', 'lines_of_code': 1,
+     'content': 'app.listen(3000);'},
+]
+
+
+class TestCodeMonkey:
+    def setup_method(self):
+        builtins.print, ipc_client_instance = get_custom_print({})
+        self.project = create_project()
+        self.project.get_all_coded_files = lambda: FILES
+        self.code_monkey = CodeMonkey(self.project)
+
+    @patch('helpers.agents.CodeMonkey.telemetry')
+    @patch('helpers.AgentConvo.create_gpt_chat_completion')
+    def test_identify_file_to_change_locally(self, mock_completion, mock_telemetry):
+        file = self.code_monkey.identify_file_to_change('Return 401 from the /login route on bad password', FILES)
+
+        assert file == 'routes/users.js'
+        mock_completion.assert_not_called()
+        mock_telemetry.record_file_resolution.assert_called_once()
+        assert mock_telemetry.record_file_resolution.call_args.args[0] is True
+
+    @patch('helpers.agents.CodeMonkey.telemetry')
+    @patch('helpers.AgentConvo.save_development_step')
+    @patch('helpers.AgentConvo.create_gpt_chat_completion', return_value={'text': '{"file": "utils/auth.js"}'})
+    def test_identify_file_to_change_falls_back_to_llm(self, mock_completion, mock_save, mock_telemetry):
+        file = self.code_monkey.identify_file_to_change('Create utils/auth.js with the JWT helpers', FILES)
+
+        assert file == 'utils/auth.js'
+        mock_completion.assert_called_once()
+        assert mock_telemetry.record_file_resolution.call_args.args[0] is False
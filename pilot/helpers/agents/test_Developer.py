@@ -174,7 +174,7 @@ class TestDeveloper:
 
     @patch('helpers.cli.execute_command', return_value=('stdout:\n```\n\n```', 'DONE', None))
     @patch('helpers.AgentConvo.save_development_step')
-    @patch('utils.llm_connection.requests.post')
+    @patch('utils.llm_connection.llm_transport.post')
     def test_test_code_changes_invalid_json(self,
                                             mock_requests_post,
                                             mock_save,
@@ -207,7 +207,7 @@ class TestDeveloper:
 
             response = requests.Response()
             response.status_code = 200
-            response.iter_lines = lambda: [line]
+            response.iter_content = lambda chunk_size: [line]
             print(f'##### mock response: {response}')
             return response
 
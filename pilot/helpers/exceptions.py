@@ -9,6 +9,12 @@ class ApiKeyNotDefinedError(Exception):
         super().__init__(f"API Key has not been configured: {env_key}")
 
 
+class InvalidLLMEndpointsError(Exception):
+    def __init__(self, reason: str):
+        self.reason = reason
+        super().__init__(f"Invalid LLM_ENDPOINTS configuration: {reason}")
+
+
 class CommandFinishedEarly(Exception):
     def __init__(self, message='Command finished before timeout. Handling early completion...'):
         self.message = message
@@ -29,9 +35,10 @@ class TooDeepRecursionError(Exception):
 
 
 class ApiError(Exception):
-    def __init__(self, message, response=None):
+    def __init__(self, message, response=None, endpoint=None):
         self.message = message
         self.response = response
+        self.endpoint = endpoint
         self.response_json = None
         if response and hasattr(response, "text"):
             try:
@@ -46,3 +53,17 @@ class GracefulExit(Exception):
     def __init__(self, message='Graceful exit'):
         self.message = message
         super().__init__(message)
+
+
+class NoScriptedAnswerError(Exception):
+    def __init__(self, question: str):
+        self.question = question
+        super().__init__(f"No scripted answer for question in headless mode: {question}")
+
+
+class InvalidScriptedAnswerError(Exception):
+    def __init__(self, question: str, answer: str, choices: list):
+        self.question = question
+        self.answer = answer
+        self.choices = choices
+        super().__init__(f"Scripted answer {answer!r} is not one of the choices {choices} for question: {question}")
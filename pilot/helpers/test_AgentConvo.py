@@ -1,10 +1,18 @@
 import builtins
+import copy
 import os.path
+import sys
+import time
+import tracemalloc
+from unittest.mock import patch
+import pytest
 from dotenv import load_dotenv
 from database.database import database
 from const.function_calls import IMPLEMENT_TASK
 from helpers.agents.Developer import Developer
+from helpers.exceptions import ApiError
 from helpers.AgentConvo import AgentConvo
+from logger.logger import logger
 from utils.custom_print import get_custom_print
 from .test_Project import create_project
 
@@ -64,3 +72,334 @@ builtins.print, ipc_client_instance = get_custom_print({})
 #     "nodemon": "^3.0.1"
 #   }
 # }'''.lstrip()
+
+
+@patch('helpers.AgentConvo.save_development_step')
+@patch('helpers.AgentConvo.async_create_gpt_chat_completion')
+def test_send_messages_concurrently(mock_completion, mock_save):
+    # Given a conversation with a system message
+    project = create_project()
+    developer = Developer(project)
+    convo = AgentConvo(developer)
+    convo.replace_files = lambda: None
+    initial_messages = convo.messages.copy()
+
+    async def completion(messages, *args, **kwargs):
+        return {'text': f'response to {messages[-1]["content"]}'}
+
+    mock_completion.side_effect = completion
+
+    # When
+    responses = convo.send_messages_concurrently([
+        {'prompt_path': 'utils/python_string.prompt', 'prompt_data': {'content': 'one'}},
+        {'prompt_path': 'utils/python_string.prompt', 'prompt_data': {'content': 'two'}},
+    ])
+
+    # Then the responses are in the order of the requests
+    assert len(responses) == 2
+    assert 'one' in responses[0] and 'two' in responses[1]
+    # And each request was branched off the conversation without modifying it
+    assert convo.messages == initial_messages
+    assert [len(c.args[0]) for c in mock_completion.call_args_list] == [2, 2]
+    # And both development steps were saved, in order
+    assert mock_save.call_count == 2
+
+
+def test_replace_files_blocks():
+    files_block = '\n---START_OF_FILES---\nnew\n---END_OF_FILES---\n'
+    message = ('Before\n---START_OF_FILES---\nold 1\n---END_OF_FILES---\nbetween'
+               '\n---START_OF_FILES---\nold 2\n---END_OF_FILES---\nafter\n---START_OF_FILES---\nunterminated')
+
+    assert AgentConvo.replace_files_blocks(message, files_block) == (
+        f'Before{files_block}between{files_block}after\n---START_OF_FILES---\nunterminated'
+    )
+    assert AgentConvo.replace_files_blocks('No files', files_block) == 'No files'
+
+
+def test_replace_files_only_rewrites_outdated_messages():
+    # Given a conversation with two messages embedding the project files
+    project = create_project()
+    files = [{'path': '', 'name': 'main.py', 'content': 'print("v1")', 'lines_of_code': 1}]
+    project.get_all_coded_files = lambda: [dict(file) for file in files]
+    convo = AgentConvo(Developer(project))
+    old_block = '\n---START_OF_FILES---\nold\n---END_OF_FILES---\n'
+    convo.messages.append({'role': 'user', 'content': f'First{old_block}'})
+    convo.messages.append({'role': 'assistant', 'content': f'Not replaced{old_block}'})
+    convo.messages.append({'role': 'user', 'content': 'No files'})
+
+    # When the files are replaced
+    convo.replace_files()
+
+    # Then the user messages embed the current files
+    assert 'print("v1")' in convo.messages[1]['content']
+    assert convo.messages[2]['content'] == f'Not replaced{old_block}'
+    assert convo.messages[3]['content'] == 'No files'
+
+    # And nothing is rendered or rewritten again while the files don't change
+    convo.messages.append({'role': 'user', 'content': f'Second{old_block}'})
+    first_message = convo.messages[1]['content']
+    with patch.object(AgentConvo, 'render_files_block', wraps=AgentConvo.render_files_block) as mock_render:
+        convo.replace_files()
+        mock_render.assert_not_called()
+    assert convo.messages[1]['content'] is first_message
+    assert 'print("v1")' in convo.messages[4]['content']
+
+    # But all files blocks are updated once the files change
+    files[0]['content'] = 'print("v2")'
+    convo.replace_files()
+    assert 'print("v2")' in convo.messages[1]['content'] and 'print("v2")' in convo.messages[4]['content']
+    assert 'print("v1")' not in convo.messages[1]['content'] + convo.messages[4]['content']
+
+
+def test_branches_are_restored_and_reclaimed():
+    # Given a conversation with a saved branch
+    project = create_project()
+    convo = AgentConvo(Developer(project))
+    convo.replace_files = lambda: None
+    convo.messages.append({'role': 'user', 'content': 'Hello'})
+    branch = convo.save_branch()
+    named_branch = convo.save_branch('named')
+
+    # When the conversation continues and the branch is loaded
+    convo.messages.append({'role': 'assistant', 'content': 'Hi'})
+    nested_branch = convo.save_branch()
+    convo.messages.append({'role': 'user', 'content': 'Bye'})
+    convo.load_branch(branch)
+
+    # Then the messages since the branch was saved are removed
+    assert [msg['content'] for msg in convo.messages[1:]] == ['Hello']
+    convo.load_branch(nested_branch)
+    assert [msg['content'] for msg in convo.messages[1:]] == ['Hello', 'Hi']
+
+    # And unnamed branches are freed once nobody can load them anymore
+    assert set(convo.branches) == {branch, named_branch, nested_branch}
+    del branch, nested_branch
+    assert set(convo.branches) == {'named'}
+    convo.load_branch('named')
+    assert len(convo.messages) == 2
+
+    convo.delete_branch('named')
+    assert len(convo.branches) == 0
+
+
+def test_remove_last_x_messages():
+    project = create_project()
+    convo = AgentConvo(Developer(project))
+    branch = convo.save_branch()
+    convo.messages.extend([{'role': 'user', 'content': 'Hello'}, {'role': 'assistant', 'content': 'Hi'}])
+
+    convo.remove_last_x_messages(2)
+
+    assert convo.messages.snapshot() is convo.branches[branch].snapshot
+
+
+def create_long_convo(n_turns):
+    project = create_project()
+    project.get_all_coded_files = lambda: [{'path': '', 'name': 'main.py', 'content': 'print(1)', 'lines_of_code': 1}]
+    convo = AgentConvo(Developer(project))
+    for i in range(n_turns):
+        convo.messages.append({'role': 'user', 'content': f'Question {i} ' + 'word ' * 100})
+        convo.messages.append({'role': 'assistant', 'content': f'Answer {i} ' + 'word ' * 100})
+    return convo
+
+
+@patch('utils.token_budget.get_context_window', lambda model: 2000)
+@patch('helpers.AgentConvo.CONVO_COMPACTION_ENABLED', True)
+@patch('helpers.AgentConvo.CONVO_COMPACTION_KEEP_TURNS', 2)
+@patch('helpers.AgentConvo.create_gpt_chat_completion')
+def test_compact_summarizes_older_turns_once(mock_completion):
+    # Given a conversation over the compaction threshold (0.75 * (2000 - 600) tokens)
+    mock_completion.return_value = {'text': 'The summary'}
+    convo = create_long_convo(6)
+    system_message = convo.messages[0]
+    latest_messages = list(convo.messages[-4:])
+    branch = convo.save_branch()
+
+    # When it's compacted
+    convo.compact()
+
+    # Then the turns before the latest 2 are replaced with their summary, in the first kept user message
+    assert convo.messages[0] is system_message
+    assert convo.messages[1] == {
+        'role': 'user',
+        'content': 'Here is a summary of our conversation so far:\n\nThe summary\n\n' + latest_messages[0]['content'],
+    }
+    assert list(convo.messages[2:]) == latest_messages[1:]
+    assert [msg['role'] for msg in convo.messages] == ['system', 'user', 'assistant', 'user', 'assistant']
+    assert mock_completion.call_count == 1
+    summary_request = mock_completion.call_args.args[0][0]['content']
+    assert 'Question 0' in summary_request and 'Answer 3' in summary_request and 'Question 4' not in summary_request
+
+    # And the same turns aren't summarized again
+    convo.load_branch(branch)
+    assert convo.messages[-4:] == latest_messages
+    convo.compact()
+    assert convo.messages[1]['content'].startswith('Here is a summary of our conversation so far:\n\nThe summary\n\n')
+    assert mock_completion.call_count == 1
+
+    # And short conversations are left alone
+    convo.compact()
+    assert mock_completion.call_count == 1
+
+
+@patch('utils.token_budget.get_context_window', lambda model: 2000)
+@patch('helpers.AgentConvo.CONVO_COMPACTION_ENABLED', True)
+@patch('helpers.AgentConvo.CONVO_COMPACTION_KEEP_TURNS', 2)
+@patch('helpers.AgentConvo.create_gpt_chat_completion')
+def test_compact_keeps_files_and_survives_errors(mock_completion):
+    convo = create_long_convo(6)
+    convo.messages[1]['content'] += '\n---START_OF_FILES---\nold\n---END_OF_FILES---\n'
+    messages = list(convo.messages)
+
+    # When the summary can't be created, the conversation is left as is
+    mock_completion.side_effect = ApiError('Error')
+    convo.compact()
+    assert list(convo.messages) == messages
+
+    # When the files were only in the compacted turns, the summary includes them
+    mock_completion.side_effect = None
+    mock_completion.return_value = {'text': 'The summary'}
+    convo.compact()
+    assert 'old' not in mock_completion.call_args.args[0][0]['content']
+    assert 'print(1)' in convo.messages[1]['content']
+    assert convo.messages[1]['content'].endswith('Question 4 ' + 'word ' * 100)
+    assert len(convo.messages) == 5
+
+    # And the files in the summary are kept up to date
+    convo.agent.project.get_all_coded_files = lambda: [
+        {'path': '', 'name': 'main.py', 'content': 'print(2)', 'lines_of_code': 1},
+    ]
+    convo.replace_files()
+    assert 'print(2)' in convo.messages[1]['content'] and 'print(1)' not in convo.messages[1]['content']
+
+
+@patch('utils.token_budget.get_context_window', lambda model: 2000)
+@patch('helpers.AgentConvo.create_gpt_chat_completion')
+def test_compact_is_disabled_by_default(mock_completion):
+    convo = create_long_convo(6)
+    messages = list(convo.messages)
+
+    convo.compact()
+
+    assert list(convo.messages) == messages
+    mock_completion.assert_not_called()
+
+
+@patch('helpers.AgentConvo.FILE_CONTEXT_MAX_FILES', 1)
+def test_replace_files_includes_most_relevant_files():
+    # Given a project with more files than fit in the files block
+    project = create_project()
+    files = [
+        {'path': 'src', 'name': 'db.js', 'content': 'mongoose.connect(url);', 'lines_of_code': 1},
+        {'path': 'src', 'name': 'routes.js', 'content': 'router.post("/login", login);', 'lines_of_code': 1},
+    ]
+    project.get_all_coded_files = lambda: [dict(file) for file in files]
+    convo = AgentConvo(Developer(project), files_query='Add a login page')
+    # (the prompt text around the files isn't part of the query)
+    convo.messages.append({'role': 'user', 'content': 'Use mongoose\n---START_OF_FILES---\nold\n---END_OF_FILES---\n'})
+
+    # When the files are replaced
+    convo.replace_files()
+
+    # Then only the file relevant to the task is included, the other one is listed by path
+    content = convo.messages[1]['content']
+    assert 'router.post' in content and 'mongoose.connect' not in content
+    assert "(Other files, not shown as they're less relevant to the task: src/db.js)" in content
+
+
+def test_replace_files_includes_all_files_without_query():
+    # Given a project with more files than FILE_CONTEXT_MAX_FILES
+    project = create_project()
+    files = [
+        {'path': 'src', 'name': 'db.js', 'content': 'mongoose.connect(url);', 'lines_of_code': 1},
+        {'path': 'src', 'name': 'routes.js', 'content': 'router.post("/login", login);', 'lines_of_code': 1},
+    ]
+    project.get_all_coded_files = lambda: [dict(file) for file in files]
+    convo = AgentConvo(Developer(project))
+    convo.messages.append({'role': 'user', 'content': 'Add a login page\n---START_OF_FILES---\nold\n---END_OF_FILES---\n'})
+
+    # When the files are replaced in a conversation not about a task
+    with patch('helpers.AgentConvo.FILE_CONTEXT_MAX_FILES', 1):
+        convo.replace_files()
+
+    # Then all of them are included
+    content = convo.messages[1]['content']
+    assert 'router.post' in content and 'mongoose.connect' in content
+
+
+def create_prompt_data(num_files=500):
+    return {
+        'name': 'TestApp',
+        'app_type': 'web app',
+        'files': [{
+            'path': f'src/module{i}',
+            'name': f'file{i}.js',
+            'content': f'// file {i}\n' + 'const value = compute(input);\n' * 60,
+            'lines_of_code': 61,
+        } for i in range(num_files)],
+        'development_tasks': [{'description': 'Set up the server'}],
+        'current_task_index': 0,
+    }
+
+
+def send_messages(convo, prompt_data, count):
+    """
+    Send messages (the LLM and the database aren't used), return the peak traced memory and time per message.
+
+    The messages aren't logged, pytest would keep them in memory.
+    """
+    with patch('helpers.AgentConvo.create_gpt_chat_completion', return_value={'text': 'DONE'}), \
+            patch('helpers.AgentConvo.save_development_step'), patch.object(logger, 'disabled', True):
+        tracemalloc.start()
+        start = time.perf_counter()
+        for _ in range(count):
+            convo.send_message('development/task/breakdown.prompt', prompt_data)
+            del convo.messages[-2:]
+        elapsed = (time.perf_counter() - start) / count
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return peak, elapsed
+
+
+def test_send_message_shares_file_contents():
+    # Given a project with 500 files
+    convo = AgentConvo(Developer(create_project()))
+    convo.replace_files = lambda: None
+    prompt_data = create_prompt_data()
+    original_data = copy.deepcopy(prompt_data)
+    send_messages(convo, prompt_data, 1)
+
+    # When the prompt is rendered (without logging it)
+    tracemalloc.start()
+    with patch.object(logger, 'disabled', True):
+        convo.construct_and_add_message_from_prompt('development/task/breakdown.prompt', prompt_data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    prompt = convo.messages.pop()['content']
+
+    # Then the prompt data isn't modified or copied, the rendered prompt is the only large allocation
+    assert prompt_data == original_data
+    assert all(f'// file {i}' in prompt for i in range(500))
+    assert peak < 1.5 * sys.getsizeof(prompt)
+
+
+@pytest.mark.slow
+def test_benchmark_send_message_memory():
+    """
+    Benchmark peak memory and time per `send_message()` with a 500-file project, copying the prompt data
+    (`copy.deepcopy()`, as before) vs copy-on-write.
+
+    Run with: pytest -s -m slow helpers/test_AgentConvo.py
+    """
+    convo = AgentConvo(Developer(create_project()))
+    convo.replace_files = lambda: None
+    prompt_data = create_prompt_data()
+    send_messages(convo, prompt_data, 1)
+
+    with patch('utils.utils.copy_on_write', copy.deepcopy):
+        deepcopy_peak, deepcopy_time = send_messages(convo, prompt_data, 10)
+    peak, elapsed = send_messages(convo, prompt_data, 10)
+
+    print(f'\ndeepcopy: peak {deepcopy_peak / 1e6:.2f} MB, {deepcopy_time * 1000:.1f} ms per message')
+    print(f'copy-on-write: peak {peak / 1e6:.2f} MB, {elapsed * 1000:.1f} ms per message')
+    assert elapsed < deepcopy_time
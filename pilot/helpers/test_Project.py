@@ -4,6 +4,7 @@ from pathlib import Path
 import pytest
 from unittest.mock import patch, MagicMock
 from helpers.Project import Project
+from helpers.files import get_file_contents
 
 test_root = str(Path(__file__).parent.parent.parent / Path("workspace") / Path("gpt-pilot-test"))
 
@@ -341,6 +342,8 @@ class TestProject:
         # Then assert that update_file with the correct path
         expected_saved_to = str(Path(test_data['saved_to']))
         mock_update_file.assert_called_once_with(expected_saved_to, 'Hello World!', project=project)
+        # And the file is indexed for relevance ranking
+        assert project.file_index.get_scores('hello').keys() == {expected_saved_to}
 
         # Also assert that File.insert was called with the expected arguments
         # expected_file_data = {'app': project.app, 'path': test_data['path'], 'name': test_data['name'],
@@ -408,16 +411,37 @@ class TestProjectFileLists:
 '''.lstrip()
 
     @patch('helpers.Project.DevelopmentSteps.get_or_create', return_value=('test', True))
-    @patch('helpers.Project.File.get_or_create', return_value=('test', True))
-    @patch('helpers.Project.FileSnapshot.get_or_create', return_value=(MagicMock(), True))
-    def test_save_files_snapshot(self, mock_snap, mock_file, mock_step):
+    @patch('helpers.Project.save_file_snapshots')
+    def test_save_files_snapshot(self, mock_save_file_snapshots, mock_step):
         # Given a snapshot of the files in the project
 
         # When we save the file snapshot
         self.project.save_files_snapshot('test')
 
-        # Then the files should be saved to the project, but nothing from `.gpt-pilot/`
-        assert mock_file.call_count == 7
+        # Then the files should be saved to the project at once, but nothing from `.gpt-pilot/`
+        mock_save_file_snapshots.assert_called_once()
+        app, step, saved_files = mock_save_file_snapshots.call_args.args
+        assert step == 'test'
         files = ['package.json', 'main.js', 'file1.js', 'file2.js', 'bar.js', 'fighters.js', 'other.js']
-        for i in range(7):
-            assert mock_file.call_args_list[i][1]['name'] in files
+        assert sorted(file['name'] for file in saved_files) == sorted(files)
+
+    def test_get_files_only_reads_changed_files(self):
+        main_js = os.path.join(self.project.root_path, 'src', 'main.js')
+        paths = ['src/main.js', 'src/other.js']
+
+        # Given the files were read once
+        self.project.get_files(paths)
+
+        # When one of them changes
+        with open(main_js, 'w') as file:
+            file.write('console.log("Changed!");')
+        with patch('helpers.Project.get_file_contents', wraps=get_file_contents) as mock_get_file_contents:
+            files = self.project.get_files(paths)
+
+        # Then only that one is read again
+        assert [call.args[0] for call in mock_get_file_contents.call_args_list] == [main_js]
+        assert [file['content'] for file in files] == ['console.log("Changed!");', 'console.log("Hello World!");']
+
+        # And the cached data can't be modified by the callers
+        files[1]['content'] = 'modified'
+        assert self.project.get_files(paths)[1]['content'] == 'console.log("Hello World!");'
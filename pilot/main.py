@@ -13,13 +13,15 @@ except ImportError:
 
 load_dotenv()
 
+from const.common import HEADLESS
 from utils.style import color_red
 from utils.custom_print import get_custom_print
 from helpers.Project import Project
 from utils.arguments import get_arguments
 from utils.exit import exit_gpt_pilot
 from logger.logger import logger
-from database.database import database_exists, create_database, tables_exist, create_tables, get_created_apps_with_steps
+from database.database import database_exists, create_database, tables_exist, create_tables, migrate_tables, \
+    get_created_apps_with_steps
 
 from utils.settings import settings, loader, get_version
 from utils.telemetry import telemetry
@@ -30,6 +32,9 @@ def init():
     if not database_exists():
         create_database()
 
+    # Update the tables created by older versions
+    migrate_tables()
+
     # Check if the tables exist, if not, create them
     if not tables_exist():
         create_tables()
@@ -143,6 +148,9 @@ if __name__ == "__main__":
         telemetry.record_crash(err)
 
     finally:
+        if HEADLESS:
+            # nobody to ask for feedback
+            ask_feedback = False
         if project is not None:
             if project.check_ipc():
                 ask_feedback = False
@@ -0,0 +1,246 @@
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+from peewee import SqliteDatabase, OperationalError
+from playhouse.pool import PooledPostgresqlDatabase
+import pytest
+
+from database.config import (
+    DB_POOL_MAX_CONNECTIONS,
+    DB_POOL_STALE_TIMEOUT,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_SYNCHRONOUS,
+    SQLITE_MMAP_SIZE,
+    SQLITE_CACHE_SIZE,
+    SQLITE_BUSY_TIMEOUT,
+)
+from database.connection import thread_connection
+from database.connection.postgres import get_postgres_database
+from database.connection.sqlite import get_sqlite_database
+from database.database import TABLES, save_file_snapshots, get_created_apps_with_steps
+from database.models.user import User
+from database.models.app import App
+from database.models.development_steps import DevelopmentSteps
+from utils.llm_connection import async_create_gpt_chat_completion
+
+
+@pytest.fixture
+def sqlite_database(tmp_path):
+    """
+    Set up a new SQLite database in a file (unlike in-memory databases, it can be
+    shared by several connections), with the pragmas from the config.
+    """
+    db = get_sqlite_database(str(tmp_path / "gpt-pilot.db"))
+    with db.bind_ctx(TABLES):
+        db.create_tables(TABLES)
+        yield db
+        db.close()
+
+
+def test_get_sqlite_database_pragmas(sqlite_database):
+    # When
+    pragmas = {
+        name: sqlite_database.execute_sql(f"PRAGMA {name}").fetchone()[0]
+        for name in ["journal_mode", "synchronous", "mmap_size", "cache_size", "busy_timeout"]
+    }
+
+    # Then
+    assert pragmas == {
+        "journal_mode": SQLITE_JOURNAL_MODE,
+        "synchronous": ["off", "normal", "full", "extra"].index(SQLITE_SYNCHRONOUS),
+        "mmap_size": SQLITE_MMAP_SIZE,
+        "cache_size": SQLITE_CACHE_SIZE,
+        "busy_timeout": SQLITE_BUSY_TIMEOUT * 1000,
+    }
+
+
+def test_get_postgres_database_is_pooled():
+    # When
+    db = get_postgres_database()
+
+    # Then
+    assert isinstance(db, PooledPostgresqlDatabase)
+    assert db._max_connections == DB_POOL_MAX_CONNECTIONS
+    assert db._stale_timeout == DB_POOL_STALE_TIMEOUT
+
+
+def test_thread_connection(sqlite_database):
+    # Given
+    sqlite_database.close()
+    states = []
+
+    def worker():
+        with thread_connection(sqlite_database):
+            User.create(email="worker", password="")
+            with thread_connection(sqlite_database):
+                User.select().count()
+            # the nested block doesn't close the connection it didn't open
+            states.append(sqlite_database.is_closed())
+        states.append(sqlite_database.is_closed())
+
+    # When
+    sqlite_database.connect()
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+
+    # Then the worker had its own connection, and closed it
+    assert states == [False, True]
+    assert not sqlite_database.is_closed()
+    assert User.select().where(User.email == "worker").count() == 1
+
+
+def test_thread_connection_is_only_opened_by_queries(sqlite_database):
+    # Given
+    sqlite_database.close()
+
+    # When
+    with thread_connection(sqlite_database):
+        opened = not sqlite_database.is_closed()
+
+    # Then
+    assert not opened
+    assert sqlite_database.is_closed()
+
+
+def test_llm_requests_close_their_thread_connection(tmp_path):
+    # Given a database counting its connections
+    class CountingDatabase(SqliteDatabase):
+        opened = closed = 0
+
+        def _connect(self):
+            CountingDatabase.opened += 1
+            return super()._connect()
+
+        def _close(self, conn):
+            CountingDatabase.closed += 1
+            super()._close(conn)
+
+    db = CountingDatabase(str(tmp_path / "gpt-pilot.db"))
+
+    def create_gpt_chat_completion(*args, **kwargs):
+        # eg. saving the user's answer to retry a failed request
+        User.create(email="", password="")
+        return {"text": "response"}
+
+    # When an LLM request queries it on a worker thread
+    with db.bind_ctx(TABLES), \
+            patch("utils.llm_connection.database", db), \
+            patch("utils.llm_connection.create_gpt_chat_completion", create_gpt_chat_completion):
+        with thread_connection(db):
+            db.create_tables(TABLES)
+        response = asyncio.run(async_create_gpt_chat_completion([], "test", None))
+
+    # Then the worker thread's connection is closed
+    assert response == {"text": "response"}
+    assert CountingDatabase.opened == CountingDatabase.closed == 2
+
+
+def test_write_while_reading(sqlite_database):
+    # Given a reader (eg. `--get-created-apps-with-steps`) in the middle of reading
+    User.create(email="reader", password="")
+    reading = threading.Event()
+    done = threading.Event()
+
+    def reader():
+        with thread_connection(sqlite_database):
+            with sqlite_database.atomic():
+                assert User.select().count() == 1
+                reading.set()
+                done.wait(5)
+                # the reader keeps seeing the snapshot it started with
+                assert User.select().count() == 1
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    reading.wait(5)
+
+    # When
+    start = time.perf_counter()
+    User.create(email="writer", password="")
+
+    # Then the writer didn't wait for the reader to finish
+    assert time.perf_counter() - start < 1
+    done.set()
+    thread.join()
+    assert User.select().count() == 2
+
+
+def run_concurrent_readers_and_writer(db, duration, num_readers=4, num_files=50):
+    """
+    Run a writer saving development steps with file snapshots (like a build), and readers
+    listing the apps with their steps (like the extension), on separate threads and connections.
+
+    :return: (write latencies, read latencies, lock errors), latencies in seconds
+    """
+    with thread_connection(db):
+        user = User.create(email="", password="")
+        app = App.create(user=user, name="TestApp", status="coding")
+    files = [
+        {"name": f"file{i}.js", "path": "src", "full_path": f"/app/src/file{i}.js", "content": ""}
+        for i in range(num_files)
+    ]
+    writes, reads, errors = [], [], []
+    stop = threading.Event()
+
+    def writer():
+        with thread_connection(db):
+            while not stop.is_set():
+                for file in files:
+                    file["content"] = f"console.log({len(writes)});\n" * 50 + file["full_path"]
+                start = time.perf_counter()
+                try:
+                    with db.atomic():
+                        step = DevelopmentSteps.create(app=app, llm_response={}, prompt_path="development/iteration")
+                        save_file_snapshots(app, step, files)
+                    writes.append(time.perf_counter() - start)
+                except OperationalError as e:
+                    errors.append(e)
+
+    def reader():
+        with thread_connection(db):
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    get_created_apps_with_steps()
+                    reads.append(time.perf_counter() - start)
+                except OperationalError as e:
+                    errors.append(e)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(num_readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return writes, reads, errors
+
+
+@pytest.mark.slow
+def test_benchmark_concurrent_readers_and_writer(tmp_path):
+    """
+    Benchmark a build writing to the SQLite database while the extension reads from it,
+    with the default connection settings (as before) vs the WAL journal and tuned pragmas.
+
+    Run with: pytest -s -m slow test/database/test_connection.py
+    """
+    duration = 5
+    results = {}
+    for name, db in [
+        ("default", SqliteDatabase(str(tmp_path / "default.db"))),
+        ("wal", get_sqlite_database(str(tmp_path / "wal.db"))),
+    ]:
+        with db.bind_ctx(TABLES):
+            with thread_connection(db):
+                db.create_tables(TABLES)
+            results[name] = run_concurrent_readers_and_writer(db, duration)
+
+    print()
+    for name, (writes, reads, errors) in results.items():
+        print(f"{name}: {len(writes) / duration:.0f} steps/s written (max {max(writes) * 1000:.0f} ms), "
+              f"{len(reads) / duration:.0f} reads/s (max {max(reads) * 1000:.0f} ms), {len(errors)} lock errors")
+    assert not results["wal"][2]
+    assert len(results["wal"][0]) > len(results["default"][0])
@@ -1,6 +1,10 @@
+import time
 from base64 import b64decode
+from datetime import datetime
+from unittest.mock import Mock, patch
+from uuid import UUID
 
-from peewee import SqliteDatabase, PostgresqlDatabase
+from peewee import SqliteDatabase, PostgresqlDatabase, fn
 import pytest
 
 from database.config import (
@@ -11,9 +15,10 @@ from database.config import (
     DB_USER,
     DB_PASSWORD,
 )
-from database.database import TABLES
+from database.database import TABLES, save_file_snapshots, delete_unused_file_blobs, migrate_tables, copy_rows
 from database.models.user import User
 from database.models.app import App
+from database.models.file_blob import FileBlob, BlobCache, make_delta, apply_delta, blob_cache
 from database.models.file_snapshot import FileSnapshot
 from database.models.files import File
 from database.models.development_steps import DevelopmentSteps
@@ -106,11 +111,309 @@ def test_file_snapshot(content, expected_content):
     step = DevelopmentSteps.create(app=app, llm_response={})
     file = File.create(app=app, name="test", path="test", full_path="test")
 
+    blob = FileBlob.create(hash=FileBlob.get_hash(b"test"), content=content)
+
     fs = FileSnapshot.create(
         app=app,
         development_step=step,
         file=file,
-        content=content,
+        blob=blob,
     )
     from_db = FileSnapshot.get(id=fs.id)
     assert from_db.content == expected_content
+
+
+def create_files(count, content="console.log('hello');\n"):
+    return [
+        {"name": f"file{i}.js", "path": f"src/dir{i % 10}", "full_path": f"/app/src/dir{i % 10}/file{i}.js", "content": content}
+        for i in range(count)
+    ]
+
+
+def save_file_snapshots_one_by_one(app, step, files):
+    """
+    Save file snapshots the way `Project.save_files_snapshot()` used to, a few queries per file.
+    """
+    for file in files:
+        file_in_db, created = File.get_or_create(
+            app=app, name=file["name"], path=file["path"], defaults={"full_path": file["full_path"]}
+        )
+        content = file["content"].encode("utf-8")
+        blob, created = FileBlob.get_or_create(hash=FileBlob.get_hash(content), defaults={"content": content})
+        file_snapshot, created = FileSnapshot.get_or_create(
+            app=app, development_step=step, file=file_in_db, defaults={"blob": blob}
+        )
+        file_snapshot.blob = blob
+        file_snapshot.save()
+
+
+def test_save_file_snapshots():
+    user = User.create(email="", password="")
+    app = App.create(user=user)
+    step = DevelopmentSteps.create(app=app, llm_response={})
+    existing = File.create(app=app, name="file0.js", path="src/dir0", full_path="/app/src/dir0/file0.js")
+    files = create_files(3)
+    files[2]["content"] = EMPTY_PNG
+
+    save_file_snapshots(app, step, files)
+
+    assert File.select().where(File.app == app).count() == 3
+    snapshots = {fs.file.name: fs for fs in FileSnapshot.select().where(FileSnapshot.development_step == step)}
+    assert snapshots["file0.js"].file.id == existing.id
+    assert snapshots["file1.js"].content == "console.log('hello');\n"
+    assert snapshots["file2.js"].content == EMPTY_PNG
+
+    # Saving the step again replaces the snapshots
+    files[1]["content"] = "changed"
+    save_file_snapshots(app, step, files)
+
+    assert FileSnapshot.select().where(FileSnapshot.development_step == step).count() == 3
+    assert FileSnapshot.get(FileSnapshot.id == snapshots["file1.js"].id).content == "changed"
+
+    # Unchanged contents are stored once, no matter how many snapshots have them
+    next_step = DevelopmentSteps.create(app=app, llm_response={})
+    save_file_snapshots(app, next_step, files)
+
+    assert FileSnapshot.select().count() == 6
+    assert FileBlob.select().count() == 3
+
+    # Contents no snapshot has anymore are deleted
+    FileSnapshot.delete().where(FileSnapshot.development_step == next_step).execute()
+    files[2]["content"] = "not an image"
+    save_file_snapshots(app, step, files)
+    assert FileBlob.select().count() == 4
+    delete_unused_file_blobs()
+    assert FileBlob.select().count() == 3
+
+
+def test_migrate_tables(database):
+    """
+    Test that snapshots saved with their content are migrated to blobs.
+    """
+    user = User.create(email="", password="")
+    app = App.create(user=user)
+    step = DevelopmentSteps.create(app=app, llm_response={})
+    files = [File.create(app=app, name=f"file{i}.js", path="src", full_path=f"/app/src/file{i}.js") for i in range(3)]
+    database.drop_tables([FileSnapshot, FileBlob])
+    database.execute_sql(
+        'CREATE TABLE "file_snapshot" ("id" TEXT NOT NULL PRIMARY KEY, "created_at" DATETIME NOT NULL, '
+        '"updated_at" DATETIME NOT NULL, "app_id" TEXT NOT NULL, "development_step_id" INTEGER NOT NULL, '
+        '"file_id" INTEGER, "content" BLOB NOT NULL)'
+    )
+    for i, (file, content) in enumerate(zip(files, [b"same", b"same", EMPTY_PNG])):
+        database.execute_sql(
+            'INSERT INTO "file_snapshot" VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (f"{i:032}", "2024-01-01 00:00:00", "2024-01-01 00:00:00", app.id.hex, step.id, file.id, content),
+        )
+
+    migrate_tables()
+
+    columns = [column.name for column in database.get_columns("file_snapshot")]
+    assert "content" not in columns and "blob_hash" in columns
+    assert FileBlob.select().count() == 2
+    assert sorted(
+        (snapshot.file.name, snapshot.content) for snapshot in FileSnapshot.select()
+    ) == [("file0.js", "same"), ("file1.js", "same"), ("file2.js", EMPTY_PNG)]
+    # Migrating again does nothing
+    migrate_tables()
+    assert FileBlob.select().count() == 2
+
+
+def test_make_and_apply_delta():
+    base = "".join(f"line {i}\n" for i in range(100)).encode("utf-8")
+    content = base.replace(b"line 50\n", b"changed\r\nline 50 \xc5\xa1\n") + b"no newline"
+
+    delta = make_delta(base, content)
+
+    assert apply_delta(base, delta) == content
+    assert len(delta) < len(content) / 10
+    assert make_delta(base, EMPTY_PNG) is None
+
+
+def test_blob_cache_is_bounded_by_size():
+    cache = BlobCache(max_size=10)
+
+    cache.set("a", b"aaaa")
+    cache.set("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.set("c", b"cccc")
+    cache.set("d", b"d" * 11)
+
+    # The least recently used content is evicted, contents over the max size aren't cached
+    assert [cache.get(key) for key in "abcd"] == [b"aaaa", None, b"cccc", None]
+    assert cache.size == 8
+
+
+@patch("database.database.FILE_DELTA_STORAGE", True)
+@patch("database.database.FILE_DELTA_KEYFRAME_INTERVAL", 3)
+def test_save_file_snapshots_as_deltas():
+    user = User.create(email="", password="")
+    app = App.create(user=user)
+    content = "".join(f"line {i}\n" for i in range(200))
+    steps = []
+    for version in range(5):
+        step = DevelopmentSteps.create(app=app, llm_response={})
+        content = content.replace(f"line {version}\n", f"version {version}\n")
+        save_file_snapshots(app, step, [
+            {"name": "app.js", "path": "src", "full_path": "/app/src/app.js", "content": content},
+            {"name": "image.png", "path": "src", "full_path": "/app/src/image.png", "content": EMPTY_PNG},
+        ])
+        steps.append((step, content))
+
+    # The versions are stored as deltas, with a keyframe every 3 versions
+    blobs = list(FileBlob.select().where(FileBlob.hash != FileBlob.get_hash(EMPTY_PNG)).order_by(FileBlob.created_at))
+    assert [blob.depth for blob in blobs] == [0, 1, 2, 0, 1]
+    assert [blob.content is None for blob in blobs] == [False, True, True, False, True]
+
+    # And they're read transparently
+    blob_cache.clear()
+    for step, step_content in steps:
+        snapshots = {fs.file.name: fs.content for fs in FileSnapshot.select().where(FileSnapshot.development_step == step)}
+        assert snapshots == {"app.js": step_content, "image.png": EMPTY_PNG}
+
+    # The bases of the deltas are kept when their snapshots are deleted
+    FileSnapshot.delete().where(FileSnapshot.development_step != steps[-1][0]).execute()
+    delete_unused_file_blobs()
+    blob_cache.clear()
+    assert FileBlob.select().count() == 3
+    assert FileSnapshot.get(FileSnapshot.file == File.get(File.name == "app.js")).content == steps[-1][1]
+
+
+def copy_with_mock_cursor(Model, rows, conflict_target, update=None):
+    """
+    Run `copy_rows()` (used on PostgreSQL) with a mock cursor.
+
+    :return: (SQL statements executed, data sent with COPY)
+    """
+    cursor = Mock()
+    copied = []
+    cursor.copy_expert.side_effect = lambda sql, data: copied.append((sql, data.read()))
+    with patch.object(Model._meta, "database", Mock(cursor=Mock(return_value=cursor))):
+        copy_rows(Model, rows, conflict_target, update)
+    return [c.args[0] for c in cursor.execute.call_args_list], copied
+
+
+def test_copy_rows():
+    # Given a full content and a delta
+    created_at = datetime(2024, 1, 2, 3, 4, 5, 678000)
+    rows = [
+        {"id": UUID(int=1), "created_at": created_at, "updated_at": created_at, "hash": "h1",
+         "content": b"\\x\t\n", "base": None, "delta": None, "depth": 0},
+        {"id": UUID(int=2), "created_at": created_at, "updated_at": created_at, "hash": "h2",
+         "content": None, "base": "h1", "delta": b"\x00\xff", "depth": 1},
+    ]
+
+    # When
+    statements, [(copy_sql, data)] = copy_with_mock_cursor(FileBlob, rows, [FileBlob.hash])
+
+    # Then
+    columns = '"id", "created_at", "updated_at", "hash", "content", "base", "delta", "depth"'
+    assert copy_sql == f'COPY "file_blob_copy" ({columns}) FROM STDIN'
+    assert data == (
+        "00000000000000000000000000000001\t2024-01-02 03:04:05.678000\t2024-01-02 03:04:05.678000\t"
+        "h1\t\\\\x5c78090a\t\\N\t\\N\t0\n"
+        "00000000000000000000000000000002\t2024-01-02 03:04:05.678000\t2024-01-02 03:04:05.678000\t"
+        "h2\t\\N\th1\t\\\\x00ff\t1\n"
+    )
+    assert statements[-1] == (
+        f'INSERT INTO "file_blob" ({columns}) SELECT {columns} FROM "file_blob_copy" ON CONFLICT ("hash") DO NOTHING'
+    )
+
+
+def test_copy_rows_escapes_text_and_updates_on_conflict():
+    # Given a file snapshot row, with a (made up) blob hash that needs escaping
+    app = App(id=UUID(int=1))
+    rows = [{"app": app, "file": 2, "blob": "a\tb\\c\nd"}]
+
+    # When
+    statements, [(_, data)] = copy_with_mock_cursor(
+        FileSnapshot, rows, [FileSnapshot.development_step, FileSnapshot.file], FileSnapshot.blob
+    )
+
+    # Then
+    assert data == "00000000000000000000000000000001\t2\ta\\tb\\\\c\\nd\n"
+    assert statements[-1] == (
+        'INSERT INTO "file_snapshot" ("app_id", "file_id", "blob_hash") '
+        'SELECT "app_id", "file_id", "blob_hash" FROM "file_snapshot_copy" '
+        'ON CONFLICT ("development_step_id", "file_id") DO UPDATE SET "blob_hash" = EXCLUDED."blob_hash"'
+    )
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("count", [100, 1000, 5000])
+def test_benchmark_save_file_snapshots(count):
+    """
+    Benchmark saving file snapshots one by one (as before) vs in bulk, on the configured
+    database (set DATABASE_TYPE=postgres and DB_* to run it on PostgreSQL).
+
+    Run with: pytest -s -m slow test/database/test_file_snapshot.py
+    """
+    user = User.create(email="", password="")
+    app = App.create(user=user)
+    files = create_files(count, content="console.log('hello');\n" * 50)
+
+    timings = {}
+    for name, save in [("one by one", save_file_snapshots_one_by_one), ("bulk", save_file_snapshots)]:
+        step = DevelopmentSteps.create(app=app, llm_response={})
+        start = time.perf_counter()
+        save(app, step, files)
+        timings[name] = time.perf_counter() - start
+        assert FileSnapshot.select().where(FileSnapshot.development_step == step).count() == count
+
+    print(f"\n{DATABASE_TYPE}, {count} files: " + ", ".join(f"{name} {t * 1000:.0f} ms" for name, t in timings.items()))
+    assert timings["bulk"] < timings["one by one"]
+
+
+@pytest.mark.slow
+def test_benchmark_file_delta_storage():
+    """
+    Benchmark storage size and reconstruction latency of file snapshots stored in full vs
+    as deltas, over a long-running project history (small edits to a few files per step).
+
+    Run with: pytest -s -m slow test/database/test_file_snapshot.py
+    """
+    num_files, num_lines, num_steps = 30, 300, 200
+    user = User.create(email="", password="")
+    app = App.create(user=user)
+    files = [
+        {"name": f"file{i}.js", "path": "src", "full_path": f"/app/src/file{i}.js",
+         "lines": [f"const value{i}_{line} = compute({line}); // file {i}\n" for line in range(num_lines)]}
+        for i in range(num_files)
+    ]
+
+    for delta_storage in [False, True]:
+        FileSnapshot.delete().execute()
+        FileBlob.delete().execute()
+        DevelopmentSteps.delete().execute()
+        history = [[list(file["lines"]) for file in files]]
+        for step_index in range(num_steps):
+            lines = [list(file_lines) for file_lines in history[-1]]
+            for i in (step_index % num_files, (step_index * 7) % num_files):
+                lines[i][(step_index * 13) % num_lines] = f"const edited = {step_index}; // edited\n"
+            history.append(lines)
+
+        with patch("database.database.FILE_DELTA_STORAGE", delta_storage):
+            start = time.perf_counter()
+            steps = []
+            for lines in history[1:]:
+                step = DevelopmentSteps.create(app=app, llm_response={})
+                save_file_snapshots(app, step, [
+                    {**file, "content": "".join(file_lines)} for file, file_lines in zip(files, lines)
+                ])
+                steps.append(step)
+            save_time = (time.perf_counter() - start) / num_steps
+
+        size = FileBlob.select(
+            fn.SUM(fn.COALESCE(fn.LENGTH(FileBlob.content), 0) + fn.COALESCE(fn.LENGTH(FileBlob.delta), 0))
+        ).scalar()
+
+        start = time.perf_counter()
+        for step in steps[::20]:
+            blob_cache.clear()
+            snapshots = (FileSnapshot.select(FileSnapshot, FileBlob).join(FileBlob)
+                         .where(FileSnapshot.development_step == step))
+            assert len([snapshot.content for snapshot in snapshots]) == num_files
+        restore_time = (time.perf_counter() - start) / len(steps[::20])
+
+        print(f"\n{'deltas' if delta_storage else 'full'}: {size / 1e6:.2f} MB stored, "
+              f"{save_time * 1000:.1f} ms per snapshot, {restore_time * 1000:.1f} ms to read a step's files")
@@ -0,0 +1,190 @@
+"""
+Run GPT Pilot end to end against the mock LLM server and report where the time goes.
+
+Usage (from the `pilot` directory):
+
+    python -m test.mock_llm.harness test/mock_llm/scenarios/hello_world.json [--runs N] [--ttft S]
+        [--tokens-per-sec N] [--error-rate P] [--rate-limit-rate P] [--verbose]
+
+Besides the mock LLM responses (see `test.mock_llm.server`), the scenario contains
+the answers to the questions GPT Pilot asks (in the ANSWERS_FILE format, see
+`utils.scripted_answers`) and optional extra command line arguments and environment
+variables for `main.py`:
+
+    {
+        "args": [],
+        "env": {"LLM_MAX_CONCURRENCY": "4"},
+        "answers": [{"question": "Describe your app", "answer": "A hello world script"}],
+        "defaults": {...},
+        "responses": [...]
+    }
+
+Each run uses a fresh workspace, SQLite database and config directory, in headless
+mode. The report contains the total wall time, the time spent waiting for the LLM
+(the union of the intervals when at least one request was in progress) and the rest,
+which is GPT Pilot's own overhead (startup, prompt rendering, token counting,
+database, file operations, ...). Waiting before retrying failed requests (see the
+`--error-rate` and `--rate-limit-rate` options) counts as overhead too.
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+
+from test.mock_llm.server import MockLLMServer
+
+PILOT_DIR = Path(__file__).parent.parent.parent
+RUN_TIMEOUT = 600  # seconds
+
+
+def get_busy_time(intervals: list[tuple[float, float]]) -> float:
+    """
+    Get the total time covered by (possibly overlapping) intervals.
+    """
+    total = 0.0
+    end = None
+    for interval_start, interval_end in sorted(intervals):
+        if end is None or interval_start > end:
+            total += interval_end - interval_start
+            end = interval_end
+        elif interval_end > end:
+            total += interval_end - end
+            end = interval_end
+    return total
+
+
+def run_scenario(scenario: dict, verbose: bool = False) -> dict:
+    """
+    Run `main.py` with the scenario against a mock LLM server.
+
+    :param scenario: scenario (see module docstring)
+    :param verbose: show GPT Pilot's output
+    :return: report with the timings and the LLM requests made
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir, MockLLMServer(scenario) as server:
+        tmp_path = Path(tmp_dir)
+        answers_path = tmp_path / 'answers.json'
+        answers_path.write_text(json.dumps(scenario.get('answers', [])), encoding='utf-8')
+
+        env = {
+            **os.environ,
+            'ENDPOINT': 'OPENAI',
+            'OPENAI_ENDPOINT': server.url,
+            'OPENAI_API_KEY': 'mock',
+            'MODEL_NAME': 'gpt-4',
+            'LLM_ENDPOINTS': '',
+            'LLM_CACHE': 'false',
+            'HEADLESS': 'true',
+            'ANSWERS_FILE': str(answers_path),
+            'DATABASE_TYPE': 'sqlite',
+            'DB_NAME': str(tmp_path / 'gpt-pilot.db'),
+            'XDG_CONFIG_HOME': str(tmp_path / 'config'),
+            # Telemetry is only sent if it's enabled in the config file
+            'TELEMETRY_ID': 'mock-llm-harness',
+            'PYTHONUNBUFFERED': '1',
+            **scenario.get('env', {}),
+        }
+        args = [sys.executable, 'main.py', f'workspace={tmp_path / "workspace"}', *scenario.get('args', [])]
+
+        start = time.monotonic()
+        process = subprocess.run(
+            args,
+            cwd=PILOT_DIR,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=None if verbose else subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            timeout=RUN_TIMEOUT,
+        )
+        wall_time = time.monotonic() - start
+
+    llm_time = get_busy_time([(request['received'], request['finished']) for request in server.requests])
+    # GPT Pilot exits with 0 even if it failed, so look at the output and the responses too
+    success = (
+        process.returncode == 0
+        and 'EXITING WITH ERROR' not in (process.stdout or '')
+        and not any(request['status'] == 400 for request in server.requests)
+    )
+    return {
+        'success': success,
+        'exit_code': process.returncode,
+        'output': process.stdout,
+        'wall_time': wall_time,
+        'llm_time': llm_time,
+        'overhead': wall_time - llm_time,
+        'requests': server.requests,
+    }
+
+
+def print_report(reports: list[dict]):
+    n_runs = len(reports)
+    wall_time = sum(report['wall_time'] for report in reports) / n_runs
+    llm_time = sum(report['llm_time'] for report in reports) / n_runs
+    overhead = sum(report['overhead'] for report in reports) / n_runs
+    requests = [request for report in reports for request in report['requests']]
+
+    print(f'Runs:               {n_runs}')
+    print(f'Wall time:          {wall_time:8.2f} s')
+    print(f'LLM wait time:      {llm_time:8.2f} s')
+    print(f'Non-LLM overhead:   {overhead:8.2f} s ({overhead / wall_time * 100 if wall_time else 0:.1f}%)')
+    print(f'LLM requests:       {len(requests) / n_runs:8.1f} per run')
+
+    by_status = {}
+    for request in requests:
+        by_status[request['status']] = by_status.get(request['status'], 0) + 1
+    print(f'Responses:          {", ".join(f"{status}: {n}" for status, n in sorted(by_status.items()))}')
+
+    by_rule = {}
+    for request in requests:
+        if request['rule'] is not None:
+            stats = by_rule.setdefault(request['rule'], {'n': 0, 'time': 0.0, 'tokens': 0})
+            stats['n'] += 1
+            stats['time'] += request['finished'] - request['received']
+            stats['tokens'] += request['completion_tokens']
+    print()
+    print(f'{"Response rule":50} {"requests":>8} {"time (s)":>9} {"tokens":>8}')
+    for name, stats in by_rule.items():
+        print(f'{name[:50]:50} {stats["n"] / n_runs:8.1f} {stats["time"] / n_runs:9.2f} {stats["tokens"] / n_runs:8.0f}')
+
+    for i, report in enumerate(reports):
+        if not report['success']:
+            print(f'\nRun {i + 1} failed (exit code {report["exit_code"]}), last output:')
+            print('\n'.join((report['output'] or '').splitlines()[-30:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run GPT Pilot end to end against the mock LLM server.')
+    parser.add_argument('scenario', help='path to the scenario JSON file')
+    parser.add_argument('--runs', type=int, default=1, help='number of runs (default: 1)')
+    parser.add_argument('--ttft', type=float, help='default time to first token (seconds), 0 to measure overhead only')
+    parser.add_argument('--tokens-per-sec', type=float, help='default streaming speed, 0 for unlimited')
+    parser.add_argument('--error-rate', type=float, help='default probability of HTTP 500 responses')
+    parser.add_argument('--rate-limit-rate', type=float, help='default probability of HTTP 429 responses')
+    parser.add_argument('--verbose', action='store_true', help="show GPT Pilot's output")
+    args = parser.parse_args()
+
+    with open(args.scenario, 'r', encoding='utf-8') as f:
+        scenario = json.load(f)
+
+    defaults = scenario.setdefault('defaults', {})
+    if args.ttft is not None:
+        defaults['ttft'] = args.ttft
+    if args.tokens_per_sec is not None:
+        defaults['tokens_per_sec'] = args.tokens_per_sec
+    if args.error_rate is not None:
+        defaults['error_rate'] = args.error_rate
+    if args.rate_limit_rate is not None:
+        defaults['rate_limit_rate'] = args.rate_limit_rate
+
+    reports = [run_scenario(scenario, verbose=args.verbose) for _ in range(args.runs)]
+    print_report(reports)
+    sys.exit(0 if all(report['success'] for report in reports) else 1)
+
+
+if __name__ == '__main__':
+    main()
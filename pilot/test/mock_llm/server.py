@@ -0,0 +1,251 @@
+"""
+Local OpenAI-compatible chat completions server with scripted responses.
+
+Used to measure GPT Pilot's own overhead (and to exercise the LLM client) without
+a real model. The server speaks the streaming (SSE) chat completions protocol and
+answers each request from a scenario:
+
+    {
+        "seed": 42,
+        "defaults": {"ttft": 0.5, "tokens_per_sec": 50, "error_rate": 0, "rate_limit_rate": 0},
+        "responses": [
+            {"prompt": "architecture/technologies.prompt", "response": {"architecture": "..."}},
+            {"match": "Describe the next step", "responses": ["first answer", "second answer"], "ttft": 2},
+            {"match": "", "response": "DONE"}
+        ]
+    }
+
+Each request is answered by the first rule that matches the current turn (the user
+messages after the last assistant message):
+* `prompt` - the request contains the prompt template (its longest line of static text)
+* `match` - regular expression searched in the current turn
+
+`response` is sent as is if it's a string, JSON-encoded otherwise. `responses` are
+sent in turn, the last one being repeated. Timing and failures can be set per rule
+or in `defaults`:
+* `ttft` - time to first token (seconds)
+* `tokens_per_sec` - streaming speed
+* `error_rate` - probability of responding with HTTP 500
+* `rate_limit_rate` - probability of responding with HTTP 429 (and a `retry-after-ms` header)
+* `retry_after` - wait time sent with the 429 responses (seconds)
+
+Requests that don't match any rule get a (non-retryable) HTTP 400 response.
+"""
+import json
+import random
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Lock, Thread
+import time
+from typing import Optional
+
+PROMPTS_DIR = Path(__file__).parent.parent.parent / 'prompts'
+DEFAULTS = {
+    'ttft': 0.0,
+    'tokens_per_sec': 0,  # unlimited
+    'error_rate': 0.0,
+    'rate_limit_rate': 0.0,
+    'retry_after': 0.1,
+}
+TOKEN_PATTERN = re.compile(r'\s*\S+|\s+')
+
+
+def get_prompt_signature(prompt_path: str) -> str:
+    """
+    Get the longest line of static text in a prompt template, to recognize the prompt in requests.
+
+    :param prompt_path: path of the template, relative to the prompts directory
+    """
+    source = (PROMPTS_DIR / prompt_path).read_text(encoding='utf-8')
+    static_parts = re.split(r'{{.*?}}|{%.*?%}|{#.*?#}', source, flags=re.DOTALL)
+    return max((line.strip() for part in static_parts for line in part.splitlines()), key=len)
+
+
+def get_current_turn(messages: list[dict]) -> str:
+    """
+    Get the content of the user messages after the last assistant message.
+    """
+    turn = []
+    for message in reversed(messages):
+        if message.get('role') == 'assistant':
+            break
+        if message.get('role') == 'user':
+            turn.append(message.get('content') or '')
+    return '\n'.join(reversed(turn))
+
+
+class Rule:
+    """
+    Scripted response to the requests matching the rule.
+    """
+
+    def __init__(self, config: dict, defaults: dict):
+        self.name = config.get('name') or config.get('prompt') or config.get('match')
+        self.signature = get_prompt_signature(config['prompt']) if 'prompt' in config else None
+        self.pattern = re.compile(config['match'], re.DOTALL) if 'match' in config else None
+        responses = config['responses'] if 'responses' in config else [config.get('response', '')]
+        self.responses = [response if isinstance(response, str) else json.dumps(response) for response in responses]
+        self.options = {key: config.get(key, defaults[key]) for key in DEFAULTS}
+        self.used = 0
+
+    def matches(self, turn: str) -> bool:
+        if self.signature is not None and self.signature not in turn:
+            return False
+        if self.pattern is not None and not self.pattern.search(turn):
+            return False
+        return True
+
+    def next_response(self) -> str:
+        response = self.responses[min(self.used, len(self.responses) - 1)]
+        self.used += 1
+        return response
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server: 'MockLLMServer'
+
+    def do_POST(self):
+        received = time.monotonic()
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        turn = get_current_turn(request.get('messages', []))
+        record = {'rule': None, 'status': 200, 'received': received, 'first_token': None, 'finished': None,
+                  'completion_tokens': 0}
+
+        rule, response, failure = self.server.choose_response(turn)
+        if rule is None:
+            record['status'] = 400
+            self.send_json(400, {'error': {'message': f'No scripted response for: {turn[:200]}',
+                                           'type': 'invalid_request_error'}})
+        elif failure == 'rate_limit':
+            record['status'] = 429
+            retry_after = rule.options['retry_after']
+            self.send_json(429, {'error': {
+                'message': f'Rate limit reached. Please try again in {int(retry_after * 1000)}ms.',
+                'type': 'tokens',
+                'code': 'rate_limit_exceeded',
+            }}, headers={'retry-after-ms': str(int(retry_after * 1000))})
+        elif failure == 'error':
+            record['status'] = 500
+            self.send_json(500, {'error': {'message': 'The server had an error while processing your request.',
+                                           'type': 'server_error'}})
+        else:
+            record['rule'] = rule.name
+            include_usage = bool(request.get('stream_options', {}).get('include_usage'))
+            self.stream_response(rule, response, turn, include_usage, record)
+
+        record['finished'] = time.monotonic()
+        self.server.record(record)
+
+    def send_json(self, status: int, body: dict, headers: Optional[dict] = None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_event(self, data: dict):
+        event = b'data: ' + json.dumps(data).encode('utf-8') + b'\n\n'
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(event), event))
+
+    def stream_response(self, rule: Rule, response: str, turn: str, include_usage: bool, record: dict):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        time.sleep(rule.options['ttft'])
+        tokens = TOKEN_PATTERN.findall(response)
+        tokens_per_sec = rule.options['tokens_per_sec']
+        start = time.monotonic()
+        record['first_token'] = start
+
+        chunk = {'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'model': 'mock',
+                 'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None}]}
+        self.send_event(chunk)
+        for i, token in enumerate(tokens):
+            if tokens_per_sec:
+                delay = start + i / tokens_per_sec - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            chunk['choices'] = [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]
+            self.send_event(chunk)
+
+        chunk['choices'] = [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]
+        self.send_event(chunk)
+        if include_usage:
+            self.send_event({'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'model': 'mock', 'choices': [],
+                             'usage': {'prompt_tokens': len(turn) // 4, 'completion_tokens': len(tokens),
+                                       'total_tokens': len(turn) // 4 + len(tokens)}})
+        event = b'data: [DONE]\n\n'
+        self.wfile.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(event), event))
+        record['completion_tokens'] = len(tokens)
+
+    def log_message(self, *args):
+        pass
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """
+    Local OpenAI-compatible chat completions server, see the module docstring for the scenario format.
+
+    >>> with MockLLMServer(scenario) as server:
+    ...     os.environ['OPENAI_ENDPOINT'] = server.url
+    ...     ...
+    >>> print(server.requests)
+    """
+    daemon_threads = True
+
+    def __init__(self, scenario: dict, host: str = '127.0.0.1', port: int = 0):
+        super().__init__((host, port), MockLLMHandler)
+        defaults = {**DEFAULTS, **scenario.get('defaults', {})}
+        self.rules = [Rule(config, defaults) for config in scenario.get('responses', [])]
+        self.random = random.Random(scenario.get('seed'))
+        self.requests = []
+        self.lock = Lock()
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.server_address[0]}:{self.server_address[1]}/v1/chat/completions'
+
+    def choose_response(self, turn: str) -> tuple[Optional[Rule], Optional[str], Optional[str]]:
+        """
+        Find the rule matching the request and decide whether to inject a failure.
+
+        :return: (rule, response, failure), failure is None, "error" or "rate_limit"
+        """
+        with self.lock:
+            rule = next((rule for rule in self.rules if rule.matches(turn)), None)
+            if rule is None:
+                return None, None, None
+            roll = self.random.random()
+            if roll < rule.options['rate_limit_rate']:
+                return rule, None, 'rate_limit'
+            if roll < rule.options['rate_limit_rate'] + rule.options['error_rate']:
+                return rule, None, 'error'
+            return rule, rule.next_response(), None
+
+    def record(self, record: dict):
+        with self.lock:
+            self.requests.append(record)
+
+    def start(self) -> 'MockLLMServer':
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> 'MockLLMServer':
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
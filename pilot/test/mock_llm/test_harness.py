@@ -0,0 +1,26 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from test.mock_llm.harness import run_scenario
+
+SCENARIOS_DIR = Path(__file__).parent / 'scenarios'
+
+
+@pytest.mark.slow
+def test_hello_world_scenario():
+    """
+    Run GPT Pilot end to end (in a subprocess) against the mock LLM server.
+
+    Run with: pytest -s -m slow test/mock_llm/test_harness.py
+    """
+    scenario = json.loads((SCENARIOS_DIR / 'hello_world.json').read_text())
+    scenario['defaults'] = {'ttft': 0, 'tokens_per_sec': 0}
+
+    report = run_scenario(scenario)
+
+    assert report['success'], report['output']
+    assert len(report['requests']) == len(scenario['responses'])
+    print(f"\nWall time {report['wall_time']:.2f}s, LLM wait time {report['llm_time']:.2f}s, "
+          f"overhead {report['overhead']:.2f}s")
@@ -0,0 +1,99 @@
+import builtins
+import time
+
+import pytest
+import requests
+
+from helpers.Project import Project
+from main import get_custom_print
+from test.mock_llm.harness import get_busy_time
+from test.mock_llm.server import MockLLMServer, get_prompt_signature
+from utils.llm_connection import stream_gpt_completion
+from utils.llm_router import LLMEndpoint, LLMRouter
+from utils.utils import get_prompt
+
+
+@pytest.fixture
+def mock_llm():
+    servers = []
+
+    def start(scenario):
+        server = MockLLMServer(scenario).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.stop()
+
+
+def send(server, content, project):
+    router = LLMRouter([LLMEndpoint('mock', url=server.url, api_key='mock')])
+    data = {'messages': [{'role': 'system', 'content': 'You are a helpful assistant.'},
+                         {'role': 'user', 'content': content}]}
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr('utils.llm_connection.llm_router', router)
+        return stream_gpt_completion(data, '', project)
+
+
+@pytest.fixture
+def project():
+    builtins.print, _ = get_custom_print({})
+    return Project({'app_id': 'test-app'})
+
+
+def test_prompt_signature_is_found_in_rendered_prompt():
+    signature = get_prompt_signature('development/get_run_command.prompt')
+
+    assert signature in get_prompt('development/get_run_command.prompt', {})
+    assert signature not in get_prompt('development/define_user_review_goal.prompt', {'os': 'Linux'})
+
+
+def test_streams_scripted_responses(mock_llm, project):
+    server = mock_llm({'responses': [
+        {'prompt': 'development/get_run_command.prompt', 'response': {'command': 'python3 hello.py'}},
+        {'match': 'Hello', 'responses': ['Hi there!', 'Hi again!']},
+    ]})
+
+    assert send(server, get_prompt('development/get_run_command.prompt', {}), project) == {
+        'text': '{"command": "python3 hello.py"}'
+    }
+    assert [send(server, 'Hello', project)['text'] for _ in range(3)] == ['Hi there!', 'Hi again!', 'Hi again!']
+    assert [request['status'] for request in server.requests] == [200] * 4
+
+
+def test_response_timing(mock_llm, project):
+    server = mock_llm({'defaults': {'ttft': 0.3, 'tokens_per_sec': 50}, 'responses': [
+        {'match': '', 'response': 'one two three four five six seven eight nine ten eleven'},
+    ]})
+
+    start = time.monotonic()
+    send(server, 'Count to eleven', project)
+
+    [request] = server.requests
+    assert request['completion_tokens'] == 11
+    assert request['first_token'] - request['received'] == pytest.approx(0.3, abs=0.05)
+    # 10 gaps between the tokens at 50 tokens/sec
+    assert request['finished'] - request['first_token'] == pytest.approx(0.2, abs=0.05)
+    assert time.monotonic() - start >= 0.5
+
+
+@pytest.mark.parametrize(('rule', 'status'), [
+    ({'match': '', 'response': 'OK', 'error_rate': 1}, 500),
+    ({'match': '', 'response': 'OK', 'rate_limit_rate': 1, 'retry_after': 2}, 429),
+    ({'match': 'something else', 'response': 'OK'}, 400),
+])
+def test_failures(mock_llm, rule, status):
+    server = mock_llm({'responses': [rule]})
+
+    response = requests.post(server.url, json={'messages': [{'role': 'user', 'content': 'Hello'}]})
+
+    assert response.status_code == status
+    if status == 429:
+        assert response.headers['retry-after-ms'] == '2000'
+        assert response.json()['error']['code'] == 'rate_limit_exceeded'
+
+
+def test_busy_time_merges_overlapping_intervals():
+    assert get_busy_time([(0, 1), (0.5, 2), (3, 4), (3.5, 3.6)]) == 3
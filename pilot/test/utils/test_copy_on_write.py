@@ -0,0 +1,68 @@
+import json
+
+from utils.copy_on_write import copy_on_write, freeze, CopyOnWriteDict, CopyOnWriteList
+
+
+def get_data():
+    return {
+        'name': 'TestApp',
+        'files': [
+            {'path': 'src', 'name': 'app.js', 'content': 'const app = express();'},
+            {'path': 'src', 'name': 'db.js', 'content': 'mongoose.connect(url);'},
+        ],
+        'steps': [{'type': 'save_file', 'save_file': {'content': 'print(1)'}}],
+    }
+
+
+def test_copy_on_write_modifications_dont_reach_original():
+    # Given
+    original = get_data()
+    data = copy_on_write(original)
+
+    # When
+    data['name'] = 'Other'
+    data['files'][0]['content'] = ''
+    data['files'].append({'path': '', 'name': 'new.js', 'content': ''})
+    for step in data['steps']:
+        step.get('save_file').update({'content': '...'})
+    data['files'][1].setdefault('lines_of_code', 1)
+    data['files'][1].pop('path')
+
+    # Then
+    assert original == get_data()
+    assert data['files'][0]['content'] == ''
+    assert data['steps'][0]['save_file']['content'] == '...'
+    assert data['files'][1] == {'name': 'db.js', 'content': 'mongoose.connect(url);', 'lines_of_code': 1}
+    assert len(data['files']) == 3
+
+
+def test_copy_on_write_shares_values():
+    # Given
+    original = get_data()
+
+    # When
+    data = copy_on_write(original)
+
+    # Then the file contents aren't copied
+    assert data['files'][0]['content'] is original['files'][0]['content']
+    assert isinstance(data['files'], CopyOnWriteList)
+    assert all(isinstance(file, CopyOnWriteDict) for file in data['files'])
+    # And the copy serializes like the original
+    assert json.dumps(data) == json.dumps(original)
+    assert repr(data['files'][1:]) == repr(original['files'][1:])
+
+
+def test_freeze():
+    # Given
+    original = get_data()
+    data = copy_on_write(original)
+
+    # When
+    frozen = freeze(original)
+
+    # Then
+    assert hash(frozen) == hash(freeze(data))
+    assert frozen == freeze(data)
+    data['steps'][0]['save_file']['content'] = '...'
+    assert frozen != freeze(data)
+    assert freeze({'a': [1]}) != freeze({'a': (1,)})
@@ -0,0 +1,94 @@
+from utils.file_relevance import FileIndex, select_relevant_files, tokenize
+
+
+def count_tokens(text):
+    return len(text.split())
+
+
+def create_file(name, content, path='src'):
+    return {'path': path, 'name': name, 'full_path': f'/app/{path}/{name}'.replace('//', '/'), 'content': content,
+            'lines_of_code': len(content.splitlines())}
+
+
+FILES = [
+    create_file('db.js', 'const mongoose = require("mongoose");\nmongoose.connect(process.env.MONGO_URL);'),
+    create_file('userRoutes.js', 'router.post("/login", loginUser);\nrouter.post("/register", registerUser);'),
+    create_file('app.js', 'const express = require("express");\nconst app = express();\napp.listen(3000);'),
+    create_file('README.md', 'Run npm start to start the server. ' * 10, path=''),
+]
+
+
+def create_index(files=FILES):
+    index = FileIndex()
+    for file in files:
+        index.update(file['full_path'], f"{file['path']}/{file['name']}", file['content'])
+    return index
+
+
+def test_tokenize_splits_identifiers():
+    assert tokenize('getUserName(HTTPServer, user_id, x)') == [
+        'getusername', 'get', 'user', 'name', 'httpserver', 'http', 'server', 'user_id', 'user', 'id',
+    ]
+
+
+def test_scores_rank_files_by_relevance():
+    scores = create_index().get_scores('Add a user login endpoint')
+
+    assert max(scores, key=scores.get) == '/app/src/userRoutes.js'
+    assert scores['/app/src/db.js'] == 0
+
+
+def test_path_terms_are_weighted():
+    scores = create_index().get_scores('Update the readme')
+
+    assert max(scores, key=scores.get) == '/app/README.md'
+
+
+def test_index_is_updated_incrementally():
+    index = create_index()
+    index.update('/app/src/db.js', 'src/db.js', 'const { Pool } = require("pg");')
+    index.remove('/app/src/app.js')
+    index.update('/app/src/models.js', 'src/models.js', 'const userSchema = new mongoose.Schema({});')
+
+    scores = index.get_scores('mongoose')
+
+    assert set(scores) == {'/app/src/db.js', '/app/src/userRoutes.js', '/app/src/models.js', '/app/README.md'}
+    assert scores['/app/src/db.js'] == 0
+    assert scores['/app/src/models.js'] > 0
+    # the freed document id was reused
+    assert len(index.doc_keys) == 4
+    assert create_index().get_scores('mongoose') != scores
+
+
+def test_all_files_selected_if_they_fit():
+    selected, other = select_relevant_files(FileIndex(), FILES, 'login', count_tokens, max_tokens=1000, max_files=10)
+
+    assert selected == FILES
+    assert other == []
+
+
+def test_most_relevant_files_selected_within_budget():
+    index = FileIndex()
+
+    selected, other = select_relevant_files(index, FILES, 'Connect to the database with mongoose and express',
+                                            count_tokens, max_tokens=14, max_files=None)
+
+    assert [file['name'] for file in selected] == ['db.js', 'app.js']
+    assert [file['name'] for file in other] == ['userRoutes.js', 'README.md']
+    assert len(index) == len(FILES)
+
+
+def test_max_files_limits_selection():
+    selected, other = select_relevant_files(FileIndex(), FILES, 'login user', count_tokens, max_tokens=None,
+                                            max_files=1)
+
+    assert [file['name'] for file in selected] == ['userRoutes.js']
+    assert len(other) == 3
+
+
+def test_deleted_files_are_removed_from_index():
+    index = create_index()
+
+    select_relevant_files(index, FILES[:2], 'login', count_tokens, max_tokens=None, max_files=None)
+
+    assert set(index.doc_ids) == {'/app/src/db.js', '/app/src/userRoutes.js'}
@@ -0,0 +1,105 @@
+import pytest
+
+from utils.file_relevance import FileIndex
+from utils.file_resolver import SymbolIndex, extract_symbols, resolve_file
+
+
+def create_file(path, name, content):
+    return {'path': path, 'name': name, 'full_path': f'/app/{path}/{name}'.replace('//', '/'), 'content': content,
+            'lines_of_code': len(content.splitlines())}
+
+
+FILES = [
+    create_file('', 'server.js', 'const express = require("express");\nconst app = express();\n'
+                                 'app.use("/api/users", userRoutes);\napp.listen(3000);'),
+    create_file('routes', 'userRoutes.js', 'router.post("/login", async (req, res) => {});\n'
+                                           'router.post("/register", registerUser);'),
+    create_file('controllers', 'userController.js', 'async function registerUser(req, res) {\n'
+                                                    '  const user = await User.create(req.body);\n}\n'
+                                                    'exports.hashPassword = (password) => bcrypt.hash(password);'),
+    create_file('models', 'User.js', 'const userSchema = new mongoose.Schema({ email: String, password: String });'),
+    create_file('', 'app.py', 'class TodoList:\n    def add_item(self, item):\n        pass\n\n'
+                              '@app.route("/todos")\ndef list_todos():\n    pass'),
+]
+
+
+def resolve(description, files=FILES):
+    return resolve_file(description, files, FileIndex(), SymbolIndex())
+
+
+def test_extract_symbols():
+    assert extract_symbols('userRoutes.js', FILES[1]['content']) == {'/login', '/register'}
+    assert extract_symbols('userController.js', FILES[2]['content']) == {'registerUser', 'hashPassword'}
+    assert extract_symbols('app.py', FILES[4]['content']) == {'TodoList', 'add_item', 'list_todos', '/todos'}
+    assert extract_symbols('README.md', '# function main()') == set()
+
+
+@pytest.mark.parametrize(
+    ("description", "expected_path", "expected_reason"),
+    [
+        ("In routes/userRoutes.js, validate the request body", "routes/userRoutes.js", "path"),
+        ("Add input validation to `userRoutes.js`.", "routes/userRoutes.js", "path"),
+        ("Fix the registerUser function so it returns 201", "controllers/userController.js", "symbol"),
+        ("The /login route should return a JWT token", "routes/userRoutes.js", "symbol"),
+        ("Make add_item() skip duplicates", "app.py", "symbol"),
+        ("Add a unique index on the email field in the mongoose schema", "models/User.js", "lexical"),
+    ],
+)
+def test_resolve_file(description, expected_path, expected_reason):
+    resolution = resolve(description)
+
+    assert resolution.path == expected_path
+    assert resolution.reason == expected_reason
+    assert resolution.confidence >= 0.6
+
+
+def test_resolve_file_prefers_symbols_among_mentioned_files():
+    resolution = resolve("Import registerUser from userController.js in userRoutes.js and use it for registerUser")
+
+    assert resolution.path == "controllers/userController.js"
+    assert resolution.reason == "symbol"
+
+
+def test_weak_lexical_match_is_not_confident():
+    files = [
+        create_file('public', 'index.html', '<ul class="todo-list"></ul>'),
+        FILES[0],
+    ]
+
+    # Only one of the words of the description is in one of the files
+    resolution = resolve("Add input validation so an empty todo item can't be submitted", files)
+
+    assert resolution.path == "public/index.html"
+    assert resolution.reason == "lexical"
+    assert resolution.confidence < 0.6
+
+
+@pytest.mark.parametrize(
+    "description",
+    [
+        "Create utils/validation.js with the email validation helpers",
+        "Start the app",
+    ],
+)
+def test_unresolved_file(description):
+    resolution = resolve(description)
+
+    assert resolution.path is None or resolution.confidence < 0.6
+
+
+def test_technology_names_are_not_files():
+    resolution = resolve("Use Node.js and Express.js to handle the /register route")
+
+    assert resolution.path == "routes/userRoutes.js"
+
+
+def test_symbol_index_is_updated():
+    index = SymbolIndex()
+    resolve_file("registerUser", FILES, FileIndex(), index)
+    assert index.owners['registerUser'] == {'/app/controllers/userController.js'}
+
+    files = [dict(FILES[2], content='function createUser() {}')]
+    resolve_file("createUser", files, FileIndex(), index)
+    assert 'registerUser' not in index.owners
+    assert index.owners['createUser'] == {'/app/controllers/userController.js'}
+    assert set(index.contents) == {'/app/controllers/userController.js'}
@@ -0,0 +1,124 @@
+import json
+
+import pytest
+from jsonschema import ValidationError
+
+from const.function_calls import DEVELOPMENT_PLAN
+from utils.json_stream import StreamingJsonValidator
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'type': {'type': 'string', 'enum': ['command', 'code_change']},
+        'steps': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {'name': {'type': 'string'}, 'timeout': {'type': 'number'}},
+                'required': ['name'],
+            },
+        },
+    },
+    'required': ['type'],
+}
+
+
+def feed_chars(validator, text):
+    for c in text:
+        validator.feed(c)
+
+
+@pytest.mark.parametrize('response', [
+    '{"type": "command", "steps": [{"name": "npm \\"install\\"\\n", "timeout": 1.5e3}, {"name": "\\u00e9"}]}',
+    '```json\n{\n  "type": "code_change",\n  "steps": []\n}\n```',
+    'Here is the plan:\n{"type": "command", "enabled": True}',
+])
+def test_valid_response(response):
+    # Fed all at once and character by character
+    StreamingJsonValidator(SCHEMA).feed(response)
+    feed_chars(StreamingJsonValidator(SCHEMA), response)
+
+
+def test_incomplete_response_is_not_an_error():
+    validator = StreamingJsonValidator(SCHEMA)
+    validator.feed('{"type": "command", "steps": [{"name": "np')
+    assert validator.state == 'string'
+
+
+def test_invalid_enum_fails_as_soon_as_value_is_complete():
+    validator = StreamingJsonValidator(SCHEMA)
+    validator.feed('{"type": "human_interven')
+
+    with pytest.raises(ValidationError) as err:
+        validator.feed('tion"')
+
+    assert err.value.json_path == '$.type'
+
+
+def test_missing_required_key_fails_when_object_is_closed():
+    validator = StreamingJsonValidator(SCHEMA)
+    validator.feed('{"type": "command", "steps": [{"timeout": 10')
+
+    with pytest.raises(ValidationError) as err:
+        validator.feed('}')
+
+    assert err.value.json_path == '$.steps[0]'
+    assert "'name' is a required property" in err.value.message
+
+
+def test_invalid_value():
+    validator = StreamingJsonValidator(SCHEMA)
+
+    with pytest.raises(json.JSONDecodeError) as err:
+        feed_chars(validator, '{"type": undefined,')
+
+    # Handled by retry_on_exception() as "Invalid value: `undefined`"
+    assert err.value.msg == 'Expecting value'
+    assert err.value.doc[err.value.pos:] == 'undefined,'
+
+
+def test_error_in_long_streamed_response():
+    validator = StreamingJsonValidator(None)
+    text = '{"steps": [' + ', '.join(['"step"'] * 10000) + ']]'
+
+    with pytest.raises(json.JSONDecodeError) as err:
+        feed_chars(validator, text)
+
+    assert err.value.doc == text
+    assert err.value.pos == len(text) - 1
+
+
+def test_missing_delimiter_is_not_reported_as_incomplete():
+    validator = StreamingJsonValidator(SCHEMA)
+
+    with pytest.raises(json.JSONDecodeError) as err:
+        validator.feed('{"type": "command" "steps": []}')
+
+    assert not err.value.msg.startswith('Expecting')
+    assert err.value.pos == len('{"type": "command" ')
+
+
+@pytest.mark.parametrize(('response', 'message'), [
+    ('{"type": "comm\\xd800"}', 'Invalid \\escape'),
+    ('{"type": "comm\nand"}', 'Invalid control character at'),
+    ('{"type": "command"}\n```\nHope this helps!', 'Extra data'),
+])
+def test_invalid_json(response, message):
+    with pytest.raises(json.JSONDecodeError) as err:
+        feed_chars(StreamingJsonValidator(SCHEMA), response)
+
+    assert err.value.msg == message
+
+
+def test_continues_from_initial_buffer():
+    validator = StreamingJsonValidator(SCHEMA, '{"type": "com')
+
+    with pytest.raises(ValidationError):
+        validator.feed('mand_test"}')
+
+
+def test_development_plan():
+    schema = DEVELOPMENT_PLAN['definitions'][0]['parameters']
+    plan = {'plan': [{'description': f'Task {i}', 'user_review_goal': 'It works'} for i in range(20)]}
+
+    feed_chars(StreamingJsonValidator(schema), json.dumps(plan, indent=2))
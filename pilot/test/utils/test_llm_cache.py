@@ -0,0 +1,153 @@
+import os
+from pathlib import Path
+from threading import Event, Thread
+import time
+from unittest.mock import patch
+
+import pytest
+
+from utils.llm_cache import LLMCache
+
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+def test_get_key_depends_on_request():
+    key = LLMCache.get_key("gpt-4", MESSAGES, None, 0)
+    assert key == LLMCache.get_key("gpt-4", [dict(m) for m in MESSAGES], None, 0)
+    assert key != LLMCache.get_key("gpt-3.5", MESSAGES, None, 0)
+    assert key != LLMCache.get_key("gpt-4", MESSAGES, [{"name": "fn"}], 0)
+    assert key != LLMCache.get_key("gpt-4", MESSAGES, None, 0.5)
+    assert key != LLMCache.get_key("gpt-4", MESSAGES + MESSAGES, None, 0)
+
+
+@pytest.mark.parametrize(
+    ("enabled", "cache_nondeterministic", "temperature", "expected"),
+    [
+        (False, False, 0, False),
+        (True, False, 0, True),
+        (True, False, 0.7, False),
+        (True, True, 0.7, True),
+    ],
+)
+def test_is_cacheable(tmp_path, enabled, cache_nondeterministic, temperature, expected):
+    cache = LLMCache(tmp_path, enabled=enabled, cache_nondeterministic=cache_nondeterministic)
+    assert cache.is_cacheable(temperature) == expected
+
+
+@patch("utils.llm_cache.telemetry")
+def test_get_or_compute_caches_response(mock_telemetry, tmp_path):
+    cache = LLMCache(tmp_path, enabled=True)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"text": "response"}
+
+    assert cache.get_or_compute("abc", compute) == {"text": "response"}
+    assert cache.get_or_compute("abc", compute) == {"text": "response"}
+    # survives a restart
+    assert LLMCache(tmp_path, enabled=True).get("abc") == {"text": "response"}
+
+    assert len(calls) == 1
+    mock_telemetry.inc.assert_any_call("num_llm_cache_misses")
+    mock_telemetry.inc.assert_any_call("num_llm_cache_hits")
+
+
+def test_expired_entries_are_ignored(tmp_path):
+    cache = LLMCache(tmp_path, enabled=True, ttl=60)
+    cache.set("abc", {"text": "response"})
+
+    with patch("utils.llm_cache.time.time", return_value=time.time() + 61):
+        assert cache.get("abc") is None
+    assert not cache._path("abc").exists()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = LLMCache(tmp_path, enabled=True)
+    cache.set("aa1", {"text": "x" * 100})
+    # room for two entries (their size may differ by a few bytes), but not three
+    cache.max_size = cache.total_size * 2 + 10
+
+    cache.set("bb2", {"text": "x" * 100})
+    # make sure mtime differs even on filesystems with coarse timestamps
+    past = time.time() - 100
+    os.utime(cache._path("aa1"), (past, past))
+    os.utime(cache._path("bb2"), (past + 1, past + 1))
+    cache.get("aa1")
+
+    cache.set("cc3", {"text": "x" * 100})
+
+    assert cache.get("aa1") is not None
+    assert cache.get("bb2") is None
+    assert cache.get("cc3") is not None
+    assert cache.total_size <= cache.max_size
+
+
+def test_overwriting_an_entry_replaces_its_size(tmp_path):
+    cache = LLMCache(tmp_path, enabled=True)
+    cache.set("aa1", {"text": "x" * 100})
+    cache.set("bb2", {"text": "x" * 100})
+
+    cache.set("aa1", {"text": "x" * 1000})
+    cache.set("aa1", {"text": "x" * 10})
+
+    assert cache.total_size == cache._calculate_size()
+
+
+def test_eviction_skips_entries_removed_in_the_meantime(tmp_path):
+    cache = LLMCache(tmp_path, enabled=True)
+    cache.set("aa1", {"text": "x" * 100})
+    cache.max_size = cache.total_size + 10
+    # eg. expired and removed by another process sharing the cache
+    removed = cache._path("bb2")
+    glob = Path.glob
+
+    with patch.object(Path, "glob", autospec=True, side_effect=lambda self, pattern: [*glob(self, pattern), removed]):
+        cache.set("cc3", {"text": "x" * 100})
+
+    assert cache.get("aa1") is None
+    assert cache.get("cc3") == {"text": "x" * 100}
+    assert cache.total_size == cache._calculate_size()
+
+
+@patch("utils.llm_cache.telemetry")
+def test_concurrent_identical_requests_are_coalesced(mock_telemetry, tmp_path):
+    cache = LLMCache(tmp_path, enabled=True)
+    started = Event()
+    release = Event()
+    calls = []
+    results = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"text": "response"}
+
+    owner = Thread(target=lambda: results.append(cache.get_or_compute("abc", compute)))
+    owner.start()
+    started.wait(5)
+    waiters = [Thread(target=lambda: results.append(cache.get_or_compute("abc", compute))) for _ in range(3)]
+    for waiter in waiters:
+        waiter.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in [owner] + waiters:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [{"text": "response"}] * 4
+
+
+def test_errors_are_propagated_and_not_cached(tmp_path):
+    cache = LLMCache(tmp_path, enabled=True)
+
+    def compute():
+        raise ValueError("API error")
+
+    with pytest.raises(ValueError):
+        cache.get_or_compute("abc", compute)
+
+    assert cache.get("abc") is None
+    assert cache.in_flight == {}
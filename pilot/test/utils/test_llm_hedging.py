@@ -0,0 +1,141 @@
+from threading import Event
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from utils.llm_hedging import RequestHedger, has_content
+
+CONTENT_LINE = b'{"choices": [{"index": 0, "delta": {"content": "Hi"}}]}'
+ROLE_LINE = b'{"choices": [{"index": 0, "delta": {"role": "assistant"}}]}'
+
+
+def create_response(name, first_token_delay=0.0):
+    """
+    Streamed response which starts sending content after `first_token_delay` seconds.
+    """
+    closed = Event()
+
+    def iter_content(chunk_size):
+        yield b'data: ' + ROLE_LINE + b'\n\n'
+        if closed.wait(first_token_delay):
+            return
+        yield b'data: ' + CONTENT_LINE + b'\n\n'
+        yield f'data: {{"choices": [{{"index": 0, "delta": {{"content": " from {name}"}}}}]}}\n\n'.encode('utf-8')
+
+    response = Mock(status_code=200)
+    response.name = name
+    response.iter_content.side_effect = iter_content
+    response.close.side_effect = closed.set
+    return response
+
+
+def create_hedger(samples=(0.1,) * 10, **kwargs):
+    hedger = RequestHedger(enabled=True, min_samples=10, min_delay=0, **kwargs)
+    for ttft in samples:
+        hedger.record_ttft('coding', ttft)
+    return hedger
+
+
+@pytest.mark.parametrize(('line', 'expected'), [
+    (CONTENT_LINE, True),
+    (ROLE_LINE, False),
+    (b'{"choices": [], "usage": {"total_tokens": 10}}', False),
+    (b'{"error": {"message": "Overloaded"}}', True),
+    (b'[1, 2]', False),
+    (b'not json', False),
+])
+def test_has_content(line, expected):
+    assert has_content(line) is expected
+
+
+def test_threshold_is_percentile_of_recent_ttfts():
+    hedger = RequestHedger(enabled=True, percentile=90, min_samples=5, min_delay=0.5)
+    assert hedger.get_threshold('coding') is None
+
+    for ttft in [0.1, 0.2, 0.3, 0.4, 0.6, 0.8, 1.0, 1.2, 2.0, 30.0]:
+        hedger.record_ttft('coding', ttft)
+
+    assert hedger.get_threshold('coding') == 2.0
+    # other request types fall back to all samples until they have enough of their own
+    assert hedger.get_threshold('architecture') == 2.0
+
+    for _ in range(5):
+        hedger.record_ttft('architecture', 0.1)
+    # but never less than min_delay
+    assert hedger.get_threshold('architecture') == 0.5
+
+
+def test_no_hedging_without_enough_samples():
+    hedger = create_hedger(samples=[])
+    send_request = Mock(return_value=(create_response('primary'), 'endpoint', {}))
+
+    response, _, _, lines = hedger.send('coding', send_request)
+
+    send_request.assert_called_once_with(False)
+    assert response.name == 'primary'
+
+
+def test_fast_request_is_not_hedged():
+    hedger = create_hedger()
+    send_request = Mock(side_effect=lambda hedge: (create_response('primary'), 'endpoint', {}))
+
+    response, _, _, lines = hedger.send('coding', send_request)
+
+    send_request.assert_called_once_with(False)
+    assert response.name == 'primary'
+    assert list(lines)[:2] == [ROLE_LINE, CONTENT_LINE]
+
+
+def test_slow_request_is_hedged():
+    hedger = create_hedger()
+    responses = {False: create_response('primary', first_token_delay=5), True: create_response('hedge')}
+
+    start = time.time()
+    response, endpoint, _, lines = hedger.send('coding', lambda hedge: (responses[hedge], f'endpoint-{hedge}', {}))
+
+    # the hedged request started streaming first and the original one was cancelled
+    assert time.time() - start < 2
+    assert response.name == 'hedge'
+    assert endpoint == 'endpoint-True'
+    assert list(lines)[-1] == b'{"choices": [{"index": 0, "delta": {"content": " from hedge"}}]}'
+    responses[False].close.assert_called_once()
+    assert hedger.hedges_sent == {'coding': 1}
+
+
+def test_hedging_is_capped_per_request_type():
+    hedger = create_hedger(max_per_type=5, caps={'coding': 1})
+
+    for _ in range(2):
+        responses = {False: create_response('primary', first_token_delay=0.3), True: create_response('hedge')}
+        response, _, _, _ = hedger.send('coding', lambda hedge: (responses[hedge], 'endpoint', {}))
+
+    # only the first request was hedged, the second one waited for the original response
+    assert response.name == 'primary'
+    assert hedger.hedges_sent == {'coding': 1}
+
+
+def test_hedge_is_used_if_original_fails():
+    hedger = create_hedger()
+
+    def send_request(hedge):
+        if not hedge:
+            time.sleep(0.3)
+            raise ConnectionError('Connection reset')
+        time.sleep(0.5)
+        return create_response('hedge'), 'endpoint', {}
+
+    response, _, _, _ = hedger.send('coding', send_request)
+
+    assert response.name == 'hedge'
+
+
+def test_error_is_raised_if_all_requests_fail():
+    hedger = create_hedger()
+
+    def send_request(hedge):
+        time.sleep(0.2)
+        raise ConnectionError(f'Failed (hedge={hedge})')
+
+    with pytest.raises(ConnectionError, match='hedge=False'):
+        hedger.send('coding', send_request)
@@ -0,0 +1,78 @@
+import json
+
+from utils.llm_latency import LatencyRecorder, LLMRequestTiming, summarize_timings, format_latency_report, \
+    percentile
+
+
+def make_timing(req_type='coding', prompt_path='development/implement_changes.prompt', **kwargs) -> dict:
+    return LLMRequestTiming(req_type, prompt_path, **{'endpoint': 'OPENAI', 'model': 'gpt-4', **kwargs}).to_dict()
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile(list(range(1, 101)), 95) == 95
+
+
+def test_summarize_timings_per_prompt():
+    timings = [
+        make_timing(ttft=1, tokens_per_sec=40, connect_time=0.2),
+        make_timing(ttft=2, tokens_per_sec=50, connect_time=0),
+        make_timing(ttft=None, is_error=True, retries=0, endpoint='OPENROUTER'),
+        make_timing(ttft=3, tokens_per_sec=60, connect_time=0, retries=1),
+        make_timing('architecture', 'architecture/technologies.prompt', ttft=5),
+    ]
+
+    coding, architecture = summarize_timings(timings)
+
+    assert (coding['req_type'], coding['prompt_path']) == ('coding', 'development/implement_changes.prompt')
+    assert (coding['num_requests'], coding['num_errors'], coding['num_retries']) == (4, 1, 1)
+    assert coding['endpoints'] == {'OPENAI': 3, 'OPENROUTER': 1}
+    # failed requests without a first token don't count towards the TTFT stats
+    assert coding['ttft'] == {'median': 2, 'p95': 3}
+    assert coding['connect_time'] == {'median': 0, 'p95': 0.2}
+    assert coding['streaming_time'] == {'median': None, 'p95': None}
+    assert architecture['num_requests'] == 1
+
+
+def test_summarize_timings_per_request_type():
+    timings = [
+        make_timing(prompt_path='development/implement_changes.prompt', ttft=1),
+        make_timing(prompt_path=None, ttft=3),
+    ]
+
+    [summary] = summarize_timings(timings, group_by=('req_type',))
+
+    assert summary['req_type'] == 'coding'
+    assert 'prompt_path' not in summary
+    assert summary['ttft'] == {'median': 1, 'p95': 3}
+
+
+def test_recorder_appends_to_log_and_reports(tmp_path):
+    log_path = tmp_path / 'latency.jsonl'
+    recorder = LatencyRecorder(log_path=str(log_path))
+
+    recorder.record(LLMRequestTiming('coding', 'development/implement_changes.prompt', endpoint='OPENAI', ttft=1.5))
+    recorder.record(LLMRequestTiming('coding', None, endpoint='OPENAI', is_error=True))
+
+    logged = [json.loads(line) for line in log_path.read_text().splitlines()]
+    assert logged == recorder.get_timings()
+    assert logged[0]['ttft'] == 1.5
+
+    report = recorder.report()
+    assert 'for 2 requests' in report
+    assert 'coding development/implement_changes.prompt' in report
+    assert '1.50' in report
+
+
+def test_recorder_keeps_latest_timings():
+    recorder = LatencyRecorder(log_path=None, max_timings=2)
+
+    for ttft in [1, 2, 3]:
+        recorder.record(LLMRequestTiming('coding', None, ttft=ttft))
+
+    assert [timing['ttft'] for timing in recorder.get_timings()] == [2, 3]
+
+
+def test_report_without_timings():
+    assert format_latency_report([]).startswith('LLM request latency (seconds, medians unless noted) for 0 requests')
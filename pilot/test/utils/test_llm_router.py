@@ -0,0 +1,254 @@
+import builtins
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from threading import Thread
+import time
+from unittest.mock import patch
+
+import pytest
+
+from const.llm import MAX_GPT_MODEL_TOKENS
+from helpers.exceptions import InvalidLLMEndpointsError
+from helpers.Project import Project
+from main import get_custom_print
+from utils.llm_connection import stream_gpt_completion
+from utils.llm_hedging import RequestHedger
+from utils.llm_router import LLMEndpoint, LLMRouter
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Chat completions endpoint with configurable latency and status code.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.num_requests += 1
+        time.sleep(self.server.delay)
+
+        if self.server.status != 200:
+            body = b'{"error": {"message": "Internal server error"}}'
+            self.send_response(self.server.status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        chunk = json.dumps({'choices': [{'delta': {'content': self.server.content}}]})
+        body = f'data: {chunk}\n\ndata: [DONE]\n\n'.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_servers():
+    servers = []
+
+    def start(content, delay=0.0, status=200):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        server.content = content
+        server.delay = delay
+        server.status = status
+        server.num_requests = 0
+        Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, f'http://127.0.0.1:{server.server_address[1]}/v1/chat/completions'
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def project():
+    builtins.print, _ = get_custom_print({})
+    return Project({'app_id': 'test-app'})
+
+
+def use_router(router):
+    return patch('utils.llm_connection.llm_router', router)
+
+
+def test_candidates_prefer_fastest_healthy_endpoint():
+    router = LLMRouter([LLMEndpoint('a'), LLMEndpoint('b'), LLMEndpoint('c')], alpha=0.5)
+
+    # unmeasured endpoints keep the configured order
+    assert [endpoint.name for endpoint in router.candidates()] == ['a', 'b', 'c']
+
+    router.record_success('a', ttft=2.0, tokens_per_sec=50)
+    router.record_success('b', ttft=0.5, tokens_per_sec=100)
+    router.record_success('c', ttft=0.2, tokens_per_sec=10)
+    assert [endpoint.name for endpoint in router.candidates()] == ['b', 'a', 'c']
+
+    router.record_failure('b')
+    assert [endpoint.name for endpoint in router.candidates()] == ['a', 'c', 'b']
+
+
+def test_ewma():
+    router = LLMRouter([LLMEndpoint('a')], alpha=0.5)
+
+    router.record_success('a', ttft=1.0, tokens_per_sec=100)
+    router.record_success('a', ttft=3.0, tokens_per_sec=50)
+
+    assert router.stats['a'].ttft == 2.0
+    assert router.stats['a'].tokens_per_sec == 75
+
+
+@patch('utils.llm_router.time.monotonic')
+def test_failed_endpoint_recovers_after_cooldown(mock_monotonic):
+    router = LLMRouter([LLMEndpoint('a'), LLMEndpoint('b')], cooldown=10, max_cooldown=15)
+    mock_monotonic.return_value = 100.0
+
+    router.record_failure('a')
+    assert [endpoint.name for endpoint in router.candidates()] == ['b', 'a']
+
+    # consecutive failures double the cooldown, up to max_cooldown
+    router.record_failure('a')
+    assert router.stats['a'].unhealthy_until == 115.0
+
+    mock_monotonic.return_value = 116.0
+    assert [endpoint.name for endpoint in router.candidates()] == ['a', 'b']
+
+
+def test_default_endpoint_from_env(monkeypatch):
+    monkeypatch.setenv('ENDPOINT', 'OPENROUTER')
+    monkeypatch.setenv('OPENROUTER_API_KEY', 'secret')
+    monkeypatch.setenv('MODEL_NAME', 'openai/gpt-4')
+
+    [endpoint] = LLMRouter().candidates()
+    url, headers, data = endpoint.prepare_request({'messages': []})
+
+    assert endpoint.name == 'OPENROUTER'
+    assert url == 'https://openrouter.ai/api/v1/chat/completions'
+    assert headers['Authorization'] == 'Bearer secret'
+    assert data['model'] == 'openai/gpt-4'
+
+
+def test_openrouter_endpoint_drops_unsupported_params(monkeypatch):
+    # The default endpoint is OpenAI, OpenRouter is one of the routed endpoints
+    monkeypatch.setenv('ENDPOINT', 'OPENAI')
+    endpoint = LLMEndpoint('openrouter', 'OPENROUTER', api_key='secret', model='openai/gpt-4')
+    data = {'messages': [], 'n': 1, 'temperature': 0.7, 'top_p': 1, 'presence_penalty': 0, 'frequency_penalty': 0}
+
+    _, _, request_data = endpoint.prepare_request(data)
+
+    assert request_data == {'messages': [], 'max_tokens': MAX_GPT_MODEL_TOKENS, 'model': 'openai/gpt-4'}
+
+
+def test_endpoints_config_is_parsed_on_first_use():
+    router = LLMRouter(config='[{"name": "a"}, {"name": "b", "type": "OPENROUTER"}]')
+
+    assert [(endpoint.name, endpoint.type) for endpoint in router.candidates()] == [('a', 'OPENAI'), ('b', 'OPENROUTER')]
+
+
+@pytest.mark.parametrize('config, reason', [
+    ('[{"name": "a"', 'not valid JSON'),
+    ('{"name": "a"}', 'expected a non-empty list of endpoints'),
+    ('["a"]', "expected an object for each endpoint, got 'a'"),
+    ('[{"type": "OPENAI"}]', "missing 1 required positional argument: 'name'"),
+    ('[{"name": "a", "type": "openai"}]', 'Unknown LLM endpoint type openai'),
+    ('[{"name": "a"}, {"name": "a", "url": "http://localhost:8000"}]', 'duplicate endpoint names a'),
+])
+def test_invalid_endpoints_config(config, reason):
+    # Creating the router doesn't fail (it's created when the module is imported)
+    router = LLMRouter(config=config)
+
+    with pytest.raises(InvalidLLMEndpointsError) as err:
+        router.candidates()
+
+    assert str(err.value).startswith('Invalid LLM_ENDPOINTS configuration: ')
+    assert reason in err.value.reason
+
+
+@pytest.mark.parametrize('url, stream_usage, expected', [
+    (None, None, True),
+    ('http://localhost:8000/v1/chat/completions', None, False),
+    ('http://localhost:8000/v1/chat/completions', 'true', True),
+    (None, 'false', False),
+])
+def test_stream_usage_is_only_requested_from_openai_by_default(monkeypatch, url, stream_usage, expected):
+    monkeypatch.setenv('OPENAI_API_KEY', 'secret')
+    monkeypatch.delenv('OPENAI_ENDPOINT', raising=False)
+    endpoint = LLMEndpoint('openai', url=url)
+
+    with patch('utils.llm_router.LLM_STREAM_USAGE', stream_usage):
+        _, _, data = endpoint.prepare_request({'messages': []})
+
+    assert ('stream_options' in data) == expected
+
+
+def test_routes_to_fastest_endpoint(stub_servers, project):
+    slow_server, slow_url = stub_servers('slow', delay=0.3)
+    fast_server, fast_url = stub_servers('fast', delay=0.01)
+    router = LLMRouter([
+        LLMEndpoint('slow', url=slow_url, api_key='secret'),
+        LLMEndpoint('fast', url=fast_url, api_key='secret'),
+    ])
+
+    with use_router(router):
+        # both endpoints are measured first, then the faster one is used
+        responses = [stream_gpt_completion({'messages': []}, '', project)['text'] for _ in range(5)]
+
+    assert responses == ['slow', 'fast', 'fast', 'fast', 'fast']
+    assert router.stats['slow'].ttft > router.stats['fast'].ttft
+
+
+def test_fails_over_on_server_error(stub_servers, project):
+    broken_server, broken_url = stub_servers('broken', status=503)
+    ok_server, ok_url = stub_servers('ok')
+    router = LLMRouter([
+        LLMEndpoint('broken', url=broken_url, api_key='secret'),
+        LLMEndpoint('ok', url=ok_url, api_key='secret'),
+    ])
+
+    with use_router(router):
+        responses = [stream_gpt_completion({'messages': []}, '', project)['text'] for _ in range(3)]
+
+    assert responses == ['ok', 'ok', 'ok']
+    # the broken endpoint isn't retried while it's cooling down
+    assert broken_server.num_requests == 1
+
+
+def test_fails_over_on_connection_error(stub_servers, project):
+    ok_server, ok_url = stub_servers('ok')
+    router = LLMRouter([
+        LLMEndpoint('down', url='http://127.0.0.1:1/v1/chat/completions', api_key='secret'),
+        LLMEndpoint('ok', url=ok_url, api_key='secret'),
+    ])
+
+    with use_router(router):
+        response = stream_gpt_completion({'messages': []}, '', project)
+
+    assert response == {'text': 'ok'}
+    assert not router.stats['down'].is_healthy(time.monotonic())
+
+
+def test_slow_request_is_hedged_to_other_endpoint(stub_servers, project):
+    slow_server, slow_url = stub_servers('slow', delay=3)
+    fast_server, fast_url = stub_servers('fast')
+    router = LLMRouter([
+        LLMEndpoint('slow', url=slow_url, api_key='secret'),
+        LLMEndpoint('fast', url=fast_url, api_key='secret'),
+    ])
+    # the slow endpoint looks faster, so the request goes there first
+    router.record_success('slow', ttft=0.1)
+    router.record_success('fast', ttft=0.2)
+    hedger = RequestHedger(enabled=True, min_samples=1, min_delay=0.2)
+    hedger.record_ttft('coding', 0.1)
+
+    start = time.time()
+    with use_router(router), patch('utils.llm_connection.llm_hedger', hedger):
+        response = stream_gpt_completion({'messages': []}, 'coding', project)
+
+    assert response == {'text': 'fast'}
+    assert time.time() - start < 2
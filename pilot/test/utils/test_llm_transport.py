@@ -0,0 +1,202 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from threading import Thread
+import time
+
+import pytest
+import requests
+
+from utils.llm_transport import LLMTransport
+
+
+class SSEStubHandler(BaseHTTPRequestHandler):
+    """
+    Minimal chat completions endpoint streaming a fixed SSE response.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.num_connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        chunk = json.dumps({'choices': [{'delta': {'content': 'DONE'}}]})
+        body = f'data: {chunk}\n\ndata: [DONE]\n\n'.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('x-ratelimit-limit-requests', '200')
+        self.send_header('x-ratelimit-remaining-requests', '199')
+        self.send_header('x-ratelimit-reset-requests', '300ms')
+        self.send_header('x-ratelimit-limit-tokens', '40000')
+        self.send_header('x-ratelimit-remaining-tokens', '39000')
+        self.send_header('x-ratelimit-reset-tokens', '1.5s')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def sse_stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SSEStubHandler)
+    server.num_connections = 0
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f'http://127.0.0.1:{server.server_address[1]}/v1/chat/completions'
+    server.shutdown()
+    server.server_close()
+
+
+def stream_completion(post, url):
+    response = post(url, json={'messages': []}, stream=True, timeout=(5, 5))
+    lines = [line for line in response.iter_lines() if line]
+    assert response.status_code == 200
+    assert lines[-1] == b'data: [DONE]'
+
+
+def test_transport_reuses_connections(sse_stub):
+    server, url = sse_stub
+    transport = LLMTransport(pool_size=2)
+
+    for _ in range(5):
+        stream_completion(lambda *a, **kw: transport.post('OPENAI', *a, **kw), url)
+
+    assert server.num_connections == 1
+    transport.close()
+
+
+def test_transport_updates_rate_limits_from_headers(sse_stub):
+    server, url = sse_stub
+    transport = LLMTransport()
+
+    stream_completion(lambda *a, **kw: transport.post('OPENAI', *a, n_tokens=1000, **kw), url)
+
+    buckets = transport.rate_limiter.endpoints['OPENAI'].buckets
+    assert (buckets['requests'].capacity, buckets['requests'].level) == (200, 199)
+    assert (buckets['tokens'].capacity, buckets['tokens'].level) == (40000, 39000)
+    transport.close()
+
+
+def test_transport_keeps_separate_pool_per_endpoint(sse_stub):
+    server, url = sse_stub
+    transport = LLMTransport()
+
+    stream_completion(lambda *a, **kw: transport.post('OPENAI', *a, **kw), url)
+    stream_completion(lambda *a, **kw: transport.post('OPENROUTER', *a, **kw), url)
+    stream_completion(lambda *a, **kw: transport.post(None, *a, **kw), url)
+
+    assert set(transport.sessions) == {'OPENAI', 'OPENROUTER'}
+    assert server.num_connections == 2
+    transport.close()
+
+
+def test_transport_without_keep_alive(sse_stub):
+    server, url = sse_stub
+    transport = LLMTransport(keep_alive=False)
+
+    for _ in range(3):
+        stream_completion(lambda *a, **kw: transport.post('OPENAI', *a, **kw), url)
+
+    assert server.num_connections == 3
+    transport.close()
+
+
+def test_transport_evicts_idle_pools(sse_stub):
+    server, url = sse_stub
+    transport = LLMTransport(idle_timeout=0)
+
+    stream_completion(lambda *a, **kw: transport.post('OPENAI', *a, **kw), url)
+    first_session = transport.sessions['OPENAI']
+    time.sleep(0.01)
+    stream_completion(lambda *a, **kw: transport.post('OPENAI', *a, **kw), url)
+
+    assert transport.sessions['OPENAI'] is not first_session
+    assert server.num_connections == 2
+    transport.close()
+
+
+def test_transport_keeps_pools_with_requests_in_flight(sse_stub):
+    server, url = sse_stub
+    transport = LLMTransport(idle_timeout=0)
+
+    # a response still being streamed (longer than the idle timeout)
+    response = transport.post('OPENAI', url, json={'messages': []}, stream=True, timeout=(5, 5))
+    first_session = transport.sessions['OPENAI']
+    time.sleep(0.01)
+    stream_completion(lambda *a, **kw: transport.post('OPENAI', *a, **kw), url)
+
+    assert transport.sessions['OPENAI'] is first_session
+    assert transport.in_flight['OPENAI'] == 1
+    response.content
+    assert transport.in_flight['OPENAI'] == 0
+    transport.close()
+
+
+def test_transport_refreshes_last_used_when_response_is_done(sse_stub):
+    server, url = sse_stub
+    transport = LLMTransport(idle_timeout=0.05)
+
+    response = transport.post('OPENAI', url, json={'messages': []}, stream=True, timeout=(5, 5))
+    first_session = transport.sessions['OPENAI']
+    # the completion streams longer than the idle timeout
+    time.sleep(0.1)
+    response.close()
+    response.close()
+    stream_completion(lambda *a, **kw: transport.post('OPENAI', *a, **kw), url)
+
+    assert transport.sessions['OPENAI'] is first_session
+    assert transport.in_flight['OPENAI'] == 0
+    transport.close()
+
+
+def test_transport_records_connection_timings(sse_stub):
+    server, url = sse_stub
+    transport = LLMTransport()
+
+    timings = []
+    for _ in range(2):
+        response = transport.post('OPENAI', url, json={'messages': []}, stream=True, timeout=(5, 5))
+        response.content
+        timings.append(response.llm_timing)
+
+    # the second request reuses the pooled connection
+    assert timings[0].connect_time > 0
+    assert timings[1].connect_time == 0
+    assert all(timing.ttfb >= timing.connect_time for timing in timings)
+    transport.close()
+
+
+@pytest.mark.slow
+def test_benchmark_connect_overhead(sse_stub):
+    """
+    Compare per-request overhead of unpooled `requests.post()` with the pooled transport.
+
+    Run with: pytest -s -m slow test/utils/test_llm_transport.py
+    """
+    server, url = sse_stub
+    n_requests = 200
+
+    start = time.perf_counter()
+    for _ in range(n_requests):
+        stream_completion(requests.post, url)
+    unpooled = (time.perf_counter() - start) / n_requests
+    unpooled_connections = server.num_connections
+
+    server.num_connections = 0
+    transport = LLMTransport()
+    start = time.perf_counter()
+    for _ in range(n_requests):
+        stream_completion(lambda *a, **kw: transport.post('OPENAI', *a, **kw), url)
+    pooled = (time.perf_counter() - start) / n_requests
+    transport.close()
+
+    print(
+        f"\nrequests.post(): {unpooled * 1000:.3f} ms/request, {unpooled_connections} connections"
+        f"\nLLMTransport:    {pooled * 1000:.3f} ms/request, {server.num_connections} connections"
+    )
+    assert server.num_connections == 1
+    assert unpooled_connections == n_requests
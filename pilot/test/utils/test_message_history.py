@@ -0,0 +1,87 @@
+import copy
+
+import pytest
+
+from utils.message_history import MessageHistory
+
+
+def msg(i) -> dict:
+    return {'role': 'user', 'content': str(i)}
+
+
+def assert_consistent(history: MessageHistory):
+    # the persistent copy always matches the list
+    assert (history.head.messages() if history.head is not None else []) == list(history)
+    assert all(a is b for a, b in zip(history.head.messages() if history.head else [], history))
+
+
+def test_snapshot_and_restore_shares_prefix():
+    history = MessageHistory([msg(0), msg(1)])
+    snapshot = history.snapshot()
+    history.append(msg(2))
+    history.append(msg(3))
+
+    # the snapshot is part of the current history, nothing is copied
+    assert history.head.parent.parent is snapshot
+
+    history.restore(snapshot)
+    assert history == [msg(0), msg(1)]
+    assert history.snapshot() is snapshot
+    assert_consistent(history)
+
+
+def test_restore_diverged_history():
+    history = MessageHistory([msg(0), msg(1), msg(2)])
+    snapshot = history.snapshot()
+    history.pop()
+    history.pop()
+    history.append(msg('other'))
+
+    history.restore(snapshot)
+
+    assert history == [msg(0), msg(1), msg(2)]
+    assert_consistent(history)
+
+
+def test_restore_empty_snapshot():
+    history = MessageHistory()
+    snapshot = history.snapshot()
+    history.extend([msg(0), msg(1)])
+
+    history.restore(snapshot)
+
+    assert history == [] and history.head is None
+
+
+@pytest.mark.parametrize('modify', [
+    lambda h: h.pop(),
+    lambda h: h.pop(0),
+    lambda h: h.insert(1, msg('x')),
+    lambda h: h.remove(h[1]),
+    lambda h: h.__setitem__(1, msg('x')),
+    lambda h: h.__delitem__(1),
+    lambda h: h.__delitem__(slice(-2, None)),
+    lambda h: h.__delitem__(slice(10, None)),
+    lambda h: h.__delitem__(slice(0, 2)),
+    lambda h: h.__iadd__([msg('x')]),
+    lambda h: h.reverse(),
+    lambda h: h.clear(),
+])
+def test_modifications_keep_persistent_copy_consistent(modify):
+    history = MessageHistory([msg(i) for i in range(4)])
+    snapshot = history.snapshot()
+
+    modify(history)
+
+    assert_consistent(history)
+    # snapshots are never affected
+    assert snapshot.messages() == [msg(i) for i in range(4)]
+
+
+def test_copies():
+    history = MessageHistory([msg(0), msg(1)])
+
+    for copied in [history.copy(), history[:], copy.copy(history), copy.deepcopy(history)]:
+        assert copied == history
+    assert isinstance(copy.deepcopy(history), MessageHistory)
+    assert_consistent(copy.deepcopy(history))
@@ -0,0 +1,180 @@
+import copy
+import os
+import time
+
+import pytest
+from jinja2 import Environment, FileSystemLoader
+
+from const.llm import MAX_QUESTIONS, END_RESPONSE
+from utils.utils import get_prompt, get_sys_message, get_bytecode_cache, prompts_path, PromptComponents, env
+
+PROMPT_DATA = {
+    'name': 'TestApp',
+    'app_type': 'web app',
+    'prompt': 'A simple todo app',
+    'technologies': ['Node.js', 'MongoDB'],
+    'architecture': 'Express server with a REST API',
+    'user_stories': ['As a user, I can add a todo'],
+    'user_tasks': ['Add a todo'],
+    'files': [{'path': 'src', 'name': 'app.js', 'content': 'const x = 1;', 'lines_of_code': 1}],
+    'development_tasks': [{'description': 'Set up the server'}, {'description': 'Add todos'}],
+    'current_task_index': 1,
+    'previous_features': None,
+    'current_feature': None,
+    'task': {'description': 'Add todos'},
+    'command': 'npm test',
+    'cli_response': 'stdout:\n```\nok\n```',
+    'exit_code': 0,
+    'additional_message': '',
+    'user_input': '',
+    'issue_description': 'It crashes',
+    'task_steps': [
+        {'type': 'save_file', 'save_file': {'path': 'src/app.js', 'content': 'const x = 1;'}},
+        {'type': 'command', 'command': {'command': 'npm start', 'timeout': 1000}},
+    ],
+    'step_index': 1,
+}
+PROMPTS = [
+    'development/task/breakdown.prompt',
+    'development/parse_task.prompt',
+    'dev_ops/ran_command.prompt',
+    'dev_ops/debug.prompt',
+    'system_messages/full_stack_developer.prompt',
+]
+eager_env = Environment(loader=FileSystemLoader(prompts_path))
+
+
+def get_prompt_eagerly(prompt_name, original_data):
+    """
+    Render a prompt the way `get_prompt()` used to: with a new environment for the
+    components, all of which are rendered for each prompt.
+    """
+    data = copy.deepcopy(original_data)
+    components_env = Environment(loader=FileSystemLoader(os.path.join(prompts_path, 'components')))
+    data.update({'MAX_QUESTIONS': MAX_QUESTIONS, 'END_RESPONSE': END_RESPONSE})
+    components = {}
+    for file_name in components_env.list_templates():
+        components[file_name.replace('.prompt', '')] = components_env.get_template(file_name).render(data)
+    data.update(components)
+    return eager_env.get_template(prompt_name).render(data)
+
+
+@pytest.mark.parametrize('prompt_name', PROMPTS)
+def test_get_prompt_renders_components_lazily(prompt_name):
+    # When
+    prompt = get_prompt(prompt_name, PROMPT_DATA)
+
+    # Then
+    assert prompt == get_prompt_eagerly(prompt_name, PROMPT_DATA)
+    # rendering again with the memoized components gives the same prompt
+    assert get_prompt(prompt_name, PROMPT_DATA) == prompt
+
+
+def test_get_prompt_renders_only_referenced_components():
+    # Given
+    components = PromptComponents(env)
+    rendered = []
+    original_render = components.render
+
+    def render(template_name, data):
+        rendered.append(template_name)
+        return original_render(template_name, data)
+
+    components.render = render
+
+    # When
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr('utils.utils.prompt_components', components)
+        get_prompt('development/parse_task.prompt', PROMPT_DATA)
+
+    # Then
+    assert rendered == ['components/file_naming.prompt', 'components/execution_order.prompt']
+
+
+def test_prompt_components_are_memoized_by_the_variables_they_use():
+    # Given
+    components = PromptComponents(env)
+    data = {**PROMPT_DATA, 'MAX_QUESTIONS': MAX_QUESTIONS, 'END_RESPONSE': END_RESPONSE}
+
+    # When
+    first = components.render('components/files_list.prompt', data)
+    components.render('components/files_list.prompt', {**data, 'command': 'npm run lint'})
+
+    # Then the unrelated change is a cache hit
+    assert len(components.cache) == 1
+
+    # When
+    changed = components.render('components/files_list.prompt', {
+        **data, 'files': [{'path': 'src', 'name': 'db.js', 'content': 'const db = 1;', 'lines_of_code': 1}],
+    })
+
+    # Then
+    assert len(components.cache) == 2
+    assert 'db.js' in changed and 'db.js' not in first
+
+
+def test_prompt_components_modifying_data_are_not_memoized():
+    # Given
+    components = PromptComponents(env)
+    data = copy.deepcopy({**PROMPT_DATA, 'MAX_QUESTIONS': MAX_QUESTIONS, 'END_RESPONSE': END_RESPONSE})
+
+    # When
+    components.render('components/steps_list.prompt', data)
+    components.render('components/steps_list.prompt', copy.deepcopy(PROMPT_DATA))
+
+    # Then
+    assert components.impure == {'components/steps_list.prompt'}
+    assert len(components.cache) == 0
+
+
+def test_get_bytecode_cache(tmp_path):
+    # Given
+    cache = get_bytecode_cache(str(tmp_path / 'prompt_cache'))
+    assert cache.directory == str(tmp_path / 'prompt_cache')
+    assert not os.path.exists(cache.directory)
+
+    # When
+    Environment(loader=FileSystemLoader(prompts_path), bytecode_cache=cache).get_template('utils/update.prompt')
+
+    # Then the directory is created when the first template is compiled
+    assert os.listdir(cache.directory)
+
+
+def test_get_bytecode_cache_unavailable(tmp_path):
+    # Given
+    (tmp_path / 'file').write_text('')
+    cache = get_bytecode_cache(str(tmp_path / 'file' / 'prompt_cache'))
+
+    # When
+    template = Environment(loader=FileSystemLoader(prompts_path), bytecode_cache=cache).get_template('utils/update.prompt')
+
+    # Then the template is compiled anyway
+    assert template.render()
+    assert cache.writable is False
+
+
+@pytest.mark.slow
+def test_benchmark_get_prompt():
+    """
+    Benchmark prompts rendered per second, rendering all components for each prompt
+    (as before) vs rendering the referenced components, memoized.
+
+    Run with: pytest -s -m slow test/utils/test_prompt_components.py
+    """
+    def prompts_per_second(render, duration=2.0):
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            for prompt_name in PROMPTS:
+                render(prompt_name, PROMPT_DATA)
+            count += len(PROMPTS)
+        return count / (time.perf_counter() - start)
+
+    eager = prompts_per_second(get_prompt_eagerly)
+    lazy = prompts_per_second(get_prompt)
+    system_messages = prompts_per_second(lambda _, __: get_sys_message('full_stack_developer'))
+
+    print(f'\nEager components: {eager:.0f} prompts/s')
+    print(f'Lazy, memoized components: {lazy:.0f} prompts/s ({lazy / eager:.1f}x)')
+    print(f'System messages: {system_messages:.0f} prompts/s')
+    assert lazy > eager
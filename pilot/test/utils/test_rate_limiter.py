@@ -0,0 +1,106 @@
+from unittest.mock import patch
+
+import pytest
+
+from utils.rate_limiter import RateLimiter, parse_duration
+
+
+def rate_limit_headers(limit_requests, remaining_requests, limit_tokens, remaining_tokens, reset='1m0s'):
+    return {
+        'x-ratelimit-limit-requests': str(limit_requests),
+        'x-ratelimit-remaining-requests': str(remaining_requests),
+        'x-ratelimit-reset-requests': reset,
+        'x-ratelimit-limit-tokens': str(limit_tokens),
+        'x-ratelimit-remaining-tokens': str(remaining_tokens),
+        'x-ratelimit-reset-tokens': reset,
+    }
+
+
+@pytest.mark.parametrize(('value', 'expected'), [
+    ('20ms', 0.02),
+    ('1.5s', 1.5),
+    ('6m0s', 360),
+    ('1h2m3s', 3723),
+    ('7', 7),
+    ('', None),
+    ('soon', None),
+])
+def test_parse_duration(value, expected):
+    if expected is None:
+        assert parse_duration(value) is None
+    else:
+        assert parse_duration(value) == pytest.approx(expected)
+
+
+@patch('utils.rate_limiter.time.sleep')
+def test_requests_are_not_delayed_until_limits_are_known(mock_sleep):
+    limiter = RateLimiter()
+
+    for _ in range(100):
+        assert limiter.acquire('OPENAI', 100000) == 0
+
+    mock_sleep.assert_not_called()
+
+
+@patch('utils.rate_limiter.time.monotonic', return_value=1000.0)
+@patch('utils.rate_limiter.time.sleep')
+def test_requests_are_paced_by_tokens(mock_sleep, _mock_monotonic):
+    limiter = RateLimiter()
+    # 6000 tokens per minute (100/s) with 1000 remaining
+    limiter.update('OPENAI', rate_limit_headers(100, 50, 6000, 1000, reset='50s'))
+
+    assert limiter.acquire('OPENAI', 600) == 0
+    # 400 tokens left, so the next 600 token request must wait for 200 tokens to be refilled
+    assert limiter.acquire('OPENAI', 600) == pytest.approx(2.0)
+    mock_sleep.assert_called_once_with(pytest.approx(2.0))
+
+
+@patch('utils.rate_limiter.time.monotonic', return_value=1000.0)
+@patch('utils.rate_limiter.time.sleep')
+def test_requests_are_paced_by_request_count(mock_sleep, _mock_monotonic):
+    limiter = RateLimiter()
+    # 60 requests per minute, none remaining
+    limiter.update('OPENAI', rate_limit_headers(60, 0, 100000, 100000))
+
+    assert limiter.acquire('OPENAI', 10) == pytest.approx(1.0)
+    assert limiter.acquire('OPENAI', 10) == pytest.approx(2.0)
+    # other endpoints have their own limits
+    assert limiter.acquire('OPENROUTER', 10) == 0
+
+
+@patch('utils.rate_limiter.time.sleep')
+def test_disabled_limiter_ignores_headers(mock_sleep):
+    limiter = RateLimiter(enabled=False)
+    limiter.update('OPENAI', rate_limit_headers(60, 0, 100, 0))
+
+    assert limiter.acquire('OPENAI', 1000) == 0
+
+
+@patch('utils.rate_limiter.random.uniform', side_effect=lambda low, high: high)
+def test_backoff_is_exponential_and_capped(_mock_uniform):
+    limiter = RateLimiter(backoff_base=1, backoff_max=5)
+
+    waits = [limiter.backoff('OPENAI') for _ in range(5)]
+    assert waits == [1, 2, 4, 5, 5]
+
+    # a successful response resets the backoff
+    limiter.update('OPENAI', {}, 200)
+    assert limiter.backoff('OPENAI', retry_after=1.5) == 2.5
+
+
+def test_backoff_has_jitter():
+    limiter = RateLimiter(backoff_base=8, backoff_max=60)
+
+    waits = {limiter.backoff(f'ENDPOINT{i}') for i in range(20)}
+
+    assert all(4 <= wait <= 8 for wait in waits)
+    assert len(waits) > 1
+
+
+@patch('utils.rate_limiter.time.sleep')
+def test_backoff_pauses_other_requests(mock_sleep):
+    limiter = RateLimiter(backoff_base=2)
+
+    wait = limiter.backoff('OPENAI', retry_after=3)
+
+    assert limiter.acquire('OPENAI') == pytest.approx(wait, abs=0.1)
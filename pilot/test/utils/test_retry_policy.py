@@ -0,0 +1,43 @@
+from unittest.mock import Mock, patch
+
+import pytest
+import requests
+
+from helpers.exceptions import ApiError
+from utils.retry_policy import RetryPolicy
+
+
+@pytest.mark.parametrize(('error', 'expected'), [
+    (requests.exceptions.ConnectionError('Connection reset by peer'), True),
+    (requests.exceptions.ReadTimeout('Read timed out'), True),
+    (ApiError('API responded with status code: 503', response=Mock(status_code=503, text='')), True),
+    (ApiError('API responded with status code: 400', response=Mock(status_code=400, text='')), False),
+    (ValueError('Error in LLM response: Overloaded'), True),
+    (ValueError('LLM did not respond with JSON'), False),
+])
+def test_default_retryable_errors(error, expected):
+    assert RetryPolicy().is_retryable(error) is expected
+
+
+def test_custom_retryable_errors():
+    policy = RetryPolicy(retryable_errors='ValueError, 400')
+
+    assert policy.is_retryable(ValueError('LLM did not respond with JSON'))
+    assert policy.is_retryable(ApiError('Bad request', response=Mock(status_code=400, text='')))
+    assert not policy.is_retryable(requests.exceptions.ConnectionError('Connection reset by peer'))
+
+
+def test_should_retry_up_to_max_attempts():
+    policy = RetryPolicy(max_attempts=3)
+    error = requests.exceptions.ConnectionError()
+
+    assert [policy.should_retry(error, attempt) for attempt in [1, 2, 3]] == [True, True, False]
+
+
+@patch('utils.retry_policy.random.uniform', side_effect=lambda low, high: high)
+def test_exponential_backoff(mock_uniform):
+    policy = RetryPolicy(backoff_base=2, backoff_max=10)
+
+    assert [policy.get_backoff(attempt) for attempt in [1, 2, 3, 4]] == [2, 4, 8, 10]
+    # with jitter
+    mock_uniform.assert_called_with(5, 10)
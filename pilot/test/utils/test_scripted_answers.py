@@ -0,0 +1,88 @@
+import json
+from unittest.mock import patch, Mock
+
+import pytest
+import questionary
+
+from helpers.exceptions import NoScriptedAnswerError, InvalidScriptedAnswerError
+from utils.questionary import styled_text, styled_select
+from utils.scripted_answers import ScriptedAnswers
+
+
+@pytest.fixture
+def answers_file(tmp_path):
+    path = tmp_path / 'answers.json'
+    path.write_text(json.dumps([
+        {'question': 'Describe your app', 'answer': 'A simple todo app'},
+        {'question': r'try make the same request again\?', 'answer': ['', 'no']},
+        {'question': 'What type of app', 'answer': ['App', 'Chrome extensoin']},
+    ]))
+    return str(path)
+
+
+def test_first_matching_rule_is_used(answers_file):
+    answers = ScriptedAnswers(answers_file)
+
+    assert answers.get_answer('Describe your app in as much detail as possible.') == 'A simple todo app'
+    assert answers.get_answer('What is the name of the project?') is None
+
+
+def test_answer_list_is_used_in_turn(answers_file):
+    answers = ScriptedAnswers(answers_file)
+    question = 'Do you want to try make the same request again? If yes, just press ENTER.'
+
+    assert [answers.get_answer(question) for _ in range(3)] == ['', 'no', 'no']
+
+
+@patch('utils.questionary.save_user_input')
+@patch('utils.questionary.questionary')
+def test_styled_text_uses_scripted_answers(mock_questionary, mock_save_user_input, answers_file):
+    project = Mock(user_inputs_count=0, check_ipc=Mock(return_value=False))
+
+    with patch('utils.questionary.scripted_answers', ScriptedAnswers(answers_file, headless=False)):
+        answer = styled_text(project, 'Describe your app in as much detail as possible.')
+        styled_text(project, 'What is the name of the project?')
+
+    assert answer == 'A simple todo app'
+    # questions without a scripted answer are asked as usual
+    mock_questionary.text.assert_called_once()
+    assert mock_questionary.text.call_args.args[0] == 'What is the name of the project?'
+
+
+@patch('utils.questionary.questionary')
+def test_unanswered_question_fails_in_headless_mode(mock_questionary, answers_file):
+    project = Mock(user_inputs_count=0, check_ipc=Mock(return_value=False))
+
+    with patch('utils.questionary.scripted_answers', ScriptedAnswers(answers_file, headless=True)), \
+            pytest.raises(NoScriptedAnswerError):
+        styled_text(project, 'What is the name of the project?')
+
+    mock_questionary.text.assert_not_called()
+
+
+@patch('utils.questionary.questionary')
+def test_styled_select_checks_scripted_answer_in_headless_mode(mock_questionary, answers_file):
+    mock_questionary.Choice = questionary.Choice
+    choices = ['App', questionary.Choice('Chrome extension'), {'name': 'Other', 'value': 'other'}]
+
+    with patch('utils.questionary.scripted_answers', ScriptedAnswers(answers_file, headless=True)):
+        assert styled_select('What type of app do you want to build?', choices=choices) == 'App'
+        with pytest.raises(InvalidScriptedAnswerError) as exc_info:
+            styled_select('What type of app do you want to build?', choices=choices)
+
+    assert exc_info.value.answer == 'Chrome extensoin'
+    assert exc_info.value.choices == ['App', 'Chrome extension', 'other']
+    mock_questionary.select.assert_not_called()
+
+
+@patch('utils.questionary.questionary')
+def test_styled_select_asks_user_if_scripted_answer_is_not_a_choice(mock_questionary, answers_file):
+    mock_questionary.Choice = questionary.Choice
+    mock_questionary.select.return_value.unsafe_ask.return_value = 'Chrome extension'
+
+    with patch('utils.questionary.scripted_answers', ScriptedAnswers(answers_file, headless=False)):
+        styled_select('What type of app do you want to build?', choices=['App', 'Chrome extension'])
+        answer = styled_select('What type of app do you want to build?', choices=['App', 'Chrome extension'])
+
+    assert answer == 'Chrome extension'
+    mock_questionary.select.assert_called_once()
@@ -0,0 +1,153 @@
+import builtins
+import json
+import random
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+import requests
+
+from helpers.Project import Project
+from main import get_custom_print
+from utils.llm_connection import stream_gpt_completion
+from utils.sse import SSEDecoder, iter_sse_data, json_loads
+
+
+def record_stream(n_deltas: int, seed: int = 42) -> tuple[list[bytes], str]:
+    """
+    Create a stream as sent by the OpenAI API, split into network-sized chunks.
+
+    :return: (chunks, streamed content)
+    """
+    rnd = random.Random(seed)
+    words = ['const', 'app', '=', 'express();', '\n', '  ', 'res.send(', '"Hello"', ');', '{', '}', 'function']
+    deltas = [rnd.choice(words) for _ in range(n_deltas)]
+
+    events = [
+        'data: ' + json.dumps({
+            'id': 'chatcmpl-123',
+            'object': 'chat.completion.chunk',
+            'created': 1700000000,
+            'model': 'gpt-4-0613',
+            'system_fingerprint': None,
+            'choices': [{'index': 0, 'delta': {'content': delta}, 'logprobs': None, 'finish_reason': None}],
+        }) + '\n\n'
+        for delta in deltas
+    ]
+    events.append('data: [DONE]\n\n')
+    stream = ''.join(events).encode('utf-8')
+
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        size = rnd.randint(50, 1500)
+        chunks.append(stream[pos:pos + size])
+        pos += size
+    return chunks, ''.join(deltas)
+
+
+def test_decoder_handles_events_split_across_chunks():
+    chunks, content = record_stream(200)
+
+    received = ''.join(json_loads(data)['choices'][0]['delta']['content'] for data in iter_sse_data(chunks))
+
+    assert received == content
+
+
+def test_decoder_skips_comments_and_other_fields():
+    decoder = SSEDecoder()
+
+    payloads = decoder.feed(
+        b': OPENROUTER PROCESSING\r\n\r\n'
+        b'event: message\nid: 1\nretry: 100\n'
+        b'data:{"a": 1}\n\n'
+        b'data: [DONE]\n\n'
+    )
+
+    assert payloads == [b'{"a": 1}']
+
+
+def test_decoder_accepts_bare_json_lines():
+    assert list(iter_sse_data([b'{"a": 1}\n{"a"', b': 2}'])) == [b'{"a": 1}', b'{"a": 2}']
+
+
+def legacy_parse(chunks):
+    """
+    Previous implementation: iter_lines(), decode, strip the prefix, json.loads(), concatenate.
+    """
+    response = requests.Response()
+    response.iter_content = lambda chunk_size, decode_unicode: iter(chunks)
+    gpt_response = ''
+    for line in response.iter_lines():
+        if line and line != b': OPENROUTER PROCESSING':
+            line = line.decode('utf-8')
+            if line.startswith('data: '):
+                line = line[6:]
+            if line == '[DONE]':
+                continue
+            json_line = json.loads(line)
+            content = json_line['choices'][0]['delta'].get('content')
+            if content:
+                gpt_response += content
+    return gpt_response
+
+
+def sse_parse(chunks):
+    parts = []
+    for data in iter_sse_data(chunks):
+        content = json_loads(data)['choices'][0]['delta'].get('content')
+        if content:
+            parts.append(content)
+    return ''.join(parts)
+
+
+@pytest.mark.slow
+def test_benchmark_stream_parsing():
+    """
+    Compare per-delta CPU cost of the previous line-based parsing with the SSE decoder.
+
+    Run with: pytest -s -m slow test/utils/test_sse.py
+    """
+    n_deltas = 20000
+    chunks, content = record_stream(n_deltas)
+
+    results = {}
+    for name, parse in (('iter_lines + json', legacy_parse), ('SSEDecoder + ' + json_loads.__module__, sse_parse)):
+        best = None
+        for _ in range(5):
+            start = time.process_time()
+            assert parse(chunks) == content
+            elapsed = time.process_time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+
+    print()
+    for name, elapsed in results.items():
+        print(f'{name:30} {elapsed / n_deltas * 1e6:.2f} us/delta')
+
+
+@pytest.mark.slow
+@patch('utils.llm_connection.llm_transport.post')
+def test_benchmark_stream_gpt_completion(mock_post, monkeypatch):
+    """
+    Per-delta CPU cost of the whole `stream_gpt_completion()` replaying a recorded stream.
+
+    Run with: pytest -s -m slow test/utils/test_sse.py
+    """
+    builtins.print, _ = get_custom_print({})
+    monkeypatch.setenv('OPENAI_API_KEY', 'secret')
+    project = Project({'app_id': 'test-app'})
+    n_deltas = 20000
+    chunks, content = record_stream(n_deltas)
+
+    response = Mock(status_code=200)
+    response.iter_content.side_effect = lambda chunk_size: iter(chunks)
+    mock_post.return_value = response
+
+    with patch('builtins.print'):
+        start = time.process_time()
+        result = stream_gpt_completion({'messages': []}, '', project)
+        elapsed = time.process_time() - start
+
+    assert result == {'text': content}
+    print(f'\nstream_gpt_completion(): {elapsed / n_deltas * 1e6:.2f} us/delta ({n_deltas} deltas)')
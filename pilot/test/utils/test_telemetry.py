@@ -1,6 +1,7 @@
 from unittest.mock import patch
 
 
+from utils.llm_latency import LatencyRecorder, LLMRequestTiming
 from utils.telemetry import Telemetry
 
 
@@ -409,3 +410,42 @@ def test_calculate_statistics(mock_settings):
         "avg_time": 36,
         "median_time": 20,
     }
+
+
+@patch("utils.telemetry.llm_latency", new_callable=lambda: LatencyRecorder(log_path=None))
+@patch("utils.telemetry.settings")
+def test_calculate_statistics_llm_latency(mock_settings, mock_llm_latency):
+    mock_settings.telemetry = {
+        "id": "test-id",
+        "endpoint": "test-endpoint",
+        "enabled": True,
+    }
+
+    telemetry = Telemetry()
+    mock_llm_latency.record(LLMRequestTiming("coding", "a.prompt", ttft=1))
+    mock_llm_latency.record(LLMRequestTiming("coding", "b.prompt", ttft=3))
+
+    telemetry.calculate_statistics()
+    [stats] = telemetry.data["llm_latency"]
+    assert stats["req_type"] == "coding"
+    assert stats["num_requests"] == 2
+    assert stats["ttft"] == {"median": 1, "p95": 3}
+
+
+@patch("utils.telemetry.settings")
+def test_calculate_statistics_file_resolver(mock_settings):
+    mock_settings.telemetry = {
+        "id": "test-id",
+        "endpoint": "test-endpoint",
+        "enabled": True,
+    }
+
+    telemetry = Telemetry()
+    telemetry.record_file_resolution(True, 0.01)
+    telemetry.record_file_resolution(True, 0.03)
+    telemetry.record_file_resolution(False, 5.02)
+
+    telemetry.calculate_statistics()
+    assert telemetry.data["num_file_resolver_hits"] == 2
+    assert telemetry.data["num_file_resolver_fallbacks"] == 1
+    assert telemetry.data["file_resolver_saved_time"] == 10
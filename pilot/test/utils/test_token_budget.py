@@ -0,0 +1,124 @@
+from unittest.mock import patch
+
+import pytest
+
+from helpers.AgentConvo import AgentConvo
+from utils.token_budget import fit_messages_to_token_budget, get_context_window, parse_files_section, \
+    split_files_notes, FILES_SECTION_PATTERN
+from utils.utils import get_prompt
+
+
+def count_tokens(text):
+    return len(text.split())
+
+
+def create_file(name, n_lines, word='code'):
+    return {
+        'path': '/src',
+        'name': name,
+        'content': '\n'.join(f'{word} line {i}' for i in range(n_lines)),
+        'lines_of_code': n_lines,
+    }
+
+
+def create_messages(files, task='Implement the task.'):
+    files_list = get_prompt('components/files_list.prompt', {'files': files})
+    return [
+        {'role': 'system', 'content': 'You are a developer.'},
+        {'role': 'user', 'content': f'{task}\n{files_list}\nDo it now.'},
+    ]
+
+
+@pytest.mark.parametrize(
+    ("model", "expected"),
+    [
+        ("gpt-4", 8192),
+        ("gpt-4-0613", 8192),
+        ("gpt-4-turbo-preview", 128000),
+        ("gpt-4-32k-0613", 32768),
+        ("openai/gpt-3.5-turbo", 16385),
+        ("some-local-model", 4096),
+    ],
+)
+@patch('utils.token_budget.MAX_GPT_MODEL_TOKENS', 4096)
+def test_get_context_window(model, expected):
+    assert get_context_window(model) == expected
+
+
+def test_parse_files_section_roundtrip():
+    files = [create_file('a.js', 3), create_file('README.md', 2)]
+    files[1]['content'] = 'Usage:\n```\nnpm start\n```'
+    messages = create_messages(files)
+
+    section = FILES_SECTION_PATTERN.search(messages[1]['content']).group(1)
+    entries = parse_files_section(section)
+
+    assert [entry.path for entry in entries] == ['/src/a.js', '/src/README.md']
+    assert [entry.content for entry in entries] == [files[0]['content'], files[1]['content']]
+
+
+def test_request_within_budget_is_unchanged():
+    messages = create_messages([create_file('a.js', 10)])
+
+    trimmed, n_tokens = fit_messages_to_token_budget(messages, 10000, count_tokens)
+
+    assert trimmed is messages
+    assert n_tokens > 0
+
+
+def test_unreferenced_files_are_dropped_first():
+    files = [create_file('big.js', 200), create_file('server.js', 100), create_file('small.js', 20)]
+    messages = create_messages(files, task='Fix the bug in server.js')
+    _, full_size = fit_messages_to_token_budget(messages, 100000, count_tokens)
+
+    trimmed, n_tokens = fit_messages_to_token_budget(messages, full_size - 100, count_tokens)
+
+    content = trimmed[1]['content']
+    # biggest unreferenced file was dropped, the others are still there
+    assert '**/src/big.js**' not in content
+    assert '**/src/server.js**' in content
+    assert '**/src/small.js**' in content
+    assert 'Omitted to fit the context window: /src/big.js' in content
+    assert n_tokens <= full_size - 100
+    # the original messages are not modified
+    assert '**/src/big.js**' in messages[1]['content']
+
+
+def test_referenced_files_are_truncated():
+    files = [create_file('server.js', 400)]
+    messages = create_messages(files, task='Fix the bug in server.js')
+    _, full_size = fit_messages_to_token_budget(messages, 100000, count_tokens)
+
+    trimmed, n_tokens = fit_messages_to_token_budget(messages, full_size // 2, count_tokens)
+
+    content = trimmed[1]['content']
+    assert '**/src/server.js**' in content
+    assert 'more lines truncated' in content
+    assert n_tokens <= full_size // 2
+    assert content.endswith('---END_OF_FILES---\n\nDo it now.')
+
+
+def test_request_that_cant_fit_is_reported():
+    messages = create_messages([create_file('server.js', 30)], task='Fix server.js ' + 'word ' * 1000)
+
+    _, n_tokens = fit_messages_to_token_budget(messages, 500, count_tokens)
+
+    assert n_tokens > 500
+
+
+def test_files_notes_are_kept_when_trimming():
+    files = [create_file('big.js', 200), create_file('server.js', 100)]
+    block = AgentConvo.render_files_block(files, [create_file('other.js', 1)])
+    messages = [{'role': 'user', 'content': f'Fix the bug in server.js\nHere are the files:{block}Do it now.'}]
+    _, full_size = fit_messages_to_token_budget(messages, 100000, count_tokens)
+
+    trimmed, _ = fit_messages_to_token_budget(messages, full_size - 100, count_tokens)
+
+    content = trimmed[0]['content']
+    section = FILES_SECTION_PATTERN.search(content).group(1)
+    files_section, notes = split_files_notes(section)
+    assert [entry.content for entry in parse_files_section(files_section)] == [files[1]['content']]
+    assert notes == [
+        "(Other files, not shown as they're less relevant to the task: /src/other.js)",
+        '(Omitted to fit the context window: /src/big.js)',
+    ]
@@ -0,0 +1,72 @@
+from unittest.mock import MagicMock
+
+from utils.token_counter import TokenCounter
+
+
+def create_encoding():
+    encoding = MagicMock()
+    encoding.encode_ordinary.side_effect = lambda text: text.split()
+    encoding.encode_ordinary_batch.side_effect = lambda texts, num_threads: [text.split() for text in texts]
+    return encoding
+
+
+def test_count():
+    counter = TokenCounter(create_encoding())
+    assert counter.count("one two three") == 3
+    assert counter.count("") == 0
+
+
+def test_count_messages_only_encodes_new_messages():
+    encoding = create_encoding()
+    counter = TokenCounter(encoding)
+    messages = [
+        {"role": "system", "content": "you are a developer"},
+        {"role": "user", "content": "write some code"},
+    ]
+
+    assert counter.count_messages(messages) == 7
+    assert encoding.encode_ordinary.call_count == 2
+
+    messages.append({"role": "assistant", "content": "ok"})
+    messages.append({"role": "user", "content": "write some code"})
+
+    assert counter.count_messages(messages) == 11
+    assert encoding.encode_ordinary.call_count == 3
+
+
+def test_changed_message_is_recounted():
+    encoding = create_encoding()
+    counter = TokenCounter(encoding)
+    messages = [{"role": "user", "content": "a b"}]
+
+    assert counter.count_messages(messages) == 2
+    messages[0]["content"] = "a b c"
+    assert counter.count_messages(messages) == 3
+
+
+def test_large_texts_are_encoded_in_batch():
+    encoding = create_encoding()
+    counter = TokenCounter(encoding, batch_threshold=10, num_threads=2)
+
+    counts = counter.count_many(["one two three", "four five six", "one two three"])
+
+    assert counts == [3, 3, 3]
+    encoding.encode_ordinary_batch.assert_called_once_with(["one two three", "four five six"], num_threads=2)
+    encoding.encode_ordinary.assert_not_called()
+
+
+def test_cache_is_bounded():
+    encoding = create_encoding()
+    counter = TokenCounter(encoding, max_entries=2)
+
+    counter.count("a")
+    counter.count("b")
+    counter.count("a")
+    counter.count("c")
+
+    assert len(counter.cache) == 2
+    # "b" was least recently used, so it was evicted
+    counter.count("a")
+    assert encoding.encode_ordinary.call_count == 3
+    counter.count("b")
+    assert encoding.encode_ordinary.call_count == 4
@@ -0,0 +1,119 @@
+import base64
+import os
+from hashlib import sha1
+from unittest.mock import patch, Mock
+
+import pytest
+import regex
+import tiktoken.registry
+
+from utils.tokenizer import TokenizerRegistry, ApproximateEncoding, get_encoding_name, ENCODING_URLS, ENCODING_PARAMS
+
+
+def create_bpe_file() -> bytes:
+    """
+    Minimal BPE file (all single bytes plus a few merges) in tiktoken's format.
+    """
+    tokens = [bytes([i]) for i in range(256)] + [b'he', b'll', b'hell', b'hello']
+    return b''.join(base64.b64encode(token) + b' ' + str(rank).encode() + b'\n' for rank, token in enumerate(tokens))
+
+
+@pytest.fixture(autouse=True)
+def tiktoken_state(monkeypatch):
+    # don't leak the test encodings to other tests
+    monkeypatch.setattr(tiktoken.registry, 'ENCODINGS', {})
+
+
+@pytest.mark.parametrize(('model', 'expected'), [
+    ('gpt-4', 'cl100k_base'),
+    ('gpt-4o', 'o200k_base'),
+    ('openai/gpt-4o-2024-05-13', 'o200k_base'),
+    ('claude-3-opus', 'cl100k_base'),
+])
+def test_get_encoding_name(model, expected):
+    assert get_encoding_name(model) == expected
+
+
+def test_encoding_is_loaded_lazily_from_preseeded_file(tmp_path):
+    (tmp_path / 'cl100k_base.tiktoken').write_bytes(create_bpe_file())
+    registry = TokenizerRegistry(cache_dir=str(tmp_path), offline=True)
+    assert registry.encodings == {}
+
+    counter = registry.get_token_counter('gpt-4')
+
+    assert counter.encoding.name == 'cl100k_base'
+    assert counter.count('hello hello') == 3
+    # copied to tiktoken's cache, so it's found there from now on
+    assert (tmp_path / sha1(ENCODING_URLS['cl100k_base'].encode()).hexdigest()).exists()
+    assert registry.get_token_counter('openai/gpt-4-turbo') is counter
+
+
+def test_encoding_unknown_to_tiktoken_is_loaded(tmp_path, monkeypatch):
+    # the installed tiktoken may not know o200k_base
+    tiktoken.list_encoding_names()
+    monkeypatch.delitem(tiktoken.registry.ENCODING_CONSTRUCTORS, 'o200k_base', raising=False)
+    monkeypatch.delenv('TIKTOKEN_CACHE_DIR', raising=False)
+    (tmp_path / 'o200k_base.tiktoken').write_bytes(create_bpe_file())
+    registry = TokenizerRegistry(cache_dir=str(tmp_path), offline=True)
+
+    encoding = registry.get_encoding('o200k_base')
+
+    assert encoding.name == 'o200k_base'
+    assert encoding.encode('hello hello') == [259, 32, 259]
+    # the cache directory is passed to tiktoken explicitly
+    assert 'TIKTOKEN_CACHE_DIR' not in os.environ
+
+
+@pytest.mark.parametrize('name', ENCODING_PARAMS)
+def test_encoding_params_match_tiktoken(name):
+    if name not in tiktoken.list_encoding_names():
+        pytest.skip(f'The installed tiktoken doesn\'t know {name}')
+    constructor = tiktoken.registry.ENCODING_CONSTRUCTORS[name]
+
+    with patch.dict(constructor.__globals__, {'load_tiktoken_bpe': lambda *args, **kwargs: {}}):
+        params = constructor()
+
+    assert ENCODING_PARAMS[name]['special_tokens'] == params['special_tokens']
+    # tiktoken versions differ in how the pattern is written, but it splits the text the same way
+    text = "Don't panic!\n\n  def getUserName(user_id=42):\r\n\treturn 'Ünïcode' + \"文字\" // 12345\n"
+    assert regex.findall(ENCODING_PARAMS[name]['pat_str'], text) == regex.findall(params['pat_str'], text)
+
+
+def test_unavailable_encoding_falls_back_to_default(tmp_path):
+    (tmp_path / 'cl100k_base.tiktoken').write_bytes(create_bpe_file())
+    registry = TokenizerRegistry(cache_dir=str(tmp_path), offline=True)
+
+    assert registry.get_encoding('o200k_base').name == 'cl100k_base'
+
+
+def test_approximate_counter_is_used_offline_without_bpe_files(tmp_path):
+    registry = TokenizerRegistry(cache_dir=str(tmp_path), offline=True)
+
+    with patch('utils.tokenizer.requests.get') as mock_get:
+        counter = registry.get_token_counter('gpt-4o')
+
+    mock_get.assert_not_called()
+    assert isinstance(counter.encoding, ApproximateEncoding)
+    assert counter.count('a' * 35) == 10
+    assert counter.count('é' * 7) == 4
+
+
+def test_encoding_is_downloaded_with_timeout(tmp_path):
+    registry = TokenizerRegistry(cache_dir=str(tmp_path))
+
+    with patch('utils.tokenizer.requests.get', return_value=Mock(content=create_bpe_file())) as mock_get:
+        encoding = registry.get_encoding('cl100k_base')
+
+    assert encoding.name == 'cl100k_base'
+    mock_get.assert_called_once_with(ENCODING_URLS['cl100k_base'], timeout=10)
+
+
+def test_failed_download_falls_back_to_approximate_counter(tmp_path):
+    registry = TokenizerRegistry(cache_dir=str(tmp_path))
+
+    with patch('utils.tokenizer.requests.get', side_effect=OSError('Network is unreachable')) as mock_get:
+        assert isinstance(registry.get_encoding('cl100k_base'), ApproximateEncoding)
+        # the failure is remembered, it's not retried for every request
+        assert isinstance(registry.get_encoding('cl100k_base'), ApproximateEncoding)
+
+    mock_get.assert_called_once()
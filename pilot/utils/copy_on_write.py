@@ -0,0 +1,121 @@
+from typing import Any
+
+
+def wrap(value: Any) -> Any:
+    """
+    Wrap a dict or list in a copy-on-write view, other values (strings, numbers, ...) are shared as they are.
+    """
+    if type(value) is dict:
+        return CopyOnWriteDict(value)
+    if type(value) is list:
+        return CopyOnWriteList(value)
+    return value
+
+
+def copy_on_write(data: dict) -> dict:
+    """
+    Get a copy of the data that can be modified without modifying the original data, like
+    `copy.deepcopy()`, but without copying the nested values that aren't modified.
+
+    Nested dicts and lists are wrapped in views that only copy references to their items (never
+    the items themselves, like file contents), and only when they're first accessed. Values of
+    other types (eg. tuples, objects) are shared with the original data.
+
+    >>> original = {'files': [{'name': 'app.js', 'content': '...'}]}
+    >>> data = copy_on_write(original)
+    >>> data['files'][0]['content'] = ''
+    >>> original['files'][0]['content']
+    '...'
+
+    :param data: original data, it's never modified
+    :return: copy of the data
+    """
+    return {key: wrap(value) for key, value in data.items()}
+
+
+class CopyOnWriteDict(dict):
+    """
+    Dict with the items of another dict, whose nested dicts and lists are wrapped
+    (see `copy_on_write()`) when they're accessed.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        wrapped = wrap(value)
+        if wrapped is not value:
+            super().__setitem__(key, wrapped)
+        return wrapped
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            super().__setitem__(key, default)
+        return self[key]
+
+    def pop(self, key, *default):
+        return wrap(super().pop(key, *default))
+
+    def popitem(self):
+        key, value = super().popitem()
+        return key, wrap(value)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def copy(self):
+        return CopyOnWriteDict(self)
+
+
+class CopyOnWriteList(list):
+    """
+    List with the items of another list, whose nested dicts and lists are wrapped
+    (see `copy_on_write()`) when they're accessed.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return CopyOnWriteList(self[i] for i in range(len(self))[index])
+        value = super().__getitem__(index)
+        wrapped = wrap(value)
+        if wrapped is not value:
+            super().__setitem__(index, wrapped)
+        return wrapped
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __reversed__(self):
+        for i in reversed(range(len(self))):
+            yield self[i]
+
+    def pop(self, index: int = -1):
+        return wrap(super().pop(index))
+
+    def copy(self):
+        return CopyOnWriteList(self)
+
+
+def freeze(value: Any) -> Any:
+    """
+    Get a hashable snapshot of the value, to compare it or use it as a key, without copying
+    the nested values (strings are shared, and their hashes are computed only once).
+
+    Copy-on-write views are read as they are, without wrapping their nested values.
+    """
+    if isinstance(value, dict):
+        return dict, tuple((key, freeze(item)) for key, item in dict.items(value))
+    if isinstance(value, list):
+        return list, tuple(freeze(item) for item in list.__iter__(value))
+    if isinstance(value, tuple):
+        return tuple, tuple(freeze(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
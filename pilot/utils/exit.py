@@ -3,6 +3,8 @@ import requests
 from helpers.cli import terminate_running_processes
 from prompts.prompts import ask_user
 
+from logger.logger import logger
+from utils.llm_latency import llm_latency
 from utils.telemetry import telemetry
 
 
@@ -113,6 +115,9 @@ def exit_gpt_pilot(project, ask_feedback=True):
     telemetry.set("num_commands", project.command_runs_count if project is not None else 0)
     telemetry.set("num_inputs", project.user_inputs_count if project is not None else 0)
 
+    if llm_latency.timings:
+        logger.info('\n' + llm_latency.report())
+
     telemetry.send()
 
     print('Exit', type='exit')
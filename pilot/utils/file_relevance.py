@@ -0,0 +1,231 @@
+import math
+import os
+import re
+from collections import Counter
+from typing import Callable, Optional
+
+import numpy as np
+
+WORD_PATTERN = re.compile(r'[A-Za-z0-9_]+')
+# Parts of camelCase, PascalCase, ACRONYMCase and snake_case identifiers
+WORD_PART_PATTERN = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+')
+# Common English words, they don't tell anything about the relevance of the files to a task description
+STOP_WORDS = frozenset(
+    'a an and are as at be but by do does for from has have if in into is it its no not of on or so such that the '
+    'their then there these they this to was we were will with you your'.split()
+)
+PATH_TERM_WEIGHT = 3  # terms in the file path count as this many occurrences in the content
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split text (code or prose) into lowercase terms.
+
+    Identifiers are split into their parts, and the whole identifier is kept as
+    well, so "getUserName" matches both "user" and "getusername".
+    """
+    terms = []
+    for word in WORD_PATTERN.findall(text):
+        parts = WORD_PART_PATTERN.findall(word)
+        if len(parts) != 1:
+            terms.append(word.lower())
+        terms.extend(part.lower() for part in parts)
+    return [term for term in terms if len(term) > 1 and term not in STOP_WORDS]
+
+
+class FileIndex:
+    """
+    BM25 relevance index of the project files (their contents and paths).
+
+    Files are added or updated one at a time (see `update()`), so the index stays
+    current as files are saved without re-indexing the whole project. Scoring a query
+    is vectorized per query term over the files containing it.
+
+    >>> index = FileIndex()
+    >>> index.update('/app/src/db.js', 'src/db.js', 'const mongoose = require("mongoose");')
+    >>> index.update('/app/src/app.js', 'src/app.js', 'const express = require("express");')
+    >>> index.get_scores('Connect to MongoDB with mongoose')
+    {'/app/src/db.js': 2.04..., '/app/src/app.js': 0.0}
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = {}  # file key -> document id
+        self.doc_keys = []  # document id -> file key (None if the id is free)
+        self.doc_contents = []  # document id -> indexed content
+        self.doc_terms = []  # document id -> Counter of terms
+        self.doc_lengths = np.zeros(64, dtype=np.float64)
+        self.free_ids = []
+        self.postings = {}  # term -> {document id: term frequency}
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def update(self, key: str, path: str, content: Optional[str]):
+        """
+        Add or update a file in the index (no-op if it didn't change).
+
+        :param key: unique key of the file (its full path)
+        :param path: path of the file (relative to the project root), the same for the same key
+        :param content: content of the file (binary files are indexed by their path only)
+        """
+        if not isinstance(content, str):
+            content = ''
+        doc_id = self.doc_ids.get(key)
+        if doc_id is not None:
+            old_content = self.doc_contents[doc_id]
+            if old_content is content or old_content == content:
+                return
+            self._remove_terms(doc_id)
+        else:
+            doc_id = self.free_ids.pop() if self.free_ids else len(self.doc_keys)
+            if doc_id == len(self.doc_keys):
+                self.doc_keys.append(None)
+                self.doc_contents.append(None)
+                self.doc_terms.append(None)
+                if doc_id >= len(self.doc_lengths):
+                    self.doc_lengths = np.concatenate([self.doc_lengths, np.zeros_like(self.doc_lengths)])
+            self.doc_ids[key] = doc_id
+            self.doc_keys[doc_id] = key
+
+        terms = Counter(tokenize(content))
+        for term in tokenize(path):
+            terms[term] += PATH_TERM_WEIGHT
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+        self.doc_contents[doc_id] = content
+        self.doc_terms[doc_id] = terms
+        self.doc_lengths[doc_id] = sum(terms.values())
+
+    def remove(self, key: str):
+        """
+        Remove a file from the index (no-op if it isn't indexed).
+        """
+        doc_id = self.doc_ids.pop(key, None)
+        if doc_id is None:
+            return
+        self._remove_terms(doc_id)
+        self.doc_keys[doc_id] = None
+        self.doc_contents[doc_id] = None
+        self.doc_terms[doc_id] = None
+        self.doc_lengths[doc_id] = 0
+        self.free_ids.append(doc_id)
+
+    def _remove_terms(self, doc_id: int):
+        for term in self.doc_terms[doc_id]:
+            postings = self.postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[term]
+
+    def get_scores(self, query: str) -> dict[str, float]:
+        """
+        Get the BM25 relevance of the indexed files to the query.
+
+        :param query: query text (eg. the task description)
+        :return: file key -> score, for all indexed files (0 if they don't match the query)
+        """
+        n_docs = len(self.doc_ids)
+        if n_docs == 0:
+            return {}
+
+        lengths = self.doc_lengths
+        average_length = lengths.sum() / n_docs or 1.0
+        scores = np.zeros(len(lengths), dtype=np.float64)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            doc_ids = np.fromiter(postings.keys(), dtype=np.int64, count=len(postings))
+            frequencies = np.fromiter(postings.values(), dtype=np.float64, count=len(postings))
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[doc_ids] / average_length)
+            scores[doc_ids] += idf * frequencies * (self.k1 + 1) / (frequencies + norm)
+
+        return {key: float(scores[doc_id]) for key, doc_id in self.doc_ids.items()}
+
+    def get_term_coverage(self, key: str, query: str) -> float:
+        """
+        Get the share of the query terms found in the file (its content or path).
+
+        :param key: key of an indexed file
+        :param query: query text (eg. the task description)
+        :return: 0 - 1, 0 if the query has no terms
+        """
+        query_terms = set(tokenize(query))
+        if not query_terms:
+            return 0.0
+        doc_terms = self.doc_terms[self.doc_ids[key]]
+        return sum(1 for term in query_terms if term in doc_terms) / len(query_terms)
+
+
+def get_file_key(file: dict) -> str:
+    return file.get('full_path') or os.path.join(file['path'], file['name'])
+
+
+def update_file_index(index: FileIndex, files: list[dict]) -> list[str]:
+    """
+    Update the index with the files, and remove the files not among them from it.
+
+    :param index: index of the project files
+    :param files: files with content, as returned by `Project.get_all_coded_files()`
+    :return: keys of the files in the index, in the order of the files
+    """
+    keys = [get_file_key(file) for file in files]
+    for key, file in zip(keys, files):
+        index.update(key, os.path.join(file['path'], file['name']), file['content'])
+    for key in set(index.doc_ids) - set(keys):
+        index.remove(key)
+    return keys
+
+
+def select_relevant_files(
+    index: FileIndex,
+    files: list[dict],
+    query: str,
+    count_tokens: Callable[[str], int],
+    max_tokens: Optional[int],
+    max_files: Optional[int],
+) -> tuple[list[dict], list[dict]]:
+    """
+    Select the files most relevant to the query that fit in the token budget.
+
+    If all the files fit, they're all selected. Otherwise the files are ranked by their
+    relevance to the query, and the highest ranked ones are selected as long as they fit
+    (skipping the files that are too large for the remaining budget), up to `max_files`.
+
+    The index is updated with the files first (see `update_file_index()`).
+
+    :param index: index of the project files
+    :param files: files with content, as returned by `Project.get_all_coded_files()`
+    :param query: query text (eg. the task description)
+    :param count_tokens: function counting tokens in a text
+    :param max_tokens: max number of tokens in the content of the selected files (None for no limit)
+    :param max_files: max number of selected files (None for no limit)
+    :return: (selected, other) files, both in their original order
+    """
+    keys = update_file_index(index, files)
+
+    def file_tokens(file):
+        return count_tokens(file['content']) if isinstance(file['content'], str) else 0
+
+    tokens = [file_tokens(file) for file in files]
+    if (max_tokens is None or sum(tokens) <= max_tokens) and (max_files is None or len(files) <= max_files):
+        return files, []
+
+    scores = index.get_scores(query)
+    ranking = sorted(range(len(files)), key=lambda i: -scores.get(keys[i], 0))
+    selected = set()
+    remaining_tokens = max_tokens
+    for i in ranking:
+        if max_files is not None and len(selected) >= max_files:
+            break
+        if remaining_tokens is not None:
+            if tokens[i] > remaining_tokens:
+                continue
+            remaining_tokens -= tokens[i]
+        selected.add(i)
+
+    return ([file for i, file in enumerate(files) if i in selected],
+            [file for i, file in enumerate(files) if i not in selected])
@@ -0,0 +1,232 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from utils.file_relevance import FileIndex, update_file_index
+
+# Extensions of the files we expect to be mentioned by name in change descriptions
+KNOWN_EXTENSIONS = frozenset(
+    'js jsx ts tsx mjs cjs vue svelte py html htm css scss sass less json md txt yml yaml toml ini cfg env sh '
+    'sql ejs hbs pug xml java go rb php'.split()
+)
+# Names that look like files, but are usually technologies (eg. "Use Node.js")
+TECHNOLOGY_NAMES = frozenset(
+    'node.js express.js vue.js next.js nuxt.js react.js angular.js nest.js ember.js backbone.js alpine.js '
+    'chart.js three.js d3.js p5.js moment.js socket.io'.split()
+)
+PATH_TOKEN_PATTERN = re.compile(r'[\w@./-]+')
+IDENTIFIER_PATTERN = re.compile(r'[A-Za-z_$][\w$]*')
+CODE_WORD_PATTERN = re.compile(r'`([A-Za-z_$][\w$]*)|([A-Za-z_$][\w$]*)\(')
+
+JS_EXTENSIONS = ('.js', '.jsx', '.ts', '.tsx', '.mjs', '.cjs')
+# Definitions (functions, classes) and routes in the source files, by file extension
+SYMBOL_PATTERNS = {
+    '.py': [
+        re.compile(r'^[ \t]*(?:async[ \t]+)?def[ \t]+(\w+)', re.MULTILINE),
+        re.compile(r'^[ \t]*class[ \t]+(\w+)', re.MULTILINE),
+        # Flask, FastAPI
+        re.compile(r'@\w+\.(?:route|get|post|put|patch|delete)\(\s*[\'"]([^\'"]+)'),
+    ],
+    **{extension: [
+        re.compile(r'\bfunction\b\s*\*?\s*([\w$]+)\s*\('),
+        re.compile(r'\bclass\s+([\w$]+)'),
+        re.compile(r'\b(?:const|let|var)\s+([\w$]+)\s*=\s*(?:async\s*)?(?:function\b|\([^)]*\)\s*=>|[\w$]+\s*=>)'),
+        re.compile(r'\b(?:module\.)?exports\.([\w$]+)\s*='),
+        # Express and similar routers
+        re.compile(r'\.(?:get|post|put|patch|delete|all|use|route)\(\s*[\'"`](/[^\'"`]*)'),
+    ] for extension in JS_EXTENSIONS},
+}
+MIN_SYMBOL_LENGTH = 3
+# Share of the description terms a file must contain to be resolved with full lexical confidence,
+# so a file that only shares a word or two with the description isn't picked just because no other file does
+LEXICAL_MIN_TERM_COVERAGE = 0.4
+
+
+def extract_symbols(name: str, content: str) -> set[str]:
+    """
+    Extract the names of functions and classes defined in a source file, and the routes it handles.
+
+    :param name: file name, the language is detected by its extension
+    :param content: file content
+    :return: symbol names and route paths (starting with "/")
+    """
+    patterns = SYMBOL_PATTERNS.get(os.path.splitext(name)[1].lower())
+    if not patterns or not isinstance(content, str):
+        return set()
+    symbols = set()
+    for pattern in patterns:
+        for symbol in pattern.findall(content):
+            if symbol.startswith('/') or len(symbol) >= MIN_SYMBOL_LENGTH:
+                symbols.add(symbol)
+    symbols.discard('/')
+    return symbols
+
+
+class SymbolIndex:
+    """
+    Index of the symbols (functions, classes, routes) defined in the project files.
+
+    Like `FileIndex`, it's updated one file at a time, only files whose content
+    changed are parsed again.
+
+    >>> index = SymbolIndex()
+    >>> index.update('/app/routes.js', 'routes.js', 'router.post("/login", loginUser);')
+    >>> index.owners['/login']
+    {'/app/routes.js'}
+    """
+
+    def __init__(self):
+        self.contents = {}  # file key -> indexed content
+        self.symbols = {}  # file key -> symbols defined in the file
+        self.owners = {}  # symbol -> keys of the files defining it
+
+    def update(self, key: str, name: str, content: Optional[str]):
+        """
+        Add or update a file in the index (no-op if it didn't change).
+
+        :param key: unique key of the file (its full path)
+        :param name: file name
+        :param content: file content
+        """
+        old_content = self.contents.get(key)
+        if key in self.contents and (old_content is content or old_content == content):
+            return
+        self.remove(key)
+        symbols = extract_symbols(name, content)
+        self.contents[key] = content
+        self.symbols[key] = symbols
+        for symbol in symbols:
+            self.owners.setdefault(symbol, set()).add(key)
+
+    def remove(self, key: str):
+        """
+        Remove a file from the index (no-op if it isn't indexed).
+        """
+        self.contents.pop(key, None)
+        for symbol in self.symbols.pop(key, ()):
+            owners = self.owners[symbol]
+            owners.discard(key)
+            if not owners:
+                del self.owners[symbol]
+
+    def get_mentions(self, text: str) -> dict[str, float]:
+        """
+        Find the files defining the symbols mentioned in the text.
+
+        :param text: text mentioning the symbols, eg. a change description
+        :return: file key -> score, the number of mentioned symbols the file defines (a symbol
+            defined in several files counts as a fraction in each)
+        """
+        identifiers = set(IDENTIFIER_PATTERN.findall(text))
+        # Plain lowercase words are only symbols if they look like code (eg. "login()" or "`login`"),
+        # otherwise a function called "start" would match "start the server"
+        code_words = {quoted or called for quoted, called in CODE_WORD_PATTERN.findall(text)}
+        mentioned = {
+            symbol for symbol in identifiers & self.owners.keys()
+            if not (symbol.isalpha() and symbol.islower()) or symbol in code_words
+        }
+        mentioned.update(symbol for symbol in self.owners if symbol.startswith('/') and symbol in text)
+        scores = {}
+        for symbol in mentioned:
+            owners = self.owners[symbol]
+            for key in owners:
+                scores[key] = scores.get(key, 0) + 1 / len(owners)
+        return scores
+
+
+@dataclass
+class FileResolution:
+    """
+    Result of resolving the file a change description is about.
+    """
+    path: Optional[str]  # path of the file (relative to the project root), None if unresolved
+    confidence: float  # 0 - 1
+    reason: str  # which signal decided: "path", "symbol", "lexical", or why it's unresolved
+
+
+def get_path_mentions(description: str, files: dict[str, str]) -> tuple[set[str], list[str]]:
+    """
+    Find the files mentioned by path or name in the description.
+
+    :param description: change description
+    :param files: file key -> path relative to the project root
+    :return: (keys of the mentioned files, mentioned paths that don't match any of the files)
+    """
+    mentioned = set()
+    unknown = []
+    for token in PATH_TOKEN_PATTERN.findall(description):
+        token = token.rstrip('.-').removeprefix('./').lstrip('/')
+        extension = token.rsplit('.', 1)[-1].lower() if '.' in token else None
+        if extension not in KNOWN_EXTENSIONS:
+            continue
+        matches = {
+            key for key, path in files.items()
+            if path == token or path.endswith('/' + token)
+        }
+        if matches:
+            mentioned.update(matches)
+        elif token.lower() not in TECHNOLOGY_NAMES:
+            unknown.append(token)
+    return mentioned, unknown
+
+
+def resolve_file(
+    description: str,
+    files: list[dict],
+    file_index: FileIndex,
+    symbol_index: SymbolIndex,
+) -> FileResolution:
+    """
+    Resolve the file to change from the change description, without asking the LLM.
+
+    The signals are tried from the strongest to the weakest:
+    1. path: the description mentions exactly one of the files by its path or name (confidence 1);
+       if it mentions a file that doesn't exist, it's probably about a new file, so it's unresolved;
+    2. symbol: only one of the (mentioned) files defines functions, classes or routes mentioned
+       in the description (confidence 0.9), or it defines most of them;
+    3. lexical: the (mentioned) file most similar to the description (BM25), with the confidence
+       depending on how much more similar it is than the next one, and lowered if the file
+       contains less than LEXICAL_MIN_TERM_COVERAGE of the description terms.
+
+    :param description: change description
+    :param files: files with content, as returned by `Project.get_all_coded_files()`
+    :param file_index: relevance index of the project files, updated with the files
+    :param symbol_index: symbol index of the project files, updated with the files
+    :return: the resolved file (check the confidence before using it)
+    """
+    keys = update_file_index(file_index, files)
+    paths = {}
+    for key, file in zip(keys, files):
+        symbol_index.update(key, file['name'], file['content'])
+        paths[key] = os.path.join(file['path'], file['name']).replace(os.path.sep, '/').lstrip('/')
+    for key in set(symbol_index.contents) - paths.keys():
+        symbol_index.remove(key)
+
+    if not paths:
+        return FileResolution(None, 0, 'no files')
+
+    mentioned, unknown = get_path_mentions(description, paths)
+    if unknown:
+        return FileResolution(None, 0, f'unknown file mentioned: {unknown[0]}')
+    if len(mentioned) == 1:
+        return FileResolution(paths[mentioned.pop()], 1, 'path')
+    candidates = mentioned or set(paths)
+
+    def best_two(scores):
+        ranked = sorted(((scores.get(key, 0), paths[key], key) for key in candidates), reverse=True)
+        best_score, _, best_key = ranked[0]
+        second_score = ranked[1][0] if len(ranked) > 1 else 0
+        return best_key, best_score, second_score
+
+    key, best, second = best_two(symbol_index.get_mentions(description))
+    if best > 0 and second == 0:
+        return FileResolution(paths[key], 0.9, 'symbol')
+    if best > 0 and best >= 2 * second:
+        return FileResolution(paths[key], 0.7, 'symbol')
+
+    key, best, second = best_two(file_index.get_scores(description))
+    if best <= 0:
+        return FileResolution(None, 0, 'no similar files')
+    coverage = min(1.0, file_index.get_term_coverage(key, description) / LEXICAL_MIN_TERM_COVERAGE)
+    return FileResolution(paths[key], (1 - second / best) * coverage, 'lexical')
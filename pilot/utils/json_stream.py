@@ -0,0 +1,303 @@
+import json
+import re
+from typing import Optional
+
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+WHITESPACE = ' \t\n\r'
+STRING_SPECIAL = re.compile(r'["\\\x00-\x1f]')
+LITERAL_CHARS = re.compile(r'[A-Za-z0-9+\-.]*')
+NUMBER = re.compile(r'-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?$')
+# JSON is only recognized at the start of a line, optionally after a ```json fence
+JSON_START_PREFIX = re.compile(r'\s*(```(json)?\s*)?$')
+# Python-style booleans are healed by clean_json_response(), so we accept them here too
+LITERALS = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False}
+
+
+class Frame:
+    """
+    An open JSON object or array.
+    """
+
+    def __init__(self, value, schema: Optional[dict], path: list):
+        self.value = value
+        self.schema = schema
+        self.path = path
+        self.key = None
+
+    @property
+    def is_object(self) -> bool:
+        return isinstance(self.value, dict)
+
+
+class StreamingJsonValidator:
+    """
+    Incremental JSON parser and schema validator for streamed LLM responses.
+
+    Feed it the response as it arrives and it raises as soon as the response can
+    no longer be valid, instead of waiting for the whole response:
+
+    * `json.JSONDecodeError` on structural errors (unexpected characters, invalid
+      values, invalid escapes or control characters, extra data after the JSON)
+    * `jsonschema.ValidationError` as soon as a completed value (eg. a string not
+      in the enum, or an object missing a required key) violates the schema
+
+    Text before the JSON starts (eg. a ```json fence) is ignored, that's
+    checked by `assert_json_response()`; the JSON must start on a new line. Incomplete JSON is not an error, as
+    the stream might just not be finished yet.
+
+    >>> validator = StreamingJsonValidator(function['parameters'])
+    >>> for content in deltas:
+    ...     validator.feed(content)
+    """
+
+    def __init__(self, schema: Optional[dict], initial: str = ''):
+        """
+        :param schema: JSON schema the response should conform to
+        :param initial: response received so far (eg. when asking LLM to finish incomplete JSON)
+        """
+        self.schema = schema
+        self.validator_cls = validator_for(schema) if schema else None
+        # chunks received so far, only joined when raising an error
+        self.chunks = []
+        self.length = 0
+        self.state = 'prefix'
+        self.line_prefix = ''
+        self.stack = []
+        # string being parsed: start position, raw (undecoded) chunks and whether it's an object key
+        self.string_start = None
+        self.string_parts = []
+        self.string_is_key = False
+        self.pending_escape = False
+        # literal (number, true/false/null) being parsed
+        self.literal_start = None
+        self.literal = ''
+        self.feed(initial)
+
+    def feed(self, chunk: str):
+        """
+        Feed the next part of the response to the parser.
+
+        :param chunk: text received from the LLM
+        :raises json.JSONDecodeError: if the response is not valid JSON
+        :raises ValidationError: if the response doesn't conform to the schema
+        """
+        offset = self.length
+        self.chunks.append(chunk)
+        self.length += len(chunk)
+        i = 0
+        n = len(chunk)
+
+        while i < n:
+            state = self.state
+
+            if state == 'string':
+                i = self._feed_string(chunk, i, offset)
+                continue
+
+            if state == 'literal':
+                m = LITERAL_CHARS.match(chunk, i)
+                self.literal += m.group(0)
+                i = m.end()
+                if i < n:
+                    self._end_literal()
+                continue
+
+            c = chunk[i]
+
+            if state == 'prefix':
+                if c in '{[' and JSON_START_PREFIX.match(self.line_prefix):
+                    self.state = 'value'
+                    continue
+                self.line_prefix = '' if c == '\n' else self.line_prefix + c
+                i += 1
+                continue
+
+            if state == 'done':
+                if c not in WHITESPACE and c != '`':
+                    raise json.JSONDecodeError('Extra data', self.doc, offset + i)
+                i += 1
+                continue
+
+            if c in WHITESPACE:
+                i += 1
+                continue
+
+            if state in ('value', 'first_item'):
+                if c == ']' and state == 'first_item':
+                    self._close()
+                elif c == '{':
+                    self._open({})
+                    self.state = 'first_key'
+                elif c == '[':
+                    self._open([])
+                    self.state = 'first_item'
+                elif c == '"':
+                    self._start_string(offset + i, is_key=False)
+                elif LITERAL_CHARS.match(c).group(0):
+                    self.state = 'literal'
+                    self.literal_start = offset + i
+                    self.literal = ''
+                    continue
+                else:
+                    raise json.JSONDecodeError('Expecting value', self.doc, offset + i)
+
+            elif state in ('key', 'first_key'):
+                if c == '}' and state == 'first_key':
+                    self._close()
+                elif c == '"':
+                    self._start_string(offset + i, is_key=True)
+                else:
+                    self._unexpected(c, '"', offset + i)
+
+            elif state == 'colon':
+                if c != ':':
+                    self._unexpected(c, ':', offset + i)
+                self.state = 'value'
+
+            elif state == 'after_value':
+                frame = self.stack[-1]
+                closing = '}' if frame.is_object else ']'
+                if c == ',':
+                    self.state = 'key' if frame.is_object else 'value'
+                elif c == closing:
+                    self._close()
+                else:
+                    self._unexpected(c, f"',' or '{closing}'", offset + i)
+
+            i += 1
+
+    @property
+    def doc(self) -> str:
+        """
+        The response received so far.
+        """
+        return ''.join(self.chunks)
+
+    def _unexpected(self, c: str, expected: str, pos: int):
+        # Note: the message must not start with "Expecting", otherwise retry_on_exception()
+        # treats it as incomplete JSON and asks the LLM to continue it.
+        raise json.JSONDecodeError(f"Unexpected character {c!r} (expected {expected})", self.doc, pos)
+
+    def _start_string(self, pos: int, is_key: bool):
+        self.state = 'string'
+        self.string_start = pos
+        self.string_parts = []
+        self.string_is_key = is_key
+        self.pending_escape = False
+
+    def _feed_string(self, chunk: str, i: int, offset: int) -> int:
+        n = len(chunk)
+        if self.pending_escape:
+            self.pending_escape = False
+            self.string_parts.append(chunk[i])
+            i += 1
+
+        while i < n:
+            m = STRING_SPECIAL.search(chunk, i)
+            if m is None:
+                self.string_parts.append(chunk[i:])
+                return n
+
+            c = m.group(0)
+            self.string_parts.append(chunk[i:m.start()])
+            if c == '"':
+                self._end_string()
+                return m.end()
+            if c == '\\':
+                if m.end() < n:
+                    self.string_parts.append(chunk[m.start():m.end() + 1])
+                    i = m.end() + 1
+                else:
+                    self.string_parts.append(c)
+                    self.pending_escape = True
+                    return n
+            else:
+                raise json.JSONDecodeError('Invalid control character at', self.doc, offset + m.start())
+        return n
+
+    def _end_string(self):
+        raw = '"' + ''.join(self.string_parts) + '"'
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError as err:
+            raise json.JSONDecodeError(err.msg, self.doc, self.string_start + err.pos) from None
+
+        if self.string_is_key:
+            self.stack[-1].key = value
+            self.state = 'colon'
+        else:
+            self._add_value(value)
+
+    def _end_literal(self):
+        literal = self.literal
+        if literal in LITERALS:
+            value = LITERALS[literal]
+        elif NUMBER.match(literal):
+            value = json.loads(literal)
+        else:
+            raise json.JSONDecodeError('Expecting value', self.doc, self.literal_start)
+        self._add_value(value)
+
+    def _child(self) -> tuple[Optional[dict], list]:
+        """
+        Get the schema and the path for the next value in the current container.
+        """
+        if not self.stack:
+            return self.schema, []
+
+        frame = self.stack[-1]
+        schema = frame.schema
+        if frame.is_object:
+            key = frame.key
+            child_schema = None
+            if schema is not None:
+                properties = schema.get('properties') or {}
+                if key in properties:
+                    child_schema = properties[key]
+                elif isinstance(schema.get('additionalProperties'), dict):
+                    child_schema = schema['additionalProperties']
+            return child_schema, frame.path + [key]
+
+        index = len(frame.value)
+        child_schema = None
+        if schema is not None:
+            items = schema.get('items')
+            if isinstance(items, dict):
+                child_schema = items
+            elif isinstance(items, list) and index < len(items):
+                child_schema = items[index]
+        return child_schema, frame.path + [index]
+
+    def _validate(self, value, schema: Optional[dict], path: list):
+        if schema is None or self.validator_cls is None:
+            return
+        error = best_match(self.validator_cls(schema).iter_errors(value))
+        if error is not None:
+            error.path.extendleft(reversed(path))
+            raise error
+
+    def _add_value(self, value, validated: bool = False):
+        if not validated:
+            schema, path = self._child()
+            self._validate(value, schema, path)
+
+        frame = self.stack[-1]
+        if frame.is_object:
+            frame.value[frame.key] = value
+        else:
+            frame.value.append(value)
+        self.state = 'after_value'
+
+    def _open(self, value):
+        schema, path = self._child()
+        self.stack.append(Frame(value, schema, path))
+
+    def _close(self):
+        frame = self.stack.pop()
+        self._validate(frame.value, frame.schema, frame.path)
+        if self.stack:
+            self._add_value(frame.value, validated=True)
+        else:
+            self.state = 'done'
@@ -0,0 +1,230 @@
+import json
+import os
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Optional
+
+from const.llm import LLM_CACHE_ENABLED, LLM_CACHE_DIR, LLM_CACHE_MAX_SIZE, LLM_CACHE_TTL, \
+    LLM_CACHE_NONDETERMINISTIC
+from logger.logger import logger
+from utils.settings import loader
+from utils.telemetry import telemetry
+from utils.utils import hash_data
+
+
+class LLMCache:
+    """
+    Content-addressed on-disk cache for LLM responses.
+
+    Responses are keyed on a hash of the model, messages, function definitions
+    and temperature, and stored as one JSON file per response. The cache is
+    bounded in total size (least recently used entries are evicted first) and
+    entries expire after a TTL.
+
+    Concurrent identical requests are coalesced (single-flight): only the first
+    one is sent to the LLM, the rest wait for and share its response.
+
+    This class is a singleton, use the `llm_cache` global variable to access it:
+
+    >>> from utils.llm_cache import llm_cache
+    >>> key = llm_cache.get_key(model, messages, functions, temperature)
+    >>> response = llm_cache.get_or_compute(key, lambda: stream_gpt_completion(...))
+
+    Configuration (environment variables):
+    * LLM_CACHE - enable the cache (default: false)
+    * LLM_CACHE_DIR - cache location (default: `llm_cache` in the config directory)
+    * LLM_CACHE_MAX_SIZE - max total size of cached responses, in MB (default: 256)
+    * LLM_CACHE_TTL - seconds after which cached responses expire (default: 7 days)
+    * LLM_CACHE_NONDETERMINISTIC - also cache requests with temperature > 0 (default: false)
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = LLM_CACHE_DIR,
+        enabled: bool = LLM_CACHE_ENABLED,
+        max_size: int = LLM_CACHE_MAX_SIZE,
+        ttl: float = LLM_CACHE_TTL,
+        cache_nondeterministic: bool = LLM_CACHE_NONDETERMINISTIC,
+    ):
+        self.cache_dir = Path(cache_dir) if cache_dir else loader.config_dir / "llm_cache"
+        self.enabled = enabled
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache_nondeterministic = cache_nondeterministic
+        self.lock = Lock()
+        self.in_flight = {}
+        self.total_size = None
+
+    @staticmethod
+    def get_key(model: str, messages: list[dict], functions: Optional[list], temperature: float) -> str:
+        """
+        Calculate the cache key for a request.
+
+        :param model: model name
+        :param messages: request messages
+        :param functions: function definitions (JSON schema) the response should conform to, if any
+        :param temperature: request temperature
+        :return: cache key (hash of the request)
+        """
+        return hash_data({
+            "model": model,
+            "messages": messages,
+            "functions": functions,
+            "temperature": temperature,
+        })
+
+    def is_cacheable(self, temperature: float) -> bool:
+        """
+        Check whether a request with the given temperature may be served from the cache.
+        """
+        return self.enabled and (temperature == 0 or self.cache_nondeterministic)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Get a cached response.
+
+        :param key: cache key
+        :return: cached response, or None if not cached (or expired)
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as fp:
+                entry = json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry["created_at"] > self.ttl:
+            with self.lock:
+                self._remove(path)
+            return None
+
+        # Mark as recently used for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry["response"]
+
+    def set(self, key: str, response: dict):
+        """
+        Store a response in the cache, evicting least recently used entries if needed.
+
+        :param key: cache key
+        :param response: response to cache
+        """
+        path = self._path(key)
+        data = json.dumps({"created_at": time.time(), "response": response})
+        with self.lock:
+            try:
+                # The entry may be overwritten (eg. expired), its size is replaced
+                replaced_size = path.stat().st_size
+            except OSError:
+                replaced_size = 0
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, "w", encoding="utf-8") as fp:
+                    fp.write(data)
+            except OSError as err:
+                logger.warning(f"Error writing LLM response to cache {path}: {err}")
+                return
+
+            if self.total_size is None:
+                self.total_size = self._calculate_size()
+            else:
+                self.total_size += len(data.encode("utf-8")) - replaced_size
+            if self.total_size > self.max_size:
+                self._evict()
+
+    def _calculate_size(self) -> int:
+        size = 0
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                size += path.stat().st_size
+            except OSError:
+                continue
+        return size
+
+    def _remove(self, path: Path):
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except OSError:
+            return
+        if self.total_size is not None:
+            self.total_size -= size
+
+    def _evict(self):
+        entries = []
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                # Removed in the meantime (eg. expired, or by another process sharing the cache)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        for _, size, path in entries:
+            if self.total_size <= self.max_size:
+                break
+            logger.debug(f"Evicting LLM response {path.stem} from cache")
+            self._remove(path)
+
+    def get_or_compute(self, key: str, compute: Callable[[], dict]) -> dict:
+        """
+        Get a cached response, or compute (and cache) it.
+
+        Concurrent calls with the same key are coalesced into a single `compute()`
+        call. Cache hits and misses are recorded in telemetry.
+
+        :param key: cache key
+        :param compute: function that makes the actual LLM request
+        :return: response
+        """
+        response = self.get(key)
+        if response is not None:
+            logger.info(f"LLM response {key} served from cache")
+            telemetry.inc("num_llm_cache_hits")
+            return response
+
+        with self.lock:
+            future = self.in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self.in_flight[key] = future
+
+        if not is_owner:
+            logger.info(f"Waiting for in-flight LLM request {key}")
+            telemetry.inc("num_llm_cache_hits")
+            return future.result()
+
+        telemetry.inc("num_llm_cache_misses")
+        try:
+            response = compute()
+            if response:
+                self.set(key, response)
+            future.set_result(response)
+            return response
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def clear(self):
+        """
+        Remove all cached responses.
+        """
+        with self.lock:
+            for path in self.cache_dir.glob("*/*.json"):
+                path.unlink()
+            self.total_size = 0
+
+
+llm_cache = LLMCache()
@@ -1,36 +1,62 @@
+import asyncio
+from contextvars import ContextVar
 import re
-import requests
 import os
 import sys
 import time
 import json
-import tiktoken
+import requests
 from prompt_toolkit.styles import Style
 
 from jsonschema import validate, ValidationError
 from utils.style import color_red, color_yellow
-from typing import List
-from const.llm import MAX_GPT_MODEL_TOKENS, API_CONNECT_TIMEOUT, API_READ_TIMEOUT
+from typing import Iterator, List, Mapping, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from const.llm import MAX_GPT_MODEL_TOKENS, API_CONNECT_TIMEOUT, API_READ_TIMEOUT, LLM_MAX_CONCURRENCY
 from const.messages import AFFIRMATIVE_ANSWERS
 from logger.logger import logger, logging
-from helpers.exceptions import TokenLimitError, ApiKeyNotDefinedError, ApiError
+from helpers.exceptions import TokenLimitError, ApiError
 from utils.utils import fix_json, get_prompt
 from utils.function_calling import add_function_calls_to_request, FunctionCallSet, FunctionType
 from utils.questionary import styled_text
+from database.connection import thread_connection
+from database.models.components.base_models import database
 
 from .telemetry import telemetry
-
-tokenizer = tiktoken.get_encoding("cl100k_base")
+from .llm_transport import llm_transport, TransportTiming
+from .llm_router import llm_router, LLMEndpoint
+from .llm_hedging import llm_hedger
+from .llm_latency import llm_latency, LLMRequestTiming
+from .llm_cache import llm_cache
+from .token_counter import TokenCounter
+from .tokenizer import tokenizer_registry
+from .retry_policy import llm_retry_policy
+from .token_budget import fit_messages_to_token_budget, get_request_token_budget
+from .json_stream import StreamingJsonValidator
+from .sse import json_loads
+
+# Worker threads used by the async API to run (blocking) LLM requests concurrently
+llm_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix='llm')
+# Number of failed attempts of the current request so far, set by retry_on_exception()
+request_retries: ContextVar[int] = ContextVar('request_retries', default=0)
+
+
+def get_token_counter() -> TokenCounter:
+    """
+    Get the token counter for the configured model (the tokenizer is loaded on first use).
+    """
+    return tokenizer_registry.get_token_counter(os.getenv('MODEL_NAME', 'gpt-4'))
 
 
 def get_tokens_in_messages(messages: List[str]) -> int:
-    tokenized_messages = [tokenizer.encode(message['content']) for message in messages]
-    return sum(len(tokens) for tokens in tokenized_messages)
+    return get_token_counter().count_messages(messages)
 
 
 # TODO: not used anywhere
 def num_tokens_from_functions(functions):
     """Return the number of tokens used by a list of functions."""
+    tokenizer = get_token_counter().encoding
     num_tokens = 0
     for function in functions:
         function_tokens = len(tokenizer.encode(function['name']))
@@ -93,7 +119,8 @@ def test_api_access(project) -> bool:
 def create_gpt_chat_completion(messages: List[dict], req_type, project,
                                function_calls: FunctionCallSet = None,
                                prompt_data: dict = None,
-                               temperature: float = 0.7):
+                               temperature: float = 0.7,
+                               prompt_path: str = None):
     """
     Called from:
       - AgentConvo.send_message() - these calls often have `function_calls`, usually from `pilot/const/function_calls.py`
@@ -104,6 +131,8 @@ def create_gpt_chat_completion(messages: List[dict], req_type, project,
     :param function_calls: (optional) {'definitions': [{ 'name': str }, ...]}
         see `IMPLEMENT_CHANGES` etc. in `pilot/const/function_calls.py`
     :param prompt_data: (optional) { 'prompt': str, 'variables': { 'variable_name': 'variable_value', ... } }
+    :param temperature: (optional) sampling temperature
+    :param prompt_path: (optional) path of the prompt template the request is made for, to tag its latency stats
     :return: {'text': new_code}
         or if `function_calls` param provided
              {'function_calls': {'name': str, arguments: {...}}}
@@ -120,12 +149,10 @@ def create_gpt_chat_completion(messages: List[dict], req_type, project,
         'stream': True
     }
 
-    # delete some keys if using "OpenRouter" API
-    if os.getenv('ENDPOINT') == 'OPENROUTER':
-        keys_to_delete = ['n', 'max_tokens', 'temperature', 'top_p', 'presence_penalty', 'frequency_penalty']
-        for key in keys_to_delete:
-            if key in gpt_data:
-                del gpt_data[key]
+    cache_key = None
+    if llm_cache.is_cacheable(temperature):
+        cache_key = llm_cache.get_key(gpt_data['model'], messages,
+                                      function_calls['definitions'] if function_calls else None, temperature)
 
     # Advise the LLM of the JSON response schema we are expecting
     messages_length = len(messages)
@@ -133,8 +160,25 @@ def create_gpt_chat_completion(messages: List[dict], req_type, project,
     if prompt_data is not None and function_call_message is not None:
         prompt_data['function_call_message'] = function_call_message
 
+    # Shrink the files sections if needed so we never send a request that's too large
+    token_budget = get_request_token_budget(gpt_data['model'])
+    token_counter = tokenizer_registry.get_token_counter(gpt_data['model'])
+    gpt_data['messages'], n_tokens = fit_messages_to_token_budget(gpt_data['messages'], token_budget,
+                                                                 token_counter.count)
+    if n_tokens > token_budget:
+        err_str = f'Request exceeds the token budget ({n_tokens}/{token_budget} tokens) even after trimming files'
+        print(color_red(f"Error calling LLM API: The request exceeded the maximum token limit (request size: {n_tokens}) tokens."))
+        trace_token_limit_error(n_tokens, gpt_data['messages'], err_str)
+        while len(messages) > messages_length:
+            messages.pop()
+        raise TokenLimitError(n_tokens, token_budget)
+
     try:
-        response = stream_gpt_completion(gpt_data, req_type, project)
+        if cache_key is not None:
+            response = llm_cache.get_or_compute(
+                cache_key, lambda: stream_gpt_completion(gpt_data, req_type, project, prompt_path=prompt_path))
+        else:
+            response = stream_gpt_completion(gpt_data, req_type, project, prompt_path=prompt_path)
 
         # Remove JSON schema and any added retry messages
         while len(messages) > messages_length:
@@ -150,6 +194,52 @@ def create_gpt_chat_completion(messages: List[dict], req_type, project,
         else:
             raise ApiError(f"Error making LLM API request: {e}") from e
 
+
+async def async_create_gpt_chat_completion(messages: List[dict], req_type, project,
+                                           function_calls: FunctionCallSet = None,
+                                           prompt_data: dict = None,
+                                           temperature: float = 0.7,
+                                           prompt_path: str = None):
+    """
+    Async counterpart of create_gpt_chat_completion().
+
+    The request is run on the `llm_executor` worker thread pool (through the same pooled
+    LLM transport), with the same retry, JSON schema validation and telemetry behavior,
+    so several independent requests can be awaited concurrently:
+
+    >>> responses = await asyncio.gather(
+    ...     async_create_gpt_chat_completion(messages_a, req_type, project),
+    ...     async_create_gpt_chat_completion(messages_b, req_type, project),
+    ... )
+
+    Note: `messages` is modified while the request is in flight, so concurrent
+    requests must not share the same messages list.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(llm_executor, partial(
+        run_on_worker_thread, create_gpt_chat_completion, messages, req_type, project,
+        function_calls=function_calls, prompt_data=prompt_data, temperature=temperature, prompt_path=prompt_path,
+    ))
+
+
+async def async_stream_gpt_completion(data, req_type, project, prompt_path: str = None):
+    """
+    Async counterpart of stream_gpt_completion(), see async_create_gpt_chat_completion().
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(llm_executor, partial(run_on_worker_thread, stream_gpt_completion, data,
+                                                            req_type, project, prompt_path=prompt_path))
+
+
+def run_on_worker_thread(function, *args, **kwargs):
+    """
+    Run the function on an `llm_executor` worker thread, closing the database connection
+    it opens (eg. to save the user's answer when a failed request is retried).
+    """
+    with thread_connection(database):
+        return function(*args, **kwargs)
+
+
 def delete_last_n_lines(n):
     for _ in range(n):
         # Move the cursor up one line
@@ -199,11 +289,15 @@ def retry_on_exception(func):
             del args[0]['function_buffer']
 
     def wrapper(*args, **kwargs):
+        attempt = 0
+        retries = 0  # all repeated requests, including the ones for incomplete/invalid JSON and rate limits
         while True:
             try:
                 # spinner_stop(spinner)
+                request_retries.set(retries)
                 return func(*args, **kwargs)
             except Exception as e:
+                retries += 1
                 # Convert exception to string
                 err_str = str(e)
 
@@ -262,20 +356,31 @@ def retry_on_exception(func):
                 print(err_str)
                 logger.error(f'There was a problem with request to openai API: {err_str}')
 
-                project = args[2]
-                print('yes/no', type='buttons-only')
-                user_message = styled_text(
-                    project,
-                    'Do you want to try make the same request again? If yes, just press ENTER. Otherwise, type "no".',
-                    style=Style.from_dict({
-                        'question': '#FF0000 bold',
-                        'answer': '#FF910A bold'
-                    })
-                )
-
-                # TODO: take user's input into consideration - send to LLM?
-                # https://github.com/Pythagora-io/gpt-pilot/issues/122
-                if user_message.lower() not in AFFIRMATIVE_ANSWERS:
+                attempt += 1
+                if llm_retry_policy.enabled:
+                    # Headless mode, nobody to ask
+                    retry = llm_retry_policy.should_retry(e, attempt)
+                    if retry:
+                        wait_duration_sec = llm_retry_policy.get_backoff(attempt)
+                        print(color_yellow(f"Retrying in {wait_duration_sec:.1f} second(s) "
+                                           f"(attempt {attempt + 1}/{llm_retry_policy.max_attempts})..."))
+                        time.sleep(wait_duration_sec)
+                else:
+                    project = args[2]
+                    print('yes/no', type='buttons-only')
+                    user_message = styled_text(
+                        project,
+                        'Do you want to try make the same request again? If yes, just press ENTER. Otherwise, type "no".',
+                        style=Style.from_dict({
+                            'question': '#FF0000 bold',
+                            'answer': '#FF910A bold'
+                        })
+                    )
+                    # TODO: take user's input into consideration - send to LLM?
+                    # https://github.com/Pythagora-io/gpt-pilot/issues/122
+                    retry = user_message.lower() in AFFIRMATIVE_ANSWERS
+
+                if not retry:
                     if isinstance(e, ApiError):
                         raise
                     else:
@@ -284,28 +389,44 @@ def retry_on_exception(func):
     return wrapper
 
 
-def rate_limit_exceeded_sleep(e, err_str):
-    extra_buffer_time = float(os.getenv('RATE_LIMIT_EXTRA_BUFFER', 6))  # extra buffer time to wait, defaults to 6 secs
-    wait_duration_sec = extra_buffer_time  # Default time to wait in seconds
+def get_rate_limit_retry_after(e, err_str) -> Optional[float]:
+    """
+    Get the time (seconds) the API asked us to wait after a rate limit error.
+    """
+    response = getattr(e, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if isinstance(headers, Mapping):
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            try:
+                return float(headers['retry-after'])
+            except ValueError:
+                pass
 
     # Regular expression to find milliseconds
     match = re.search(r'Please try again in (\d+)ms.', err_str)
     if match:
-        milliseconds = int(match.group(1))
-        wait_duration_sec += milliseconds / 1000
-    else:
-        # Regular expression to find minutes and seconds
-        match = re.search(r'Please try again in (\d+)m(\d+\.\d+)s.', err_str)
-        if match:
-            minutes = int(match.group(1))
-            seconds = float(match.group(2))
-            wait_duration_sec += minutes * 60 + seconds
-        else:
-            # Check for only seconds
-            match = re.search(r'(\d+\.\d+)s.', err_str)
-            if match:
-                seconds = float(match.group(1))
-                wait_duration_sec += seconds
+        return int(match.group(1)) / 1000
+
+    # Regular expression to find minutes and seconds
+    match = re.search(r'Please try again in (\d+)m(\d+\.\d+)s.', err_str)
+    if match:
+        return int(match.group(1)) * 60 + float(match.group(2))
+
+    # Check for only seconds
+    match = re.search(r'(\d+\.\d+)s.', err_str)
+    if match:
+        return float(match.group(1))
+
+    return None
+
+
+def rate_limit_exceeded_sleep(e, err_str):
+    retry_after = get_rate_limit_retry_after(e, err_str)
+    # Exponential backoff with jitter on top of the time the API asked us to wait
+    endpoint = getattr(e, 'endpoint', None)
+    wait_duration_sec = llm_transport.rate_limiter.backoff(endpoint, retry_after)
 
     logger.debug(f'Rate limited. Waiting {wait_duration_sec} seconds...')
 
@@ -314,7 +435,7 @@ def rate_limit_exceeded_sleep(e, err_str):
     else:
         message = "Rate limited by the API (we're over 'tokens per minute' or 'requests per minute' limit)"
     print(color_yellow(message))
-    print(color_yellow(f"Retrying in {wait_duration_sec} second(s)... with extra buffer of: {extra_buffer_time} second(s)"))
+    print(color_yellow(f"Retrying in {wait_duration_sec:.1f} second(s)..."))
     time.sleep(wait_duration_sec)
 
 
@@ -348,14 +469,16 @@ def trace_token_limit_error(request_tokens: int, messages: list[dict], err_str:
 
 
 @retry_on_exception
-def stream_gpt_completion(data, req_type, project):
+def stream_gpt_completion(data, req_type, project, prompt_path: str = None):
     """
     Called from create_gpt_chat_completion()
     :param data:
     :param req_type: 'project_description' etc. See common.STEPS
     :param project: NEEDED FOR WRAPPER FUNCTION retry_on_exception
+    :param prompt_path: (optional) path of the prompt template, to tag the request's latency stats
     :return: {'text': str} or {'function_calls': {'name': str, arguments: '{...}'}}
     """
+    function_start_time = time.time()
     # TODO add type dynamically - this isn't working when connected to the external process
     try:
         terminal_width = os.get_terminal_size().columns
@@ -366,6 +489,7 @@ def stream_gpt_completion(data, req_type, project):
     buffer = ''  # A buffer to accumulate incoming data
     expecting_json = None
     received_json = False
+    json_validator = None
 
     if 'functions' in data:
         expecting_json = data['functions']
@@ -393,52 +517,42 @@ def stream_gpt_completion(data, req_type, project):
     # spinner = spinner_start(yellow("Waiting for OpenAI API response..."))
     # print(yellow("Stream response from OpenAI:"))
 
-    # Configure for the selected ENDPOINT
     model = os.getenv('MODEL_NAME', 'gpt-4')
-    endpoint = os.getenv('ENDPOINT')
 
     logger.info(f'> Request model: {model}')
     if logger.isEnabledFor(logging.DEBUG):
         logger.debug('\n'.join([f"{message['role']}: {message['content']}" for message in data['messages']]))
 
-    if endpoint == 'AZURE':
-        # If yes, get the AZURE_ENDPOINT from .ENV file
-        endpoint_url = os.getenv('AZURE_ENDPOINT') + '/openai/deployments/' + model + '/chat/completions?api-version=2023-05-15'
-        headers = {
-            'Content-Type': 'application/json',
-            'api-key': get_api_key_or_throw('AZURE_API_KEY')
-        }
-    elif endpoint == 'OPENROUTER':
-        # If so, send the request to the OpenRouter API endpoint
-        endpoint_url = os.getenv('OPENROUTER_ENDPOINT', 'https://openrouter.ai/api/v1/chat/completions')
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': 'Bearer ' + get_api_key_or_throw('OPENROUTER_API_KEY'),
-            'HTTP-Referer': 'https://github.com/Pythagora-io/gpt-pilot',
-            'X-Title': 'GPT Pilot'
-        }
-        data['max_tokens'] = MAX_GPT_MODEL_TOKENS
-        data['model'] = model
-    else:
-        # If not, send the request to the OpenAI endpoint
-        endpoint_url = os.getenv('OPENAI_ENDPOINT', 'https://api.openai.com/v1/chat/completions')
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': 'Bearer ' + get_api_key_or_throw('OPENAI_API_KEY')
-        }
-        data['model'] = model
-
-    telemetry.set("model", model)
     token_count = get_tokens_in_messages(data['messages'])
+    usage = None
     request_start_time = time.time()
-
-    response = requests.post(
-        endpoint_url,
-        headers=headers,
-        json=data,
-        stream=True,
-        timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT),
+    first_token_time = None
+    stream_end_time = None
+    timing = LLMRequestTiming(req_type, prompt_path, retries=request_retries.get())
+
+    def record_request(tokens: int, is_error: bool):
+        now = time.time()
+        timing.is_error = is_error
+        timing.total_time = now - request_start_time
+        # time spent in our own code before sending the request and after receiving the response
+        timing.client_time = request_start_time - function_start_time + (now - stream_end_time if stream_end_time else 0)
+        llm_latency.record(timing)
+        telemetry.record_llm_request(tokens, now - request_start_time, is_error=is_error)
+
+    response, llm_endpoint, data, response_lines = llm_hedger.send(
+        req_type,
+        partial(send_llm_request, data, token_count),
     )
+    endpoint = llm_endpoint.name
+    model = data.get('model', model)
+    telemetry.set("model", model)
+    timing.endpoint = endpoint
+    timing.model = model
+    transport_timing = getattr(response, 'llm_timing', None)
+    if isinstance(transport_timing, TransportTiming):
+        timing.queue_time = transport_timing.queue_time
+        timing.connect_time = transport_timing.connect_time
+        timing.ttfb = transport_timing.ttfb
 
     if response.status_code == 401 and 'BricksLLM' in response.text:
         print("", type='keyExpired')
@@ -455,83 +569,119 @@ def stream_gpt_completion(data, req_type, project):
     if response.status_code != 200:
         project.dot_pilot_gpt.log_chat_completion(endpoint, model, req_type, data['messages'], response.text)
         logger.info(f'problem with request (status {response.status_code}): {response.text}')
-        telemetry.record_llm_request(token_count, time.time() - request_start_time, is_error=True)
-        raise ApiError(f"API responded with status code: {response.status_code}. Request token size: {token_count} tokens. Response text: {response.text}", response=response)
+        record_request(token_count, is_error=True)
+        raise ApiError(f"API responded with status code: {response.status_code}. Request token size: {token_count} tokens. Response text: {response.text}", response=response, endpoint=endpoint)
 
-    # function_calls = {'name': '', 'arguments': ''}
+    if expecting_json:
+        # Validate the JSON as it streams in, so we can abort as soon as it's invalid
+        json_validator = StreamingJsonValidator(expecting_json[0]['parameters'], gpt_response)
 
-    for line in response.iter_lines():
-        # Ignore keep-alive new lines
-        if line and line != b': OPENROUTER PROCESSING':
-            line = line.decode("utf-8")  # decode the bytes to string
+    # function_calls = {'name': '', 'arguments': ''}
 
-            if line.startswith('data: '):
-                line = line[6:]  # remove the 'data: ' prefix
+    # Content is accumulated in lists and joined once, instead of concatenating strings on every delta
+    response_parts = [gpt_response] if gpt_response else []
+    line_parts = []  # content received since the last newline
 
-            # Check if the line is "[DONE]" before trying to parse it as JSON
-            if line == "[DONE]":
-                continue
+    for data_line in iter_response_lines(response_lines, endpoint):
+        try:
+            json_line = json_loads(data_line)
 
-            try:
-                json_line = json.loads(line)
+            if json_line.get('usage'):
+                usage = json_line['usage']
 
-                if len(json_line['choices']) == 0:
-                    continue
+            if 'error' in json_line:
+                logger.error(f'Error in LLM response: {json_line}')
+                record_request(token_count, is_error=True)
+                error = json_line['error']
+                # The error code (eg. "rate_limit_exceeded") tells retry_on_exception() how to handle it
+                code = f" ({error['code']})" if error.get('code') else ''
+                raise ApiError(f"Error in LLM response: {error['message']}{code}", endpoint=endpoint)
 
-                if 'error' in json_line:
-                    logger.error(f'Error in LLM response: {json_line}')
-                    telemetry.record_llm_request(token_count, time.time() - request_start_time, is_error=True)
-                    raise ValueError(f'Error in LLM response: {json_line["error"]["message"]}')
-
-                choice = json_line['choices'][0]
-
-                # if 'finish_reason' in choice and choice['finish_reason'] == 'function_call':
-                #     function_calls['arguments'] = load_data_to_json(function_calls['arguments'])
-                #     return return_result({'function_calls': function_calls}, lines_printed)
-
-                json_line = choice['delta']
-
-            except json.JSONDecodeError as e:
-                logger.error(f'Unable to decode line: {line} {e.msg}')
-                continue  # skip to the next line
-
-            # handle the streaming response
-            # if 'function_call' in json_line:
-            #     if 'name' in json_line['function_call']:
-            #         function_calls['name'] = json_line['function_call']['name']
-            #         print(f'Function call: {function_calls["name"]}')
-            #
-            #     if 'arguments' in json_line['function_call']:
-            #         function_calls['arguments'] += json_line['function_call']['arguments']
-            #         print(json_line['function_call']['arguments'], type='stream', end='', flush=True)
-
-            if 'content' in json_line:
-                content = json_line.get('content')
-                if content:
-                    buffer += content  # accumulate the data
-
-                    # If you detect a natural breakpoint (e.g., line break or end of a response object), print & count:
-                    if buffer.endswith('\n'):
-                        if expecting_json and not received_json:
-                            try:
-                                received_json = assert_json_response(buffer, lines_printed > 2)
-                            except:
-                                telemetry.record_llm_request(token_count, time.time() - request_start_time, is_error=True)
-                                raise
-                        # or some other condition that denotes a breakpoint
-                        lines_printed += count_lines_based_on_width(buffer, terminal_width)
-                        buffer = ""  # reset the buffer
-
-                    gpt_response += content
-                    print(content, type='stream', end='', flush=True)
+            if len(json_line['choices']) == 0:
+                continue
 
+            choice = json_line['choices'][0]
+
+            # if 'finish_reason' in choice and choice['finish_reason'] == 'function_call':
+            #     function_calls['arguments'] = load_data_to_json(function_calls['arguments'])
+            #     return return_result({'function_calls': function_calls}, lines_printed)
+
+            json_line = choice['delta']
+
+        except json.JSONDecodeError as e:
+            logger.error(f'Unable to decode line: {data_line} {e.msg}')
+            continue  # skip to the next line
+
+        # handle the streaming response
+        # if 'function_call' in json_line:
+        #     if 'name' in json_line['function_call']:
+        #         function_calls['name'] = json_line['function_call']['name']
+        #         print(f'Function call: {function_calls["name"]}')
+        #
+        #     if 'arguments' in json_line['function_call']:
+        #         function_calls['arguments'] += json_line['function_call']['arguments']
+        #         print(json_line['function_call']['arguments'], type='stream', end='', flush=True)
+
+        content = json_line.get('content')
+        if content:
+            # If you detect a natural breakpoint (line break), check the response and count printed lines
+            if '\n' in content:
+                head, _, tail = content.rpartition('\n')
+                line_parts.append(head)
+                buffer = ''.join(line_parts) + '\n'
+                line_parts = [tail] if tail else []
+
+                if expecting_json and not received_json:
+                    try:
+                        received_json = assert_json_response(buffer, lines_printed > 2)
+                    except:
+                        record_request(token_count, is_error=True)
+                        raise
+                lines_printed += count_lines_based_on_width(buffer, terminal_width)
+            else:
+                line_parts.append(content)
+
+            if first_token_time is None:
+                first_token_time = time.time()
+                timing.ttft = first_token_time - request_start_time
+            response_parts.append(content)
+            print(content, type='stream', end='', flush=True)
+
+            if json_validator:
+                try:
+                    json_validator.feed(content)
+                except (json.JSONDecodeError, ValidationError):
+                    logger.info('Invalid JSON in LLM response, aborting the stream')
+                    record_request(token_count, is_error=True)
+                    # Closing the response drops the connection, which cancels the generation
+                    response.close()
+                    raise
+
+    stream_end_time = time.time()
+    gpt_response = ''.join(response_parts)
+    buffer = ''.join(line_parts)
     print('\n', type='stream')
 
-    telemetry.record_llm_request(
-        token_count + len(tokenizer.encode(gpt_response)),
-        time.time() - request_start_time,
-        is_error=False
-    )
+    if usage and 'prompt_tokens' in usage and 'completion_tokens' in usage:
+        completion_tokens = usage['completion_tokens']
+        total_tokens = usage['prompt_tokens'] + completion_tokens
+    else:
+        completion_tokens = tokenizer_registry.get_token_counter(model).count(gpt_response)
+        total_tokens = token_count + completion_tokens
+
+    timing.output_tokens = completion_tokens
+    if first_token_time is not None:
+        llm_hedger.record_ttft(req_type, first_token_time - request_start_time)
+        streaming_time = stream_end_time - first_token_time
+        timing.streaming_time = streaming_time
+        timing.tokens_per_sec = completion_tokens / streaming_time if streaming_time > 0 else None
+        llm_router.record_success(
+            endpoint,
+            ttft=first_token_time - request_start_time,
+            tokens_per_sec=timing.tokens_per_sec,
+        )
+
+    record_request(total_tokens, is_error=False)
 
     # if function_calls['arguments'] != '':
     #     logger.info(f'Response via function call: {function_calls["arguments"]}')
@@ -550,11 +700,65 @@ def stream_gpt_completion(data, req_type, project):
     return return_result({'text': new_code}, lines_printed)
 
 
-def get_api_key_or_throw(env_key: str):
-    api_key = os.getenv(env_key)
-    if api_key is None:
-        raise ApiKeyNotDefinedError(env_key)
-    return api_key
+def send_llm_request(data: dict, token_count: int, hedge: bool = False) -> tuple[requests.Response, LLMEndpoint, dict]:
+    """
+    Send the chat completion request to the fastest healthy LLM endpoint.
+
+    If the endpoint fails (5xx response, timeout or connection error), the
+    request fails over to the next endpoint.
+
+    :param data: request body (without the model)
+    :param token_count: number of tokens in the request
+    :param hedge: whether this is a hedged request; it's sent to the second best
+        endpoint (if there is one), as the original request went to the best one
+    :return: (response, endpoint it was sent to, request body as sent)
+    """
+    candidates = llm_router.candidates()
+    if hedge and len(candidates) > 1:
+        candidates = candidates[1:] + candidates[:1]
+
+    last_error = None
+    for llm_endpoint in candidates:
+        endpoint_url, headers, request_data = llm_endpoint.prepare_request(data)
+        try:
+            response = llm_transport.post(
+                llm_endpoint.name,
+                endpoint_url,
+                n_tokens=token_count,
+                headers=headers,
+                json=request_data,
+                stream=True,
+                timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT),
+            )
+        except (requests.ConnectionError, requests.Timeout) as err:
+            logger.warning(f'Request to LLM endpoint {llm_endpoint.name} failed: {err}')
+            llm_router.record_failure(llm_endpoint.name)
+            last_error = err
+            continue
+
+        if response.status_code >= 500:
+            logger.warning(f'LLM endpoint {llm_endpoint.name} responded with status code {response.status_code}')
+            llm_router.record_failure(llm_endpoint.name)
+            last_error = (response, llm_endpoint, request_data)
+            continue
+
+        return response, llm_endpoint, request_data
+
+    if isinstance(last_error, tuple):
+        # All endpoints responded with an error, report the last one
+        return last_error
+    raise last_error
+
+
+def iter_response_lines(lines: Iterator[bytes], endpoint: str):
+    """
+    Iterate over the streamed response data, marking the endpoint unhealthy if the stream breaks.
+    """
+    try:
+        yield from lines
+    except requests.RequestException:
+        llm_router.record_failure(endpoint)
+        raise
 
 
 def assert_json_response(response: str, or_fail=True) -> bool:
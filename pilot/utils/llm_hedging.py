@@ -0,0 +1,215 @@
+import json
+import math
+import queue
+from collections import deque
+from itertools import chain
+from threading import Lock, Thread
+from typing import Callable, Optional
+
+from const.llm import LLM_HEDGING_ENABLED, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES, LLM_HEDGE_MIN_DELAY, \
+    LLM_HEDGE_WINDOW, LLM_HEDGE_MAX_PER_TYPE, LLM_HEDGE_CAPS
+from logger.logger import logger
+from utils.sse import iter_response_data, json_loads
+from utils.telemetry import telemetry
+
+
+def has_content(data: bytes) -> bool:
+    """
+    Check if the streamed response data (SSE payload) contains (the first) content token.
+    """
+    try:
+        chunk = json_loads(data)
+    except ValueError:
+        return False
+    if not isinstance(chunk, dict):
+        return False
+    if 'error' in chunk:
+        return True
+    choices = chunk.get('choices') or []
+    return bool(choices and (choices[0].get('delta') or {}).get('content'))
+
+
+class Attempt:
+    """
+    A single (original or hedged) request.
+    """
+
+    def __init__(self, hedge: bool):
+        self.hedge = hedge
+        self.response = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        if self.response is not None:
+            self.response.close()
+
+
+class RequestHedger:
+    """
+    Hedges LLM requests that take unusually long to start streaming.
+
+    The time to first token (TTFT) of recent requests is tracked per request
+    type (eg. 'architecture', 'coding'). If a request hasn't received its first
+    token within the chosen percentile of the recent TTFTs, a duplicate request
+    is sent (to the next best endpoint, if there's more than one). Whichever one
+    starts streaming first is used and the other one is cancelled.
+
+    Hedging starts once there are enough TTFT samples. Each request type can be
+    hedged a limited number of times per run, to keep the cost bounded.
+
+    This class is a singleton, use the `llm_hedger` global variable to access it:
+
+    >>> from utils.llm_hedging import llm_hedger
+    >>> response, endpoint, data, lines = llm_hedger.send(req_type, lambda hedge: send_llm_request(...))
+
+    Configuration (environment variables):
+    * LLM_HEDGING - enable hedged requests (default: false)
+    * LLM_HEDGE_PERCENTILE - TTFT percentile after which the request is hedged (default: 95)
+    * LLM_HEDGE_MIN_DELAY - never hedge earlier than this (default: 2 seconds)
+    * LLM_HEDGE_MAX_PER_TYPE - max hedged requests per request type (default: 10)
+    * LLM_HEDGE_CAPS - JSON object with per-request-type limits, eg. {"coding": 20, "architecture": 0}
+    """
+
+    def __init__(
+        self,
+        enabled: bool = LLM_HEDGING_ENABLED,
+        percentile: float = LLM_HEDGE_PERCENTILE,
+        min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        min_delay: float = LLM_HEDGE_MIN_DELAY,
+        window: int = LLM_HEDGE_WINDOW,
+        max_per_type: int = LLM_HEDGE_MAX_PER_TYPE,
+        caps: Optional[dict[str, int]] = None,
+    ):
+        """
+        :param enabled: whether to hedge requests
+        :param percentile: TTFT percentile (0-100) after which the request is hedged
+        :param min_samples: number of TTFT samples needed before hedging
+        :param min_delay: min time (seconds) before hedging
+        :param window: number of recent TTFT samples to keep
+        :param max_per_type: max number of hedged requests per request type
+        :param caps: per-request-type overrides of `max_per_type`
+        """
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.window = window
+        self.max_per_type = max_per_type
+        self.caps = json.loads(LLM_HEDGE_CAPS) if caps is None and LLM_HEDGE_CAPS else (caps or {})
+        self.samples = {}
+        self.all_samples = deque(maxlen=window)
+        self.hedges_sent = {}
+        self.lock = Lock()
+
+    def record_ttft(self, req_type: str, ttft: float):
+        """
+        Record the time to first token of a request.
+        """
+        with self.lock:
+            if req_type not in self.samples:
+                self.samples[req_type] = deque(maxlen=self.window)
+            self.samples[req_type].append(ttft)
+            self.all_samples.append(ttft)
+
+    def get_threshold(self, req_type: str) -> Optional[float]:
+        """
+        Get the time after which a request of this type should be hedged.
+
+        Uses the request type's own TTFT samples if there are enough of them,
+        otherwise samples of all requests.
+
+        :return: hedging threshold (seconds), or None if there aren't enough samples yet
+        """
+        with self.lock:
+            samples = self.samples.get(req_type)
+            if samples is None or len(samples) < self.min_samples:
+                samples = self.all_samples
+            if len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        # nearest-rank percentile
+        rank = max(1, math.ceil(self.percentile / 100 * len(ordered)))
+        return max(self.min_delay, ordered[rank - 1])
+
+    def _reserve_hedge(self, req_type: str) -> bool:
+        with self.lock:
+            sent = self.hedges_sent.get(req_type, 0)
+            if sent >= self.caps.get(req_type, self.max_per_type):
+                return False
+            self.hedges_sent[req_type] = sent + 1
+            return True
+
+    def send(self, req_type: str, send_request: Callable[[bool], tuple]) -> tuple:
+        """
+        Send the request, hedging it if it doesn't start streaming in time.
+
+        :param req_type: request type ('architecture', 'coding', ...)
+        :param send_request: function sending the request, returning (response, endpoint, data);
+            its argument is True for the hedged request
+        :return: (response, endpoint, data, response data iterator) of the request that started streaming first
+        """
+        threshold = self.get_threshold(req_type) if self.enabled else None
+        if threshold is None:
+            response, endpoint, data = send_request(False)
+            return response, endpoint, data, iter_response_data(response)
+
+        results = queue.Queue()
+        primary = self._start(send_request, Attempt(hedge=False), results)
+        attempts = [primary]
+
+        try:
+            result = results.get(timeout=threshold)
+        except queue.Empty:
+            if self._reserve_hedge(req_type):
+                logger.info(f'No response to {req_type} request after {threshold:.1f}s, sending a hedged request')
+                telemetry.inc("num_llm_hedged_requests")
+                attempts.append(self._start(send_request, Attempt(hedge=True), results))
+            result = results.get()
+
+        first_error = None
+        pending = len(attempts)
+        while True:
+            attempt, value, error = result
+            pending -= 1
+            if error is None:
+                break
+            if first_error is None:
+                first_error = error
+            if pending == 0:
+                raise first_error
+            result = results.get()
+
+        for other in attempts:
+            if other is not attempt:
+                other.cancel()
+        if attempt.hedge:
+            telemetry.inc("num_llm_hedge_wins")
+        return value
+
+    @staticmethod
+    def _start(send_request: Callable[[bool], tuple], attempt: Attempt, results: queue.Queue) -> Attempt:
+        def run():
+            try:
+                response, endpoint, data = send_request(attempt.hedge)
+                attempt.response = response
+                if attempt.cancelled:
+                    response.close()
+                    return
+                stream = iter_response_data(response)
+                prefetched = []
+                if response.status_code == 200:
+                    # Wait for the first token, keeping the data received so far
+                    for data_line in stream:
+                        prefetched.append(data_line)
+                        if has_content(data_line):
+                            break
+                results.put((attempt, (response, endpoint, data, chain(prefetched, stream)), None))
+            except Exception as err:  # noqa
+                results.put((attempt, None, err))
+
+        Thread(target=run, daemon=True).start()
+        return attempt
+
+
+llm_hedger = RequestHedger()
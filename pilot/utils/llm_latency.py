@@ -0,0 +1,184 @@
+import argparse
+from collections import deque
+from dataclasses import dataclass, asdict
+import json
+import math
+from threading import Lock
+from typing import Iterable, Optional
+
+from const.llm import LLM_LATENCY_LOG, LLM_LATENCY_MAX_TIMINGS
+from logger.logger import logger
+
+# Latency breakdown fields, in the order of the request lifecycle
+LATENCY_FIELDS = ['queue_time', 'connect_time', 'ttfb', 'ttft', 'streaming_time', 'tokens_per_sec', 'client_time']
+
+
+@dataclass
+class LLMRequestTiming:
+    """
+    Latency breakdown of a single LLM request (one attempt, retries are recorded separately).
+
+    All times are in seconds, relative to when the request was started, and
+    None if the request failed before reaching that point.
+    """
+    req_type: str
+    prompt_path: Optional[str]
+    endpoint: Optional[str] = None
+    model: Optional[str] = None
+    retries: int = 0  # number of failed attempts before this one
+    is_error: bool = False
+    queue_time: Optional[float] = None  # waiting for the rate limiter
+    connect_time: Optional[float] = None  # establishing a new connection, 0 if a pooled one was reused
+    ttfb: Optional[float] = None  # from sending the request to the response headers (including connect_time)
+    ttft: Optional[float] = None  # from starting the request to the first content token
+    streaming_time: Optional[float] = None  # from the first content token to the end of the response
+    total_time: Optional[float] = None
+    output_tokens: Optional[int] = None
+    tokens_per_sec: Optional[float] = None  # output tokens per second of streaming
+    client_time: Optional[float] = None  # our own overhead: preparing the request and processing the response
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def percentile(values: list[float], pct: float) -> Optional[float]:
+    """
+    Nearest-rank percentile of the values, or None if there are none.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize_timings(timings: Iterable[dict], group_by: tuple[str, ...] = ('req_type', 'prompt_path')) -> list[dict]:
+    """
+    Aggregate request timings per group.
+
+    :param timings: request timings (as dicts, see `LLMRequestTiming.to_dict()`)
+    :param group_by: timing fields to group the requests by
+    :return: per group: the group fields, number of requests, errors and retries, requests
+        per endpoint, and the median and 95th percentile of each latency breakdown field
+    """
+    groups = {}
+    for timing in timings:
+        key = tuple(timing.get(field) for field in group_by)
+        groups.setdefault(key, []).append(timing)
+
+    summary = []
+    for key, group in groups.items():
+        stats = dict(zip(group_by, key))
+        stats['num_requests'] = len(group)
+        stats['num_errors'] = sum(1 for timing in group if timing.get('is_error'))
+        stats['num_retries'] = sum(1 for timing in group if timing.get('retries'))
+        endpoints = {}
+        for timing in group:
+            endpoints[timing.get('endpoint')] = endpoints.get(timing.get('endpoint'), 0) + 1
+        stats['endpoints'] = endpoints
+        for field in LATENCY_FIELDS:
+            values = [timing[field] for timing in group if timing.get(field) is not None]
+            stats[field] = {'median': percentile(values, 50), 'p95': percentile(values, 95)}
+        summary.append(stats)
+    return summary
+
+
+def format_latency_report(timings: list[dict]) -> str:
+    """
+    Format request timings as a plain text report, per prompt and per endpoint.
+    """
+    def fmt(value: Optional[float], width: int = 7) -> str:
+        return f'{value:{width}.2f}' if value is not None else f'{"-":>{width}}'
+
+    header = (f'{"requests":>8} {"errors":>6} {"retried":>7} {"queue":>7} {"connect":>7} {"ttfb":>7} '
+              f'{"ttft":>7} {"ttft95":>7} {"stream":>7} {"tok/s":>7} {"client":>7}')
+    lines = [f'LLM request latency (seconds, medians unless noted) for {len(timings)} requests']
+    for title, group_by in [('Prompt', ('req_type', 'prompt_path')), ('Endpoint', ('endpoint', 'model'))]:
+        lines.append('')
+        lines.append(f'{title:50} {header}')
+        for stats in summarize_timings(timings, group_by):
+            name = ' '.join(str(stats[field]) for field in group_by if stats[field] is not None) or '-'
+            lines.append(
+                f'{name[:50]:50} {stats["num_requests"]:8} {stats["num_errors"]:6} {stats["num_retries"]:7} '
+                f'{fmt(stats["queue_time"]["median"])} {fmt(stats["connect_time"]["median"])} '
+                f'{fmt(stats["ttfb"]["median"])} {fmt(stats["ttft"]["median"])} {fmt(stats["ttft"]["p95"])} '
+                f'{fmt(stats["streaming_time"]["median"])} {fmt(stats["tokens_per_sec"]["median"], 7)} '
+                f'{fmt(stats["client_time"]["median"])}'
+            )
+    return '\n'.join(lines)
+
+
+class LatencyRecorder:
+    """
+    Records the latency breakdown of each LLM request, to tell a slow model
+    (time to first token, tokens/sec) apart from slow networking (connect time,
+    time to first byte) and our own overhead (rate limiter wait, preparing the
+    request and processing the response).
+
+    Only the latest `max_timings` requests are kept in memory, the log file has them all.
+    Requests are tagged with the request type and the prompt template they were
+    made for. The timings are also sent with telemetry (aggregated per request
+    type), appended to a local JSON lines log if LLM_LATENCY_LOG is set, and
+    summarized in the debug log at exit. To report on a log file:
+
+        python -m utils.llm_latency llm-latency.jsonl
+
+    This class is a singleton, use the `llm_latency` global variable to access it:
+
+    >>> from utils.llm_latency import llm_latency
+    >>> llm_latency.record(LLMRequestTiming('coding', 'development/implement_changes.prompt', ttft=1.2, ...))
+    >>> print(llm_latency.report())
+
+    Configuration (environment variables):
+    * LLM_LATENCY_LOG - path to the JSON lines file to append the request timings to (default: none)
+    """
+
+    def __init__(self, log_path: Optional[str] = LLM_LATENCY_LOG, max_timings: int = LLM_LATENCY_MAX_TIMINGS):
+        self.log_path = log_path
+        self.timings = deque(maxlen=max_timings)
+        self.lock = Lock()
+
+    def record(self, timing: LLMRequestTiming):
+        """
+        Record the timings of a request.
+        """
+        data = timing.to_dict()
+        logger.debug(f'LLM request timing: {data}')
+        with self.lock:
+            self.timings.append(data)
+            if self.log_path:
+                try:
+                    with open(self.log_path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(data) + '\n')
+                except OSError as err:
+                    logger.warning(f'Error writing LLM latency log {self.log_path}: {err}')
+
+    def get_timings(self) -> list[dict]:
+        """
+        Get the recorded timings (as dicts, see `LLMRequestTiming.to_dict()`).
+        """
+        with self.lock:
+            return list(self.timings)
+
+    def report(self) -> str:
+        """
+        Summarize the recorded timings, per prompt and per endpoint.
+        """
+        return format_latency_report(self.get_timings())
+
+
+llm_latency = LatencyRecorder()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize LLM request latency from an LLM_LATENCY_LOG file.')
+    parser.add_argument('log', help='path to the JSON lines log')
+    args = parser.parse_args()
+
+    with open(args.log, 'r', encoding='utf-8') as f:
+        timings = [json.loads(line) for line in f if line.strip()]
+    print(format_latency_report(timings))
+
+
+if __name__ == '__main__':
+    main()
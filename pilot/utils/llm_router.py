@@ -0,0 +1,288 @@
+import json
+import os
+import time
+from threading import Lock
+from typing import Optional
+from urllib.parse import urlparse
+
+from const.llm import LLM_ENDPOINTS, LLM_ROUTER_EWMA_ALPHA, LLM_ROUTER_COOLDOWN, LLM_ROUTER_MAX_COOLDOWN, \
+    LLM_ROUTER_EXPECTED_TOKENS, MAX_GPT_MODEL_TOKENS, LLM_STREAM_USAGE
+from helpers.exceptions import ApiKeyNotDefinedError, InvalidLLMEndpointsError
+from logger.logger import logger
+
+ENDPOINT_TYPES = ('OPENAI', 'AZURE', 'OPENROUTER')
+# Request parameters not sent to OpenRouter
+OPENROUTER_UNSUPPORTED_PARAMS = ('n', 'max_tokens', 'temperature', 'top_p', 'presence_penalty', 'frequency_penalty')
+
+
+class LLMEndpoint:
+    """
+    An LLM API endpoint: OpenAI (or any OpenAI-compatible API), Azure or OpenRouter.
+
+    URL, API key and model that aren't set explicitly are read from the
+    environment variables (OPENAI_ENDPOINT, OPENAI_API_KEY, MODEL_NAME, ...)
+    when the request is made.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        type: str = 'OPENAI',
+        url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        model: Optional[str] = None,
+    ):
+        if type not in ENDPOINT_TYPES:
+            raise ValueError(f'Unknown LLM endpoint type {type} (expected one of {", ".join(ENDPOINT_TYPES)})')
+        self.name = name
+        self.type = type
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+
+    @classmethod
+    def from_env(cls) -> 'LLMEndpoint':
+        """
+        Create the endpoint selected by the ENDPOINT environment variable.
+        """
+        endpoint_type = os.getenv('ENDPOINT') or 'OPENAI'
+        return cls(endpoint_type, endpoint_type if endpoint_type in ENDPOINT_TYPES else 'OPENAI')
+
+    def _get_api_key(self, env_key: str) -> str:
+        api_key = self.api_key or os.getenv(env_key)
+        if api_key is None:
+            raise ApiKeyNotDefinedError(env_key)
+        return api_key
+
+    @staticmethod
+    def _stream_usage(url: str) -> bool:
+        """
+        Whether to request token usage stats in streamed responses from `url`.
+
+        Other OpenAI-compatible servers may reject the `stream_options` parameter,
+        so unless LLM_STREAM_USAGE is set, they're only requested from OpenAI.
+        """
+        if LLM_STREAM_USAGE is None:
+            return urlparse(url).hostname == 'api.openai.com'
+        return LLM_STREAM_USAGE.lower() in ['true', '1', 'yes']
+
+    def prepare_request(self, data: dict) -> tuple[str, dict, dict]:
+        """
+        Get the URL, headers and body of a chat completion request to this endpoint.
+
+        :param data: request body (model, messages, ...)
+        :return: (url, headers, request body)
+        """
+        model = self.model or os.getenv('MODEL_NAME', 'gpt-4')
+
+        if self.type == 'AZURE':
+            url = (self.url or os.getenv('AZURE_ENDPOINT')) + '/openai/deployments/' + model + \
+                '/chat/completions?api-version=2023-05-15'
+            headers = {
+                'Content-Type': 'application/json',
+                'api-key': self._get_api_key('AZURE_API_KEY')
+            }
+            return url, headers, data
+
+        if self.type == 'OPENROUTER':
+            url = self.url or os.getenv('OPENROUTER_ENDPOINT', 'https://openrouter.ai/api/v1/chat/completions')
+            headers = {
+                'Content-Type': 'application/json',
+                'Authorization': 'Bearer ' + self._get_api_key('OPENROUTER_API_KEY'),
+                'HTTP-Referer': 'https://github.com/Pythagora-io/gpt-pilot',
+                'X-Title': 'GPT Pilot'
+            }
+            data = {key: value for key, value in data.items() if key not in OPENROUTER_UNSUPPORTED_PARAMS}
+            return url, headers, {**data, 'max_tokens': MAX_GPT_MODEL_TOKENS, 'model': model}
+
+        url = self.url or os.getenv('OPENAI_ENDPOINT', 'https://api.openai.com/v1/chat/completions')
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': 'Bearer ' + self._get_api_key('OPENAI_API_KEY')
+        }
+        data = {**data, 'model': model}
+        if self._stream_usage(url):
+            # Ask for token usage in the last streamed chunk so we don't have to count response tokens ourselves
+            data['stream_options'] = {'include_usage': True}
+        return url, headers, data
+
+
+class EndpointStats:
+    """
+    Health and performance of an endpoint.
+    """
+
+    def __init__(self):
+        self.ttft = None  # EWMA of time to first token (seconds)
+        self.tokens_per_sec = None  # EWMA of streaming speed
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.unhealthy_until
+
+    def estimated_latency(self, expected_tokens: int) -> float:
+        """
+        Estimated time to receive a response with `expected_tokens` tokens.
+        """
+        latency = self.ttft or 0.0
+        if self.tokens_per_sec:
+            latency += expected_tokens / self.tokens_per_sec
+        return latency
+
+
+class LLMRouter:
+    """
+    Routes LLM requests to the fastest healthy endpoint.
+
+    For each endpoint it keeps an exponentially weighted moving average (EWMA)
+    of the time to first token and streaming speed (tokens/sec). Requests go to
+    the endpoint with the lowest estimated latency; endpoints that haven't been
+    measured yet are tried first. An endpoint that fails (5xx response, timeout,
+    connection error) is considered unhealthy for a cooldown period, which doubles
+    with each consecutive failure, and the request fails over to the next endpoint.
+
+    Endpoints are configured with the LLM_ENDPOINTS environment variable, a JSON
+    list of endpoints, eg.:
+
+        [{"name": "openai-1", "type": "OPENAI", "api_key": "sk-..."},
+         {"name": "local", "type": "OPENAI", "url": "http://localhost:8000/v1/chat/completions"},
+         {"name": "openrouter", "type": "OPENROUTER", "model": "openai/gpt-4-turbo-preview"}]
+
+    If it's not set, the only endpoint is the one selected by the ENDPOINT variable.
+    It's parsed when the first request is made, so an invalid configuration is
+    reported as an `InvalidLLMEndpointsError` instead of breaking the import.
+
+    This class is a singleton, use the `llm_router` global variable to access it:
+
+    >>> from utils.llm_router import llm_router
+    >>> for endpoint in llm_router.candidates():
+    ...     url, headers, data = endpoint.prepare_request(data)
+    """
+
+    def __init__(
+        self,
+        endpoints: Optional[list[LLMEndpoint]] = None,
+        alpha: float = LLM_ROUTER_EWMA_ALPHA,
+        cooldown: float = LLM_ROUTER_COOLDOWN,
+        max_cooldown: float = LLM_ROUTER_MAX_COOLDOWN,
+        expected_tokens: int = LLM_ROUTER_EXPECTED_TOKENS,
+        config: Optional[str] = None,
+    ):
+        """
+        :param endpoints: endpoints to route requests to (default: endpoint from the ENDPOINT env variable)
+        :param alpha: EWMA smoothing factor, weight of the latest measurement
+        :param cooldown: how long an endpoint is considered unhealthy after a failure (seconds)
+        :param max_cooldown: max cooldown after consecutive failures (seconds)
+        :param expected_tokens: typical response size, used to compare endpoints' latency
+        :param config: JSON list of endpoints to route requests to, instead of `endpoints` (parsed on first use)
+        """
+        self.endpoints = endpoints
+        self.config = config
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.expected_tokens = expected_tokens
+        self.stats: dict[str, EndpointStats] = {}
+        self.lock = Lock()
+
+    @classmethod
+    def from_env(cls) -> 'LLMRouter':
+        return cls(config=LLM_ENDPOINTS)
+
+    @staticmethod
+    def parse_endpoints(config: str) -> list[LLMEndpoint]:
+        """
+        Parse the JSON list of endpoints.
+
+        :param config: JSON list of endpoints, see `LLMRouter`
+        :return: endpoints
+        :raises InvalidLLMEndpointsError: if the configuration is invalid
+        """
+        try:
+            endpoint_configs = json.loads(config)
+        except json.JSONDecodeError as err:
+            raise InvalidLLMEndpointsError(f'not valid JSON ({err})') from err
+        if not isinstance(endpoint_configs, list) or not endpoint_configs:
+            raise InvalidLLMEndpointsError('expected a non-empty list of endpoints')
+
+        endpoints = []
+        for endpoint_config in endpoint_configs:
+            if not isinstance(endpoint_config, dict):
+                raise InvalidLLMEndpointsError(f'expected an object for each endpoint, got {endpoint_config!r}')
+            try:
+                endpoints.append(LLMEndpoint(**endpoint_config))
+            except (TypeError, ValueError) as err:
+                raise InvalidLLMEndpointsError(f'endpoint {endpoint_config!r}: {err}') from err
+
+        names = [endpoint.name for endpoint in endpoints]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise InvalidLLMEndpointsError(f'duplicate endpoint names {", ".join(duplicates)}')
+        return endpoints
+
+    def get_endpoints(self) -> list[LLMEndpoint]:
+        if self.endpoints is None and self.config:
+            self.endpoints = self.parse_endpoints(self.config)
+        return self.endpoints or [LLMEndpoint.from_env()]
+
+    def _get_stats(self, name: str) -> EndpointStats:
+        if name not in self.stats:
+            self.stats[name] = EndpointStats()
+        return self.stats[name]
+
+    def candidates(self) -> list[LLMEndpoint]:
+        """
+        Get the endpoints in the order they should be tried.
+
+        Healthy endpoints go first, fastest first; unhealthy ones are
+        only tried as a last resort, the one that recovers soonest first.
+        """
+        endpoints = self.get_endpoints()
+        now = time.monotonic()
+        with self.lock:
+            stats = {endpoint.name: self._get_stats(endpoint.name) for endpoint in endpoints}
+            healthy = [endpoint for endpoint in endpoints if stats[endpoint.name].is_healthy(now)]
+            unhealthy = [endpoint for endpoint in endpoints if not stats[endpoint.name].is_healthy(now)]
+            # sorted() is stable, so endpoints with the same estimate keep the configured order
+            healthy.sort(key=lambda endpoint: stats[endpoint.name].estimated_latency(self.expected_tokens))
+            unhealthy.sort(key=lambda endpoint: stats[endpoint.name].unhealthy_until)
+        return healthy + unhealthy
+
+    def _ewma(self, current: Optional[float], value: float) -> float:
+        if current is None:
+            return value
+        return self.alpha * value + (1 - self.alpha) * current
+
+    def record_success(self, name: str, ttft: Optional[float] = None, tokens_per_sec: Optional[float] = None):
+        """
+        Record a successful request.
+
+        :param name: endpoint name
+        :param ttft: time to first token (seconds)
+        :param tokens_per_sec: streaming speed after the first token
+        """
+        with self.lock:
+            stats = self._get_stats(name)
+            stats.consecutive_failures = 0
+            stats.unhealthy_until = 0.0
+            if ttft is not None:
+                stats.ttft = self._ewma(stats.ttft, ttft)
+            if tokens_per_sec:
+                stats.tokens_per_sec = self._ewma(stats.tokens_per_sec, tokens_per_sec)
+
+    def record_failure(self, name: str):
+        """
+        Record a failed request (5xx response, timeout or connection error), marking the endpoint unhealthy.
+
+        :param name: endpoint name
+        """
+        with self.lock:
+            stats = self._get_stats(name)
+            cooldown = min(self.max_cooldown, self.cooldown * 2 ** stats.consecutive_failures)
+            stats.consecutive_failures += 1
+            stats.unhealthy_until = time.monotonic() + cooldown
+        logger.warning(f'LLM endpoint {name} failed, not using it for {cooldown:.0f}s')
+
+
+llm_router = LLMRouter.from_env()
@@ -0,0 +1,226 @@
+from dataclasses import dataclass
+import time
+from threading import Lock, local
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from const.llm import LLM_POOL_SIZE, LLM_POOL_IDLE_TIMEOUT, LLM_KEEP_ALIVE
+from logger.logger import logger
+from utils.rate_limiter import RateLimiter
+
+# Time spent establishing connections, per thread (requests sends the request in the calling thread)
+_connect_timing = local()
+
+
+class TimedConnectionMixin:
+    """
+    Measures the time spent establishing the connection (TCP, and TLS for HTTPS).
+    """
+
+    def connect(self):
+        start = time.monotonic()
+        try:
+            super().connect()
+        finally:
+            _connect_timing.elapsed = getattr(_connect_timing, 'elapsed', 0.0) + time.monotonic() - start
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter whose connections record how long it took to establish them.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+@dataclass
+class TransportTiming:
+    """
+    Network timings of an LLM request, attached to its response as `response.llm_timing`.
+    """
+    queue_time: float  # waiting for the rate limiter (seconds)
+    connect_time: float  # establishing a new connection, 0 if a pooled connection was reused (seconds)
+    ttfb: float  # from sending the request to receiving the response headers, including connect_time (seconds)
+
+
+class LLMTransport:
+    """
+    Process-wide HTTP transport for LLM API requests.
+
+    Keeps one `requests.Session` (with its own connection pool) per LLM
+    endpoint (OPENAI, AZURE, OPENROUTER), so consecutive completions reuse
+    already established TCP/TLS connections instead of paying DNS, TCP and
+    TLS setup cost on every request. Requests are paced by the `RateLimiter`
+    to stay within the endpoint's rate limits. The time spent waiting for the
+    rate limiter, connecting and waiting for the response headers is attached
+    to each response as `response.llm_timing` (see `TransportTiming`).
+
+    This class is a singleton, use the `llm_transport` global variable to access it:
+
+    >>> from utils.llm_transport import llm_transport
+    >>> response = llm_transport.post('OPENAI', url, headers=headers, json=data, stream=True)
+
+    Configuration (environment variables):
+    * LLM_POOL_SIZE - max number of pooled connections per endpoint (default: 10)
+    * LLM_KEEP_ALIVE - whether to keep connections open between requests (default: true)
+    * LLM_POOL_IDLE_TIMEOUT - seconds after which an unused endpoint pool is
+      discarded, because the server has most likely closed the connections (default: 60);
+      a pool is in use from the start of a request until its response is consumed or
+      closed, pools with requests in flight are never discarded
+    """
+
+    def __init__(
+        self,
+        pool_size: int = LLM_POOL_SIZE,
+        keep_alive: bool = LLM_KEEP_ALIVE,
+        idle_timeout: float = LLM_POOL_IDLE_TIMEOUT,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.last_used = {}
+        self.in_flight = {}
+        self.lock = Lock()
+        self.rate_limiter = rate_limiter or RateLimiter()
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['Connection'] = 'keep-alive' if self.keep_alive else 'close'
+        return session
+
+    def get_session(self, endpoint: Optional[str]) -> requests.Session:
+        """
+        Get the pooled session for the endpoint, creating it if needed.
+
+        :param endpoint: endpoint name ('OPENAI', 'AZURE', 'OPENROUTER'), defaults to 'OPENAI'
+        :return: session to use for the request
+        """
+        return self._checkout(endpoint or 'OPENAI', in_flight=False)
+
+    def _checkout(self, endpoint: str, in_flight: bool) -> requests.Session:
+        now = time.monotonic()
+
+        with self.lock:
+            self._evict_idle(now)
+            session = self.sessions.get(endpoint)
+            if session is None:
+                logger.debug(f'Creating LLM connection pool for {endpoint} (size {self.pool_size})')
+                session = self._create_session()
+                self.sessions[endpoint] = session
+            self.last_used[endpoint] = now
+            if in_flight:
+                self.in_flight[endpoint] = self.in_flight.get(endpoint, 0) + 1
+
+        return session
+
+    def _release(self, endpoint: str):
+        with self.lock:
+            self.in_flight[endpoint] -= 1
+            if endpoint in self.sessions:
+                self.last_used[endpoint] = time.monotonic()
+
+    def _evict_idle(self, now: float):
+        for endpoint, last_used in list(self.last_used.items()):
+            if now - last_used > self.idle_timeout and not self.in_flight.get(endpoint):
+                logger.debug(f'Closing idle LLM connection pool for {endpoint}')
+                self.sessions.pop(endpoint).close()
+                del self.last_used[endpoint]
+
+    def _release_on_done(self, endpoint: str, response: requests.Response):
+        """
+        Release the endpoint's pool when the response is consumed or closed (that's
+        when urllib3 returns the connection to the pool), or right away if it already was.
+        """
+        release_conn = getattr(response.raw, 'release_conn', None)
+        if release_conn is None or response._content_consumed:
+            self._release(endpoint)
+            return
+
+        released = False
+
+        def release():
+            nonlocal released
+            try:
+                release_conn()
+            finally:
+                if not released:
+                    released = True
+                    self._release(endpoint)
+
+        response.raw.release_conn = release
+
+    def post(self, endpoint: Optional[str], url: str, n_tokens: int = 0, **kwargs) -> requests.Response:
+        """
+        Send a POST request to the LLM API through the endpoint's connection pool.
+
+        Waits first if the endpoint's rate limit would be exceeded, and updates the
+        limits from the response headers.
+
+        :param endpoint: endpoint name ('OPENAI', 'AZURE', 'OPENROUTER')
+        :param url: request URL
+        :param n_tokens: number of tokens in the request, for the tokens-per-minute limit
+        :param kwargs: any other arguments accepted by `requests.Session.post()`
+        :return: response
+        """
+        start = time.monotonic()
+        self.rate_limiter.acquire(endpoint, n_tokens)
+        sent = time.monotonic()
+        _connect_timing.elapsed = 0.0
+        endpoint = endpoint or 'OPENAI'
+        session = self._checkout(endpoint, in_flight=True)
+        try:
+            response = session.post(url, **kwargs)
+        except BaseException:
+            self._release(endpoint)
+            raise
+        self._release_on_done(endpoint, response)
+        response.llm_timing = TransportTiming(
+            queue_time=sent - start,
+            connect_time=_connect_timing.elapsed,
+            ttfb=time.monotonic() - sent,
+        )
+        self.rate_limiter.update(endpoint, response.headers, response.status_code)
+        return response
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+            self.last_used = {}
+
+
+llm_transport = LLMTransport()
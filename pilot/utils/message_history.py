@@ -0,0 +1,151 @@
+from typing import Iterable, Optional
+
+
+class MessageNode:
+    """
+    Immutable node of a persistent message history: a message and the history before it.
+
+    Histories that share a prefix share its nodes, so a snapshot of a history
+    is just a reference to its last node.
+    """
+    __slots__ = ('message', 'parent', 'length')
+
+    def __init__(self, message: dict, parent: Optional['MessageNode']):
+        self.message = message
+        self.parent = parent
+        self.length = parent.length + 1 if parent is not None else 1
+
+    def messages(self) -> list[dict]:
+        """
+        Get all messages of the history ending with this node, oldest first.
+        """
+        messages = []
+        node = self
+        while node is not None:
+            messages.append(node.message)
+            node = node.parent
+        messages.reverse()
+        return messages
+
+
+def get_ancestor(node: Optional[MessageNode], length: int) -> Optional[MessageNode]:
+    """
+    Get the node ending the first `length` messages of the history ending with `node`.
+    """
+    while node is not None and node.length > length:
+        node = node.parent
+    return node
+
+
+class MessageHistory(list):
+    """
+    List of conversation messages that keeps a persistent (append-only, shared-prefix)
+    copy of itself, so it can be snapshotted in O(1) and restored to a snapshot in
+    time proportional to the number of messages added since.
+
+    It's a regular list otherwise. Appending and popping the last message are O(1),
+    other modifications rebuild the persistent copy (O(n)).
+
+    >>> history = MessageHistory([system_message])
+    >>> snapshot = history.snapshot()
+    >>> history.append(user_message)
+    >>> history.restore(snapshot)
+    >>> history == [system_message]
+    True
+
+    Note: messages (dicts) are shared between the history and its snapshots, not copied.
+    """
+
+    def __init__(self, messages: Iterable[dict] = ()):
+        super().__init__()
+        self.head = None
+        self.extend(messages)
+
+    def __reduce__(self):
+        # copy/pickle the messages, the persistent copy is rebuilt
+        return self.__class__, (list(self),)
+
+    def _rebuild(self):
+        self.head = None
+        for message in self:
+            self.head = MessageNode(message, self.head)
+
+    def snapshot(self) -> Optional[MessageNode]:
+        """
+        Get a snapshot of the current messages (None if there are none).
+        """
+        return self.head
+
+    def restore(self, snapshot: Optional[MessageNode]):
+        """
+        Restore the messages to a snapshot.
+
+        :param snapshot: snapshot returned by `snapshot()`, of this or any other history
+        """
+        length = snapshot.length if snapshot is not None else 0
+        if length <= len(self) and get_ancestor(self.head, length) is snapshot:
+            # only messages were added since the snapshot
+            super().__delitem__(slice(length, None))
+        else:
+            super().__setitem__(slice(None), snapshot.messages() if snapshot is not None else [])
+        self.head = snapshot
+
+    def append(self, message: dict):
+        super().append(message)
+        self.head = MessageNode(message, self.head)
+
+    def extend(self, messages: Iterable[dict]):
+        for message in messages:
+            self.append(message)
+
+    def __iadd__(self, messages: Iterable[dict]) -> 'MessageHistory':
+        self.extend(messages)
+        return self
+
+    def pop(self, index: int = -1) -> dict:
+        last = index in (-1, len(self) - 1)
+        message = super().pop(index)
+        if last:
+            self.head = self.head.parent
+        else:
+            self._rebuild()
+        return message
+
+    def __delitem__(self, index):
+        if isinstance(index, slice) and index.step in (None, 1) and index.stop is None:
+            # removing the last messages
+            start = range(len(self))[index].start if len(self) else 0
+            super().__delitem__(index)
+            self.head = get_ancestor(self.head, start)
+        else:
+            super().__delitem__(index)
+            self._rebuild()
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._rebuild()
+
+    def __imul__(self, n: int) -> 'MessageHistory':
+        super().__imul__(n)
+        self._rebuild()
+        return self
+
+    def insert(self, index: int, message: dict):
+        super().insert(index, message)
+        self._rebuild()
+
+    def remove(self, message: dict):
+        super().remove(message)
+        self._rebuild()
+
+    def clear(self):
+        super().clear()
+        self.head = None
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._rebuild()
+
+    def reverse(self):
+        super().reverse()
+        self._rebuild()
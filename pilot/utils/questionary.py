@@ -2,11 +2,24 @@ import platform
 import questionary
 import sys
 from database.database import save_user_input
+from helpers.exceptions import NoScriptedAnswerError, InvalidScriptedAnswerError
+from utils.scripted_answers import scripted_answers
 from utils.style import style_config
 from utils.print import remove_ansi_codes
+from logger.logger import logger
 
 
 def styled_select(*args, **kwargs):
+    question = args[0] if args else kwargs.get("message", "")
+    answer = get_scripted_answer(question)
+    if answer is not None:
+        choices = get_choice_values(args[1] if len(args) > 1 else kwargs.get("choices", []))
+        if answer in choices:
+            return answer
+        if scripted_answers.headless:
+            raise InvalidScriptedAnswerError(remove_ansi_codes(question), answer, choices)
+        logger.warning(f'Scripted answer "{answer}" is not one of the choices {choices}, asking the user')
+
     kwargs["style"] = style_config.get_style()
     # TODO add saving and loading of user input
     return questionary.select(*args, **kwargs).unsafe_ask()  # .ask() is included here
@@ -22,7 +35,10 @@ def styled_text(project, question, ignore_user_input_count=False, style=None, hi
     if not ignore_user_input_count:
         project.user_inputs_count += 1
 
-    if project is not None and project.check_ipc():
+    scripted_answer = get_scripted_answer(question)
+    if scripted_answer is not None:
+        response = scripted_answer
+    elif project is not None and project.check_ipc():
         response = print(question, type='user_input_request')
     else:
         used_style = style if style is not None else style_config.get_style()
@@ -38,6 +54,39 @@ def styled_text(project, question, ignore_user_input_count=False, style=None, hi
     return response
 
 
+def get_scripted_answer(question: str):
+    """
+    Get the answer to a question from the answer file (see ScriptedAnswers).
+
+    :return: the answer, or None if the question should be asked interactively
+    :raises NoScriptedAnswerError: in headless mode, if there's no answer to the question
+    """
+    question = remove_ansi_codes(question)
+    answer = scripted_answers.get_answer(question)
+    if answer is None:
+        if scripted_answers.headless:
+            raise NoScriptedAnswerError(question)
+        return None
+
+    print(f'{question}\n> {answer}')
+    return answer
+
+
+def get_choice_values(choices: list) -> list:
+    """
+    Get the values `questionary.select()` returns for the choices (strings, `Choice` objects or dicts).
+    """
+    values = []
+    for choice in choices:
+        if isinstance(choice, dict):
+            values.append(choice.get('value', choice.get('name')))
+        elif isinstance(choice, questionary.Choice):
+            values.append(choice.value)
+        else:
+            values.append(choice)
+    return values
+
+
 def get_user_feedback():
     return questionary.text('How did GPT Pilot do? Were you able to create any app that works? '
                             'Please write any feedback you have or just press ENTER to exit: ',
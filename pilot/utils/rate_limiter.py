@@ -0,0 +1,201 @@
+import random
+import re
+import time
+from threading import Lock
+from typing import Mapping, Optional
+
+from const.llm import RATE_LIMITER_ENABLED, RATE_LIMIT_BACKOFF_BASE, RATE_LIMIT_BACKOFF_MAX
+from logger.logger import logger
+
+DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a rate limit reset duration, as sent in `x-ratelimit-reset-*` headers.
+
+    :param value: duration, eg. "20ms", "1.5s", "6m0s", or a plain number of seconds
+    :return: duration in seconds, or None if it can't be parsed
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class TokenBucket:
+    """
+    Token bucket mirroring the API provider's rate limit (requests or tokens per minute).
+
+    Capacity and refill rate are taken from the rate limit response headers. Reservations
+    may take the level below zero; the caller then has to wait until it's refilled.
+    """
+
+    def __init__(self, capacity: float, rate: float, level: float, now: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = level
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """
+        Take `amount` from the bucket.
+
+        :return: how long (seconds) the caller has to wait before the reservation is covered
+        """
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
+        if self.level >= 0 or self.rate <= 0:
+            return 0
+        return -self.level / self.rate
+
+    def update(self, limit: float, remaining: float, reset: Optional[float], now: float):
+        """
+        Sync the bucket with the state reported by the API.
+
+        :param limit: max requests/tokens per minute
+        :param remaining: requests/tokens remaining
+        :param reset: seconds until the limit is fully replenished
+        """
+        self.capacity = limit
+        self.level = remaining
+        self.updated = now
+        if reset and limit > remaining:
+            self.rate = (limit - remaining) / reset
+        else:
+            self.rate = limit / 60
+
+
+class EndpointLimits:
+    """
+    Rate limit state of a single LLM endpoint.
+    """
+
+    def __init__(self):
+        self.buckets: dict[str, TokenBucket] = {}
+        self.blocked_until = 0.0
+        self.consecutive_rate_limits = 0
+
+
+class RateLimiter:
+    """
+    Client-side adaptive rate limiter for LLM API requests.
+
+    Paces requests before the API starts rejecting them: the `x-ratelimit-*` response
+    headers (as sent by OpenAI and compatible APIs) are used to keep a requests-per-minute
+    and a tokens-per-minute token bucket per endpoint, and each request reserves one
+    request and its (locally counted) prompt tokens before it's sent. Until the endpoint
+    reports its limits, requests aren't delayed.
+
+    When a request is rate limited anyway, the endpoint is paused for the time the API
+    asked for, plus an exponential backoff with jitter that grows with each consecutive
+    rate limit error.
+
+    Used by the `LLMTransport`, which passes the request token count:
+
+    >>> from utils.llm_transport import llm_transport
+    >>> llm_transport.post('OPENAI', url, n_tokens=1200, headers=headers, json=data, stream=True)
+
+    Configuration (environment variables):
+    * RATE_LIMITER - whether to pace the requests using the rate limit headers (default: true)
+    * RATE_LIMIT_BACKOFF_BASE - backoff after the first rate limit error (default: 1 second)
+    * RATE_LIMIT_BACKOFF_MAX - max backoff (default: 60 seconds)
+    """
+
+    def __init__(
+        self,
+        enabled: bool = RATE_LIMITER_ENABLED,
+        backoff_base: float = RATE_LIMIT_BACKOFF_BASE,
+        backoff_max: float = RATE_LIMIT_BACKOFF_MAX,
+    ):
+        self.enabled = enabled
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.endpoints: dict[str, EndpointLimits] = {}
+        self.lock = Lock()
+
+    def _get_limits(self, endpoint: Optional[str]) -> EndpointLimits:
+        endpoint = endpoint or 'OPENAI'
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = EndpointLimits()
+        return self.endpoints[endpoint]
+
+    def acquire(self, endpoint: Optional[str], n_tokens: int = 0) -> float:
+        """
+        Reserve capacity for a request, waiting until it's available.
+
+        :param endpoint: endpoint name ('OPENAI', 'AZURE', 'OPENROUTER')
+        :param n_tokens: number of tokens in the request
+        :return: number of seconds waited
+        """
+        now = time.monotonic()
+        with self.lock:
+            limits = self._get_limits(endpoint)
+            wait = max(0.0, limits.blocked_until - now)
+            if self.enabled:
+                for name, amount in (('requests', 1), ('tokens', n_tokens)):
+                    bucket = limits.buckets.get(name)
+                    if bucket is not None:
+                        wait = max(wait, bucket.reserve(amount, now))
+
+        if wait > 0:
+            logger.info(f'Rate limiter: waiting {wait:.2f}s before sending request to {endpoint or "OPENAI"}')
+            time.sleep(wait)
+        return wait
+
+    def update(self, endpoint: Optional[str], headers: Mapping[str, str], status_code: int = 200):
+        """
+        Update the endpoint's limits from the API response headers.
+
+        :param endpoint: endpoint name
+        :param headers: response headers (case-insensitive mapping)
+        :param status_code: response status code
+        """
+        now = time.monotonic()
+        with self.lock:
+            limits = self._get_limits(endpoint)
+            if status_code != 429:
+                limits.consecutive_rate_limits = 0
+
+            for name in ('requests', 'tokens'):
+                try:
+                    limit = float(headers[f'x-ratelimit-limit-{name}'])
+                    remaining = float(headers[f'x-ratelimit-remaining-{name}'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                reset = parse_duration(headers.get(f'x-ratelimit-reset-{name}'))
+                bucket = limits.buckets.get(name)
+                if bucket is None:
+                    limits.buckets[name] = bucket = TokenBucket(limit, limit / 60, remaining, now)
+                bucket.update(limit, remaining, reset, now)
+
+    def backoff(self, endpoint: Optional[str], retry_after: Optional[float] = None) -> float:
+        """
+        Pause the endpoint after a rate limit error.
+
+        The pause is the time the API asked us to wait (if any), plus an exponential backoff
+        (`backoff_base * 2^n` for the n-th consecutive rate limit error, capped at `backoff_max`)
+        with jitter, so that concurrent requests don't all retry at the same moment.
+
+        :param endpoint: endpoint name
+        :param retry_after: time (seconds) the API asked us to wait
+        :return: pause duration (seconds); until it's over, `acquire()` waits for it too
+        """
+        with self.lock:
+            limits = self._get_limits(endpoint)
+            backoff = min(self.backoff_max, self.backoff_base * 2 ** limits.consecutive_rate_limits)
+            limits.consecutive_rate_limits += 1
+            wait = (retry_after or 0) + random.uniform(backoff / 2, backoff)
+            limits.blocked_until = max(limits.blocked_until, time.monotonic() + wait)
+        return wait
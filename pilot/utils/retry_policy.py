@@ -0,0 +1,87 @@
+import random
+
+from const.common import HEADLESS
+from const.llm import LLM_MAX_ATTEMPTS, LLM_RETRY_BACKOFF_BASE, LLM_RETRY_BACKOFF_MAX, LLM_RETRYABLE_ERRORS
+
+
+class RetryPolicy:
+    """
+    Non-interactive retry policy for failed LLM requests.
+
+    In headless mode, instead of asking the user whether to retry a failed request,
+    retryable errors are retried after an exponential backoff (with jitter), up to
+    the max number of attempts. Other errors fail the request immediately.
+
+    An error is retryable if any of the configured patterns is:
+    * the name of the exception class (or one of its base classes), eg. "ConnectionError"
+    * the HTTP status code of the response, eg. "503"
+    * a (case-insensitive) substring of the error message, eg. "overloaded"
+
+    Rate limit, token limit and invalid JSON errors are handled separately, before the policy applies.
+
+    This class is a singleton, use the `llm_retry_policy` global variable to access it:
+
+    >>> from utils.retry_policy import llm_retry_policy
+    >>> if llm_retry_policy.enabled and llm_retry_policy.should_retry(err, attempt):
+    ...     time.sleep(llm_retry_policy.get_backoff(attempt))
+
+    Configuration (environment variables):
+    * HEADLESS - use the policy instead of asking the user (default: false)
+    * LLM_MAX_ATTEMPTS - max attempts of a request (default: 5)
+    * LLM_RETRY_BACKOFF_BASE - wait before the first retry, in seconds (default: 2)
+    * LLM_RETRY_BACKOFF_MAX - max wait between retries, in seconds (default: 60)
+    * LLM_RETRYABLE_ERRORS - comma-separated patterns of retryable errors
+      (default: connection errors, timeouts and HTTP 408, 409, 5xx)
+    """
+
+    def __init__(
+        self,
+        enabled: bool = HEADLESS,
+        max_attempts: int = LLM_MAX_ATTEMPTS,
+        backoff_base: float = LLM_RETRY_BACKOFF_BASE,
+        backoff_max: float = LLM_RETRY_BACKOFF_MAX,
+        retryable_errors: str = LLM_RETRYABLE_ERRORS,
+    ):
+        self.enabled = enabled
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retryable_errors = [pattern.strip() for pattern in retryable_errors.split(',') if pattern.strip()]
+
+    def is_retryable(self, error: Exception) -> bool:
+        """
+        Check whether the error matches any of the retryable error patterns.
+        """
+        class_names = {cls.__name__ for cls in type(error).__mro__}
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+        message = str(error).lower()
+
+        for pattern in self.retryable_errors:
+            if pattern.isdigit():
+                if status_code == int(pattern):
+                    return True
+            elif pattern in class_names or pattern.lower() in message:
+                return True
+        return False
+
+    def should_retry(self, error: Exception, attempt: int) -> bool:
+        """
+        Check whether a request should be retried.
+
+        :param error: error the request failed with
+        :param attempt: number of attempts made so far (starting at 1)
+        """
+        return attempt < self.max_attempts and self.is_retryable(error)
+
+    def get_backoff(self, attempt: int) -> float:
+        """
+        Get the time to wait before the next attempt.
+
+        :param attempt: number of attempts made so far (starting at 1)
+        :return: wait time (seconds)
+        """
+        backoff = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        return random.uniform(backoff / 2, backoff)
+
+
+llm_retry_policy = RetryPolicy()
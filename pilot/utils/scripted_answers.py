@@ -0,0 +1,83 @@
+import json
+import re
+from threading import Lock
+from typing import Optional
+
+from const.common import HEADLESS, ANSWERS_FILE
+from logger.logger import logger
+
+
+class ScriptedAnswers:
+    """
+    Answers to interactive questions, loaded from a JSON file, for unattended runs.
+
+    The file contains a list of rules. For each question, the first rule whose
+    `question` regular expression matches it (case-insensitive search) is used.
+    If `answer` is a list, its answers are given in turn each time the rule is
+    used, and the last one is repeated once they run out:
+
+        [
+            {"question": "Describe your app", "answer": "A simple todo app in node/express"},
+            {"question": "try make the same request again", "answer": ["", "", "no"]},
+            {"question": "", "answer": ""}
+        ]
+
+    In headless mode a question without a matching rule is an error, otherwise
+    it's asked interactively as usual.
+
+    This class is a singleton, use the `scripted_answers` global variable to access it:
+
+    >>> from utils.scripted_answers import scripted_answers
+    >>> answer = scripted_answers.get_answer("Describe your app in as much detail as possible.")
+
+    Configuration (environment variables):
+    * ANSWERS_FILE - path to the answer file (default: none)
+    * HEADLESS - never ask the user, fail on unanswered questions (default: false)
+    """
+
+    def __init__(self, path: Optional[str] = ANSWERS_FILE, headless: bool = HEADLESS):
+        self.headless = headless
+        self.rules = []
+        self.lock = Lock()
+        if path:
+            self.load(path)
+
+    def load(self, path: str):
+        """
+        Load the rules from an answer file.
+
+        :param path: path to the JSON answer file
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            rules = json.load(f)
+
+        self.rules = []
+        for rule in rules:
+            answers = rule['answer'] if isinstance(rule['answer'], list) else [rule['answer']]
+            if not answers:
+                raise ValueError(f'No answer for question "{rule["question"]}" in {path}')
+            self.rules.append({
+                'pattern': re.compile(rule['question'], re.IGNORECASE),
+                'answers': [str(answer) for answer in answers],
+                'used': 0,
+            })
+        logger.info(f'Loaded {len(self.rules)} scripted answers from {path}')
+
+    def get_answer(self, question: str) -> Optional[str]:
+        """
+        Get the scripted answer to a question.
+
+        :param question: question asked
+        :return: answer, or None if no rule matches the question
+        """
+        with self.lock:
+            for rule in self.rules:
+                if rule['pattern'].search(question):
+                    answers = rule['answers']
+                    answer = answers[min(rule['used'], len(answers) - 1)]
+                    rule['used'] += 1
+                    return answer
+        return None
+
+
+scripted_answers = ScriptedAnswers()
@@ -0,0 +1,97 @@
+import json
+from typing import Iterable, Iterator
+
+from const.llm import LLM_STREAM_CHUNK_SIZE
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    # orjson is optional; the standard library decoder accepts bytes too, it's just slower
+    json_loads = json.loads
+
+DONE = b'[DONE]'
+IGNORED_FIELDS = (b'event:', b'id:', b'retry:')
+
+
+class SSEDecoder:
+    """
+    Incremental decoder of server-sent event (SSE) streams.
+
+    Works directly on the raw bytes received from the network: each chunk is
+    split into lines at once, and only the `data` payloads are returned, still
+    as bytes, so they can be passed straight to the JSON decoder. Comments (eg.
+    OpenRouter's ": OPENROUTER PROCESSING" keep-alives), other fields and the
+    final "[DONE]" are skipped. Lines without the `data:` prefix are returned
+    as they are, for APIs that stream bare JSON lines.
+
+    >>> decoder = SSEDecoder()
+    >>> decoder.feed(b'data: {"choices": []}\\n\\ndata: {"cho')
+    [b'{"choices": []}']
+    >>> decoder.feed(b'ices": []}\\n\\ndata: [DONE]\\n\\n')
+    [b'{"choices": []}']
+    """
+
+    def __init__(self):
+        self.pending = b''
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        """
+        Decode the next chunk of the stream.
+
+        :param chunk: bytes received from the network
+        :return: data payloads of the lines completed by this chunk
+        """
+        if self.pending:
+            chunk = self.pending + chunk
+        lines = chunk.split(b'\n')
+        self.pending = lines.pop()
+        return self._decode_lines(lines)
+
+    def flush(self) -> list[bytes]:
+        """
+        Decode what's left in the buffer at the end of the stream.
+        """
+        lines = [self.pending] if self.pending else []
+        self.pending = b''
+        return self._decode_lines(lines)
+
+    @staticmethod
+    def _decode_lines(lines: list[bytes]) -> list[bytes]:
+        payloads = []
+        for line in lines:
+            if line.endswith(b'\r'):
+                line = line[:-1]
+            # Empty lines separate events, lines starting with ":" are comments
+            if not line or line[0] == 58:
+                continue
+            if line.startswith(b'data:'):
+                line = line[6:] if line[5:6] == b' ' else line[5:]
+            elif line.startswith(IGNORED_FIELDS):
+                continue
+            if line != DONE:
+                payloads.append(line)
+        return payloads
+
+
+def iter_sse_data(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Iterate over the data payloads of an SSE stream.
+
+    :param chunks: raw bytes of the stream, in arbitrary chunks
+    :return: iterator over the data payloads
+    """
+    decoder = SSEDecoder()
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.flush()
+
+
+def iter_response_data(response) -> Iterator[bytes]:
+    """
+    Iterate over the data payloads of a streamed HTTP response.
+
+    :param response: `requests.Response` sent with `stream=True`
+    :return: iterator over the data payloads
+    """
+    return iter_sse_data(response.iter_content(chunk_size=LLM_STREAM_CHUNK_SIZE))
@@ -1,6 +1,7 @@
 from logging import getLogger
 from pathlib import Path
 import sys
+from threading import Lock
 import time
 import traceback
 from typing import Any
@@ -10,6 +11,7 @@ import requests
 
 from .settings import settings, version, config_path
 from const.telemetry import LARGE_REQUEST_THRESHOLD, SLOW_REQUEST_THRESHOLD
+from utils.llm_latency import llm_latency, summarize_timings
 
 log = getLogger(__name__)
 
@@ -54,6 +56,8 @@ class Telemetry:
         self.enabled = False
         self.telemetry_id = None
         self.endpoint = None
+        # LLM requests may be recorded from several worker threads at once
+        self.lock = Lock()
         self.clear_data()
 
         if settings.telemetry is not None:
@@ -112,6 +116,22 @@ class Telemetry:
             "num_llm_errors": 0,
             # Number of tokens used for LLM requests
             "num_llm_tokens": 0,
+            # Number of LLM requests served from the response cache
+            "num_llm_cache_hits": 0,
+            # Number of cacheable LLM requests not found in the response cache
+            "num_llm_cache_misses": 0,
+            # Number of hedged LLM requests (duplicates sent because the original was slow to respond)
+            "num_llm_hedged_requests": 0,
+            # Number of hedged LLM requests that responded before the original
+            "num_llm_hedge_wins": 0,
+            # Number of times a conversation was compacted (older turns replaced with their summary)
+            "num_convo_compactions": 0,
+            # Number of times the file to change was found locally, without asking the LLM
+            "num_file_resolver_hits": 0,
+            # Number of times the LLM was asked for the file to change
+            "num_file_resolver_fallbacks": 0,
+            # Estimated time saved by finding the file to change locally (seconds)
+            "file_resolver_saved_time": None,
             # Number of development steps
             "num_steps": 0,
             # Number of commands run during development
@@ -146,11 +166,14 @@ class Telemetry:
             "large_requests": None,
             # Statistics for slow requests
             "slow_requests": None,
+            # LLM request latency breakdown per request type (see utils.llm_latency.summarize_timings)
+            "llm_latency": None,
         })
         self.start_time = None
         self.end_time = None
         self.large_requests = []
         self.slow_requests = []
+        self.file_resolver_times = {True: [], False: []}
 
     def setup(self):
         """
@@ -207,7 +230,8 @@ class Telemetry:
             )
             return
 
-        self.data[name] += value
+        with self.lock:
+            self.data[name] += value
 
     def start(self):
         """
@@ -302,6 +326,17 @@ class Telemetry:
         if elapsed_time > SLOW_REQUEST_THRESHOLD:
             self.slow_requests.append(elapsed_time)
 
+    def record_file_resolution(self, resolved_locally: bool, elapsed_time: float):
+        """
+        Record finding the file to change (see `CodeMonkey.identify_file_to_change()`).
+
+        :param resolved_locally: whether the file was found locally, or the LLM was asked
+        :param elapsed_time: time it took to find the file (seconds)
+        """
+        self.inc("num_file_resolver_hits" if resolved_locally else "num_file_resolver_fallbacks")
+        with self.lock:
+            self.file_resolver_times[resolved_locally].append(elapsed_time)
+
     def calculate_statistics(self):
         """
         Calculate statistics for large and slow requests.
@@ -326,6 +361,14 @@ class Telemetry:
             "avg_time": sum(self.slow_requests) // n_slow if n_slow > 0 else None,
             "median_time": sorted(self.slow_requests)[n_slow // 2] if n_slow > 0 else None,
         }
+        # The request timings are recorded by llm_latency (see `LatencyRecorder`)
+        self.data["llm_latency"] = summarize_timings(llm_latency.get_timings(), group_by=("req_type",))
+
+        local_times = self.file_resolver_times[True]
+        llm_times = self.file_resolver_times[False]
+        if local_times and llm_times:
+            saved_per_hit = sum(llm_times) / len(llm_times) - sum(local_times) / len(local_times)
+            self.data["file_resolver_saved_time"] = round(saved_per_hit * len(local_times), 3)
 
     def send(self, event:str = "pilot-telemetry"):
         """
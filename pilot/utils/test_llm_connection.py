@@ -1,6 +1,8 @@
+import asyncio
 import builtins
 from json import JSONDecodeError
 import os
+import time
 
 import pytest
 from unittest.mock import call, patch, Mock
@@ -15,8 +17,15 @@ from utils.function_calling import parse_agent_response, FunctionType
 from test.test_utils import assert_non_empty_string
 from test.mock_questionary import MockQuestionary
 from utils.llm_connection import create_gpt_chat_completion, stream_gpt_completion, \
-    assert_json_response, assert_json_schema, clean_json_response, retry_on_exception
+    assert_json_response, assert_json_schema, clean_json_response, retry_on_exception, \
+    async_create_gpt_chat_completion
+from utils.llm_latency import LatencyRecorder
+from utils.llm_router import LLMEndpoint, LLMRouter
+from utils.llm_transport import llm_transport, TransportTiming
+from utils.rate_limiter import RateLimiter
+from utils.retry_policy import RetryPolicy
 from main import get_custom_print
+from helpers.exceptions import TokenLimitError, ApiError
 
 load_dotenv()
 os.environ.pop("AUTOFIX_FILE_PATHS", None)
@@ -361,12 +370,14 @@ class TestLlmConnection:
     def setup_method(self):
         builtins.print, ipc_client_instance = get_custom_print({})
 
-    @patch('utils.llm_connection.requests.post')
+    @patch('utils.rate_limiter.random.uniform', side_effect=lambda low, high: high)
+    @patch('utils.llm_connection.llm_transport.post')
     @patch('utils.llm_connection.time.sleep')
-    def test_rate_limit_error(self, mock_sleep, mock_post, monkeypatch):
+    def test_rate_limit_error(self, mock_sleep, mock_post, mock_uniform, monkeypatch):
         project = Project({'app_id': 'test-app'})
 
         monkeypatch.setenv('OPENAI_API_KEY', 'secret')
+        monkeypatch.setattr(llm_transport, 'rate_limiter', RateLimiter(backoff_base=1, backoff_max=60))
 
         error_texts = [
             "Please try again in 6ms.",
@@ -388,7 +399,7 @@ class TestLlmConnection:
 
         mock_success_response = Mock()
         mock_success_response.status_code = 200
-        mock_success_response.iter_lines.return_value = [success_text.encode('utf-8')]
+        mock_success_response.iter_content.return_value = [success_text.encode('utf-8') + b'\n']
 
         # add the success at the end of the error requests
         mock_responses.append(mock_success_response)
@@ -406,9 +417,68 @@ class TestLlmConnection:
 
         # Then
         assert response == {'text': 'DONE'}
-        assert mock_sleep.call_args_list == [call(6.006), call(7.2), call(131.5)]
+        # requested wait time plus exponential backoff
+        assert [c.args[0] for c in mock_sleep.call_args_list] == pytest.approx([1.006, 3.2, 129.5])
 
-    @patch('utils.llm_connection.requests.post')
+    @patch('utils.llm_connection.llm_transport.post')
+    @patch('utils.llm_connection.time.sleep')
+    def test_streamed_rate_limit_error_backs_off_its_endpoint(self, mock_sleep, mock_post, monkeypatch):
+        project = Project({'app_id': 'test-app'})
+        monkeypatch.setenv('OPENAI_API_KEY', 'secret')
+        monkeypatch.setenv('ENDPOINT', 'OPENAI')
+        rate_limiter = RateLimiter(backoff_base=1, backoff_max=60)
+        monkeypatch.setattr(llm_transport, 'rate_limiter', rate_limiter)
+
+        error_text = '{"error": {"message": "Rate limit reached. Please try again in 1.2s.", "code": "rate_limit_exceeded"}}'
+        success_text = '{"choices": [{"index": 0, "delta": {"role": "assistant", "content": "DONE"}}]}'
+        mock_post.side_effect = [
+            Mock(status_code=200, iter_content=Mock(return_value=[error_text.encode('utf-8') + b'\n'])),
+            Mock(status_code=200, iter_content=Mock(return_value=[success_text.encode('utf-8') + b'\n'])),
+        ]
+        data = {'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'testing'}]}
+
+        # When
+        with patch('utils.llm_connection.llm_router', LLMRouter([LLMEndpoint('openai-1')])):
+            response = retry_on_exception(stream_gpt_completion)(data, 'test', project)
+
+        # Then the endpoint the error came from is paused, not the one in the ENDPOINT variable
+        assert response == {'text': 'DONE'}
+        mock_sleep.assert_called_once()
+        assert list(rate_limiter.endpoints) == ['openai-1']
+
+    @patch('utils.retry_policy.random.uniform', side_effect=lambda low, high: high)
+    @patch('utils.llm_connection.styled_text')
+    @patch('utils.llm_connection.llm_transport.post')
+    @patch('utils.llm_connection.time.sleep')
+    def test_headless_retry_policy(self, mock_sleep, mock_post, mock_styled_text, mock_uniform, monkeypatch):
+        project = Project({'app_id': 'test-app'})
+        monkeypatch.setenv('OPENAI_API_KEY', 'secret')
+        policy = RetryPolicy(enabled=True, max_attempts=3, backoff_base=2, backoff_max=60)
+
+        success_text = '{"id": "gen-123", "choices": [{"index": 0, "delta": {"role": "assistant", "content": "DONE"}}]}'
+        mock_success_response = Mock(status_code=200)
+        mock_success_response.iter_content.return_value = [success_text.encode('utf-8') + b'\n']
+        mock_post.side_effect = [Mock(status_code=503, text='Service Unavailable')] * 2 + [mock_success_response]
+
+        wrapper = retry_on_exception(stream_gpt_completion)
+        data = {'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'testing'}]}
+
+        with patch('utils.llm_connection.llm_retry_policy', policy):
+            response = wrapper(data, 'test', project)
+
+        # retried with exponential backoff, without asking the user
+        assert response == {'text': 'DONE'}
+        assert [c.args[0] for c in mock_sleep.call_args_list] == [2, 4]
+        mock_styled_text.assert_not_called()
+
+        # errors that aren't retryable fail at once
+        mock_sleep.reset_mock()
+        mock_post.side_effect = [Mock(status_code=400, text='Bad Request')]
+        with patch('utils.llm_connection.llm_retry_policy', policy), pytest.raises(ApiError):
+            wrapper(data, 'test', project)
+        mock_sleep.assert_not_called()
+
+    @patch('utils.llm_connection.llm_transport.post')
     def test_stream_gpt_completion(self, mock_post, monkeypatch):
         project = Project({'app_id': 'test-app'})
 
@@ -421,17 +491,17 @@ class TestLlmConnection:
                   '}']
         lines_to_yield = [
             ('{"id": "gen-123", "choices": [{"index": 0, "delta": {"role": "assistant", "content": "' + delta + '"}}]}')
-            .encode('utf-8')
+            .encode('utf-8') + b'\n'
             for delta in deltas
         ]
-        lines_to_yield.insert(1, b': OPENROUTER PROCESSING')  # Simulate OpenRoute keep-alive pings
+        lines_to_yield.insert(1, b': OPENROUTER PROCESSING\n')  # Simulate OpenRoute keep-alive pings
         mock_response = Mock()
         mock_response.status_code = 200
-        mock_response.iter_lines.return_value = lines_to_yield
+        mock_response.iter_content.return_value = lines_to_yield
 
         mock_post.return_value = mock_response
 
-        with patch('utils.llm_connection.requests.post', return_value=mock_response):
+        with patch('utils.llm_connection.llm_transport.post', return_value=mock_response):
             # When
             response = stream_gpt_completion({
                 'model': 'gpt-4',
@@ -441,6 +511,155 @@ class TestLlmConnection:
             # Then
             assert response == {'text': '{\n  "foo": "bar",\n  "prompt": "Hello",\n  "choices": []\n}'}
 
+    @patch('utils.llm_connection.telemetry')
+    @patch('utils.llm_connection.llm_transport.post')
+    def test_stream_gpt_completion_uses_streamed_usage(self, mock_post, mock_telemetry, monkeypatch):
+        project = Project({'app_id': 'test-app'})
+        monkeypatch.setenv('OPENAI_API_KEY', 'secret')
+        monkeypatch.delenv('ENDPOINT', raising=False)
+
+        # Given a stream ending with a usage chunk
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.iter_content.return_value = [
+            b'data: {"choices": [{"index": 0, "delta": {"content": "DONE"}}]}\n\n',
+            b'data: {"choices": [], "usage": {"prompt_tokens": 120, "completion_tokens": 3, "total_tokens": 123}}\n\n',
+            b'data: [DONE]\n\n',
+        ]
+        mock_post.return_value = mock_response
+
+        # When
+        response = stream_gpt_completion({'model': 'gpt-4', 'messages': []}, '', project)
+
+        # Then usage stats were requested and used instead of counting tokens locally
+        assert response == {'text': 'DONE'}
+        assert mock_post.call_args.kwargs['json']['stream_options'] == {'include_usage': True}
+        assert mock_telemetry.record_llm_request.call_args.args[0] == 123
+
+    @patch('utils.llm_connection.rate_limit_exceeded_sleep')
+    @patch('utils.llm_connection.llm_transport.post')
+    def test_stream_gpt_completion_records_latency_breakdown(self, mock_post, mock_sleep, monkeypatch, tmp_path):
+        project = Project({'app_id': 'test-app'})
+        monkeypatch.setenv('OPENAI_API_KEY', 'secret')
+        recorder = LatencyRecorder(log_path=str(tmp_path / 'latency.jsonl'))
+
+        # Given a rate limited request, and a successful one on retry
+        rate_limited_response = Mock(status_code=429, text='{"error": {"code": "rate_limit_exceeded"}}')
+        rate_limited_response.llm_timing = TransportTiming(queue_time=0, connect_time=0.2, ttfb=0.3)
+        mock_response = Mock(status_code=200)
+        mock_response.llm_timing = TransportTiming(queue_time=0.1, connect_time=0, ttfb=0.5)
+        mock_response.iter_content.return_value = [
+            b'data: {"choices": [{"index": 0, "delta": {"content": "DONE"}}]}\n\n',
+            b'data: {"choices": [], "usage": {"prompt_tokens": 120, "completion_tokens": 3, "total_tokens": 123}}\n\n',
+            b'data: [DONE]\n\n',
+        ]
+        mock_post.side_effect = [rate_limited_response, mock_response]
+
+        # When
+        with patch('utils.llm_connection.llm_latency', recorder):
+            response = stream_gpt_completion({'model': 'gpt-4', 'messages': []}, 'coding', project,
+                                             prompt_path='development/implement_changes.prompt')
+
+        # Then both attempts are recorded, tagged with the request type and prompt
+        assert response == {'text': 'DONE'}
+        mock_sleep.assert_called_once()
+        failed, succeeded = recorder.timings
+        assert failed['is_error'] and failed['retries'] == 0 and failed['ttft'] is None
+        assert failed['connect_time'] == 0.2
+        assert not succeeded['is_error'] and succeeded['retries'] == 1
+        assert succeeded['req_type'] == 'coding'
+        assert succeeded['prompt_path'] == 'development/implement_changes.prompt'
+        assert succeeded['endpoint'] == failed['endpoint'] is not None
+        assert (succeeded['queue_time'], succeeded['connect_time'], succeeded['ttfb']) == (0.1, 0, 0.5)
+        assert succeeded['ttft'] is not None and succeeded['streaming_time'] is not None
+        assert succeeded['output_tokens'] == 3
+        assert succeeded['total_time'] >= succeeded['ttft']
+        assert len((tmp_path / 'latency.jsonl').read_text().splitlines()) == 2
+
+    @patch('utils.llm_connection.llm_transport.post')
+    def test_stream_gpt_completion_aborts_on_invalid_json(self, mock_post, monkeypatch):
+        project = Project({'app_id': 'test-app'})
+        monkeypatch.setenv('OPENAI_API_KEY', 'secret')
+        function = {
+            'name': 'test',
+            'description': 'test schema',
+            'parameters': {
+                'type': 'object',
+                'properties': {'type': {'type': 'string', 'enum': ['command', 'code_change']}},
+                'required': ['type'],
+            },
+        }
+
+        # Given a streamed response with an invalid enum value early on, and a valid response on retry
+        deltas = ['{\\n', '  \\"type\\": ', '\\"human_intervention\\"', ',\\n', '  \\"more\\": 1', '}']
+        lines_read = []
+
+        def iter_content(chunk_size):
+            for delta in deltas:
+                lines_read.append(delta)
+                yield ('data: {"choices": [{"index": 0, "delta": {"content": "' + delta + '"}}]}\n\n').encode('utf-8')
+
+        invalid_response = Mock()
+        invalid_response.status_code = 200
+        invalid_response.iter_content.side_effect = iter_content
+        valid_response = Mock()
+        valid_response.status_code = 200
+        valid_response.iter_content.return_value = [
+            b'data: {"choices": [{"index": 0, "delta": {"content": "{\\"type\\": \\"command\\"}"}}]}\n\n',
+        ]
+        mock_post.side_effect = [invalid_response, valid_response]
+
+        # When
+        response = stream_gpt_completion({'model': 'gpt-4', 'messages': [], 'functions': [function]}, '', project)
+
+        # Then the first stream is aborted as soon as the invalid value is received
+        assert len(lines_read) == 3
+        invalid_response.close.assert_called_once()
+        # And the LLM is asked to fix the response
+        retry_messages = mock_post.call_args.kwargs['json']['messages']
+        assert "at $.type - 'human_intervention' is not one of" in retry_messages[-1]['content']
+        assert response == {'text': '{"type": "command"}'}
+
+    @patch('utils.token_budget.get_context_window', lambda model: 1000)
+    @patch('utils.llm_connection.trace_token_limit_error')
+    @patch('utils.llm_connection.llm_transport.post')
+    def test_create_gpt_chat_completion_rejects_oversize_request(self, mock_post, mock_trace, monkeypatch):
+        project = Project({'app_id': 'test-app'})
+        monkeypatch.setenv('OPENAI_API_KEY', 'secret')
+        messages = [{'role': 'user', 'content': 'word ' * 2000}]
+
+        # When / Then the request is rejected before it's sent
+        with pytest.raises(TokenLimitError):
+            create_gpt_chat_completion(messages, '', project)
+
+        mock_post.assert_not_called()
+        mock_trace.assert_called_once()
+
+    @patch('utils.llm_connection.stream_gpt_completion')
+    def test_async_create_gpt_chat_completion_runs_concurrently(self, mock_stream):
+        project = Project({'app_id': 'test-app'})
+
+        def slow_completion(data, _req_type, _project, prompt_path=None):
+            time.sleep(0.2)
+            return {'text': data['messages'][-1]['content']}
+
+        mock_stream.side_effect = slow_completion
+
+        async def gather():
+            return await asyncio.gather(*[
+                async_create_gpt_chat_completion([{'role': 'user', 'content': str(i)}], 'test', project)
+                for i in range(3)
+            ])
+
+        # When
+        start = time.time()
+        responses = asyncio.run(gather())
+        elapsed = time.time() - start
+
+        # Then the requests overlap and the responses are in order
+        assert responses == [{'text': '0'}, {'text': '1'}, {'text': '2'}]
+        assert elapsed < 0.5
+
     @pytest.mark.uses_tokens
     @pytest.mark.parametrize('endpoint, model', [
         ('OPENAI', 'gpt-4'),  # role: system
@@ -0,0 +1,227 @@
+import os
+import re
+from typing import Callable, Optional
+
+from const.llm import MAX_GPT_MODEL_TOKENS, MODEL_CONTEXT_WINDOWS, MIN_TOKENS_FOR_GPT_RESPONSE, TOKENS_PER_MESSAGE, MIN_TRUNCATED_FILE_LINES, \
+    FILE_CONTEXT_MAX_TOKENS
+from logger.logger import logger
+
+# These must match the formatting in `files_list.prompt`
+FILES_SECTION_PATTERN = re.compile(r"\n---START_OF_FILES---\n(.*?)\n---END_OF_FILES---\n", re.DOTALL)
+FILE_HEADER_PATTERN = re.compile(r"^\*\*(.+?)\*\* \((\d+) lines of code\):\n```\n", re.MULTILINE)
+# Notes after the last file in the files section, eg. the files not included (see `AgentConvo.render_files_block()`)
+FILES_NOTES_PATTERN = re.compile(r"```\n+((?:\([^\n]*\)(?:\n+|$))+)$")
+OTHER_FILES_NOTE_START = "(Other files, not shown as they're less relevant to the task: "
+
+
+def get_context_window(model: str) -> int:
+    """
+    Get the context window size (in tokens) for the model.
+
+    Models that aren't well known get the MAX_TOKENS environment variable.
+
+    :param model: model name, optionally with the provider prefix (eg. "openai/gpt-4")
+    :return: context window size
+    """
+    model = model.split('/')[-1]
+    # Longest prefix wins, so "gpt-4-turbo" is matched before "gpt-4"
+    for prefix in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(prefix):
+            return MODEL_CONTEXT_WINDOWS[prefix]
+    return MAX_GPT_MODEL_TOKENS
+
+
+class FileEntry:
+    """
+    A single file in the files section of a message.
+    """
+
+    def __init__(self, path: str, header: str, content: str):
+        self.path = path
+        self.header = header
+        self.content = content
+        self.dropped = False
+
+    def render(self) -> str:
+        return f"{self.header}{self.content}\n```\n"
+
+
+def parse_files_section(section: str) -> list[FileEntry]:
+    """
+    Split the files section (between the START/END markers) into file entries.
+    """
+    headers = list(FILE_HEADER_PATTERN.finditer(section))
+    entries = []
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(section)
+        body = section[header.end():end]
+        # Each entry ends with "\n```\n" and an empty line between the entries
+        body = body.rstrip('\n')
+        if body.endswith('```'):
+            body = body[:-3]
+        entries.append(FileEntry(header.group(1), header.group(0), body.rstrip('\n')))
+    return entries
+
+
+def split_files_notes(section: str) -> tuple[str, list[str]]:
+    """
+    Split the notes after the last file off the files section (between the START/END markers).
+
+    :return: (files, notes) - the section without the notes, and the notes
+    """
+    match = FILES_NOTES_PATTERN.search(section)
+    if not match:
+        return section, []
+    notes = [line for line in match.group(1).split('\n') if line]
+    return section[:match.start(1)], notes
+
+
+def render_files_section(entries: list[FileEntry], omitted: list[str], notes: Optional[list[str]] = None) -> str:
+    lines = [entry.render() for entry in entries if not entry.dropped]
+    lines.extend(f"{note}\n" for note in notes or [])
+    if omitted:
+        lines.append(f"(Omitted to fit the context window: {', '.join(omitted)})\n")
+    return "\n---START_OF_FILES---\n" + "\n".join(lines) + "---END_OF_FILES---\n"
+
+
+def fit_messages_to_token_budget(
+    messages: list[dict],
+    max_tokens: int,
+    count_tokens: Callable[[str], int],
+) -> tuple[list[dict], int]:
+    """
+    Shrink the files sections in the messages until the request fits in the token budget.
+
+    The trimming is deterministic:
+    1. files that aren't mentioned anywhere else in the conversation (least relevant)
+       are dropped, largest first;
+    2. if that's not enough, the largest remaining files are truncated (halved) until
+       the request fits or they can't be truncated any further.
+
+    Each decision is logged. The original messages are not modified.
+
+    :param messages: request messages
+    :param max_tokens: max number of tokens the request may have
+    :param count_tokens: function counting tokens in a text
+    :return: (messages, number of tokens) - trimmed copy of the messages (or the original
+        messages if they already fit) and the number of tokens in them
+    """
+    def total_tokens(msgs):
+        return sum(count_tokens(msg['content']) + TOKENS_PER_MESSAGE for msg in msgs)
+
+    n_tokens = total_tokens(messages)
+    if n_tokens <= max_tokens:
+        return messages, n_tokens
+
+    # Parse files sections from all the messages; the same file may be in several of them
+    sections = {}
+    other_text = []
+    for i, msg in enumerate(messages):
+        content = msg.get('content') or ''
+        parts = FILES_SECTION_PATTERN.split(content)
+        other_text.extend(parts[0::2])
+        if len(parts) > 1:
+            sections[i] = []
+            for section in parts[1::2]:
+                section, notes = split_files_notes(section)
+                sections[i].append((parse_files_section(section), notes))
+
+    files = {}
+    for msg_sections in sections.values():
+        for entries, _notes in msg_sections:
+            for entry in entries:
+                files.setdefault(entry.path, []).append(entry)
+
+    if not files:
+        return messages, n_tokens
+
+    def file_tokens(path):
+        return sum(count_tokens(entry.render()) for entry in files[path] if not entry.dropped)
+
+    other_text = '\n'.join(other_text)
+    relevance = {
+        path: other_text.count(path) + other_text.count(os.path.basename(path))
+        for path in files
+    }
+
+    overshoot = n_tokens - max_tokens
+    omitted = []
+
+    # 1. Drop files not referenced elsewhere in the conversation, largest first
+    candidates = sorted(
+        (path for path in files if relevance[path] == 0),
+        key=lambda path: (-file_tokens(path), path),
+    )
+    for path in candidates:
+        if overshoot <= 0:
+            break
+        saved = file_tokens(path)
+        for entry in files[path]:
+            entry.dropped = True
+        omitted.append(path)
+        overshoot -= saved
+        logger.info(f'Token budget: dropped file {path} from the request (not referenced, {saved} tokens)')
+
+    # 2. Truncate the largest remaining files
+    while overshoot > 0:
+        remaining = [path for path in files if path not in omitted]
+        truncatable = [
+            path for path in remaining
+            if files[path][0].content.count('\n') + 1 > MIN_TRUNCATED_FILE_LINES * 2
+        ]
+        if not truncatable:
+            break
+        path = min(truncatable, key=lambda p: (-file_tokens(p), p))
+        before = file_tokens(path)
+        for entry in files[path]:
+            lines = entry.content.split('\n')
+            keep = len(lines) // 2
+            entry.content = '\n'.join(lines[:keep] + [f'[... {len(lines) - keep} more lines truncated ...]'])
+        saved = before - file_tokens(path)
+        overshoot -= saved
+        logger.info(f'Token budget: truncated file {path} to {keep} lines (saved {saved} tokens)')
+
+    trimmed = []
+    for i, msg in enumerate(messages):
+        if i not in sections:
+            trimmed.append(msg)
+            continue
+        msg_sections = iter(sections[i])
+
+        def render_next_section(_match):
+            entries, notes = next(msg_sections)
+            return render_files_section(entries, omitted, notes)
+
+        content = FILES_SECTION_PATTERN.sub(
+            render_next_section,
+            msg['content'],
+        )
+        trimmed.append({**msg, 'content': content})
+
+    n_tokens = total_tokens(trimmed)
+    logger.info(f'Token budget: request trimmed to {n_tokens} tokens (budget: {max_tokens} tokens)')
+    return trimmed, n_tokens
+
+
+def get_request_token_budget(model: str) -> int:
+    """
+    Get the max number of tokens a request to the model may have, leaving room for the response.
+
+    :param model: model name
+    :return: token budget
+    """
+    return get_context_window(model) - MIN_TOKENS_FOR_GPT_RESPONSE
+
+
+def get_file_context_budget(model: str) -> int:
+    """
+    Get the max number of tokens the content of the project files sent to the model may have.
+
+    Set with the FILE_CONTEXT_MAX_TOKENS environment variable, defaults to half of the request token budget.
+
+    :param model: model name
+    :return: token budget
+    """
+    if FILE_CONTEXT_MAX_TOKENS:
+        return FILE_CONTEXT_MAX_TOKENS
+    return get_request_token_budget(model) // 2
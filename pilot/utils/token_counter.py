@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock
+
+from const.llm import TOKEN_COUNT_CACHE_SIZE, TOKEN_COUNT_BATCH_THRESHOLD, TOKEN_COUNT_THREADS
+
+
+class TokenCounter:
+    """
+    Memoized token counter.
+
+    Token counts are cached by a hash of the text, so as a conversation grows only
+    the new (or changed) messages need to be encoded. If a request contains a lot of
+    text that hasn't been seen before, it's encoded in a batch on a thread pool.
+
+    >>> counter = TokenCounter(tiktoken.get_encoding("cl100k_base"))
+    >>> counter.count_messages([{"role": "user", "content": "Hello"}])
+    1
+    """
+
+    def __init__(
+        self,
+        encoding,
+        max_entries: int = TOKEN_COUNT_CACHE_SIZE,
+        batch_threshold: int = TOKEN_COUNT_BATCH_THRESHOLD,
+        num_threads: int = TOKEN_COUNT_THREADS,
+    ):
+        """
+        :param encoding: tiktoken encoding (or any object with compatible `encode_ordinary()`
+            and `encode_ordinary_batch()` methods)
+        :param max_entries: max number of cached token counts
+        :param batch_threshold: number of uncached characters above which they're encoded in a batch
+        :param num_threads: number of threads to use for batch encoding
+        """
+        self.encoding = encoding
+        self.max_entries = max_entries
+        self.batch_threshold = batch_threshold
+        self.num_threads = num_threads
+        self.cache = OrderedDict()
+        self.lock = Lock()
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+    def _get_cached(self, key: bytes):
+        with self.lock:
+            n_tokens = self.cache.get(key)
+            if n_tokens is not None:
+                self.cache.move_to_end(key)
+            return n_tokens
+
+    def _set_cached(self, key: bytes, n_tokens: int):
+        with self.lock:
+            self.cache[key] = n_tokens
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def count(self, text: str) -> int:
+        """
+        Count the number of tokens in a text.
+        """
+        return self.count_many([text])[0]
+
+    def count_many(self, texts: list[str]) -> list[int]:
+        """
+        Count the number of tokens in each of the texts.
+
+        Texts whose token count isn't cached yet are encoded (in a batch on the
+        thread pool if there's enough of them) and their counts are cached.
+
+        :param texts: texts to count tokens in
+        :return: number of tokens in each text
+        """
+        keys = [self._key(text) for text in texts]
+        counts = [self._get_cached(key) for key in keys]
+
+        missing = {}
+        for i, n_tokens in enumerate(counts):
+            if n_tokens is None:
+                missing.setdefault(keys[i], texts[i])
+        if not missing:
+            return counts
+
+        missing_texts = list(missing.values())
+        if len(missing_texts) > 1 and sum(len(text) for text in missing_texts) > self.batch_threshold:
+            encoded = self.encoding.encode_ordinary_batch(missing_texts, num_threads=self.num_threads)
+        else:
+            encoded = [self.encoding.encode_ordinary(text) for text in missing_texts]
+
+        new_counts = {}
+        for key, tokens in zip(missing, encoded):
+            new_counts[key] = len(tokens)
+            self._set_cached(key, len(tokens))
+
+        return [new_counts[keys[i]] if n_tokens is None else n_tokens for i, n_tokens in enumerate(counts)]
+
+    def count_messages(self, messages: list[dict]) -> int:
+        """
+        Count the total number of tokens in the content of the messages.
+
+        :param messages: [{ "role": "system"|"assistant"|"user", "content": string }, ... ]
+        :return: total number of tokens
+        """
+        return sum(self.count_many([message['content'] for message in messages]))
@@ -0,0 +1,229 @@
+import base64
+import math
+import os
+from hashlib import sha1
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+from uuid import uuid4
+
+import requests
+
+from const.llm import MODEL_ENCODINGS, DEFAULT_ENCODING, TOKENIZER_CACHE_DIR, TOKENIZER_OFFLINE, \
+    TOKENIZER_DOWNLOAD_TIMEOUT, APPROXIMATE_BYTES_PER_TOKEN
+from logger.logger import logger
+from utils.settings import loader
+from .token_counter import TokenCounter
+
+# BPE files of the encodings; they're cached as `sha1(url)` in the cache directory (like tiktoken does)
+ENCODING_URLS = {
+    'cl100k_base': 'https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken',
+    'o200k_base': 'https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken',
+}
+# Split pattern and special tokens of the encodings (same as in `tiktoken_ext.openai_public`), so they're
+# built from the cached BPE files, even if the installed tiktoken doesn't know them (eg. o200k_base)
+ENCODING_PARAMS = {
+    'cl100k_base': {
+        'pat_str': r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+""",
+        'special_tokens': {
+            '<|endoftext|>': 100257,
+            '<|fim_prefix|>': 100258,
+            '<|fim_middle|>': 100259,
+            '<|fim_suffix|>': 100260,
+            '<|endofprompt|>': 100276,
+        },
+    },
+    'o200k_base': {
+        'pat_str': '|'.join([
+            r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]*[\p{Ll}\p{Lm}\p{Lo}\p{M}]+(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+            r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]+[\p{Ll}\p{Lm}\p{Lo}\p{M}]*(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+            r"""\p{N}{1,3}""",
+            r""" ?[^\s\p{L}\p{N}]+[\r\n/]*""",
+            r"""\s*[\r\n]+""",
+            r"""\s+(?!\S)""",
+            r"""\s+""",
+        ]),
+        'special_tokens': {
+            '<|endoftext|>': 199999,
+            '<|endofprompt|>': 200018,
+        },
+    },
+}
+
+
+def get_encoding_name(model: str) -> str:
+    """
+    Get the name of the tokenizer encoding used by the model.
+
+    :param model: model name, optionally with the provider prefix (eg. "openai/gpt-4o")
+    :return: encoding name, DEFAULT_ENCODING for unknown models
+    """
+    model = model.split('/')[-1]
+    # Longest prefix wins, same as for the context windows
+    for prefix in sorted(MODEL_ENCODINGS, key=len, reverse=True):
+        if model.startswith(prefix):
+            return MODEL_ENCODINGS[prefix]
+    return DEFAULT_ENCODING
+
+
+class ApproximateEncoding:
+    """
+    Fast token count estimate, used when no BPE encoding is available.
+
+    Only the length of the "encoded" tokens is meaningful. The estimate is based
+    on the UTF-8 size of the text and errs on the side of more tokens, so token
+    budgets stay safe.
+    """
+    name = 'approximate'
+
+    def __init__(self, bytes_per_token: float = APPROXIMATE_BYTES_PER_TOKEN):
+        self.bytes_per_token = bytes_per_token
+
+    def encode_ordinary(self, text: str) -> range:
+        return range(math.ceil(len(text.encode('utf-8', 'surrogatepass')) / self.bytes_per_token))
+
+    def encode(self, text: str, **kwargs) -> range:
+        return self.encode_ordinary(text)
+
+    def encode_ordinary_batch(self, texts: list[str], num_threads: int = 1) -> list[range]:
+        return [self.encode_ordinary(text) for text in texts]
+
+
+class TokenizerRegistry:
+    """
+    Lazily loaded tokenizer encodings, selected per model.
+
+    Nothing is loaded at import time: each encoding is loaded the first time
+    it's needed, from the local cache directory if possible. The cache can be
+    pre-seeded for offline use by copying the BPE files there, named after the
+    encoding (eg. `cl100k_base.tiktoken`). If the model's encoding can't be
+    loaded, `cl100k_base` is used instead, and if that's not available either,
+    token counts are estimated with `ApproximateEncoding`.
+
+    This class is a singleton, use the `tokenizer_registry` global variable to access it:
+
+    >>> from utils.tokenizer import tokenizer_registry
+    >>> tokenizer_registry.get_token_counter("gpt-4o").count("Hello")
+    1
+
+    Configuration (environment variables):
+    * TOKENIZER_CACHE_DIR - location of the BPE files (default: TIKTOKEN_CACHE_DIR
+      or `tokenizers` in the config directory)
+    * TOKENIZER_OFFLINE - never download the BPE files (default: false)
+    """
+
+    def __init__(self, cache_dir: Optional[str] = TOKENIZER_CACHE_DIR, offline: bool = TOKENIZER_OFFLINE):
+        cache_dir = cache_dir or os.getenv('TIKTOKEN_CACHE_DIR')
+        self.cache_dir = Path(cache_dir) if cache_dir else loader.config_dir / "tokenizers"
+        self.offline = offline
+        self.encodings = {}
+        self.approximate_encoding = None
+        self.token_counters = {}
+        self.lock = Lock()
+
+    def get_encoding(self, name: str):
+        """
+        Get an encoding by name, loading it on first use.
+
+        :param name: encoding name, eg. "cl100k_base"
+        :return: tiktoken encoding, or a fallback encoding if it's not available
+        """
+        with self.lock:
+            if name not in self.encodings:
+                self.encodings[name] = self._load(name)
+            encoding = self.encodings[name]
+
+        if encoding is not None:
+            return encoding
+        if name != DEFAULT_ENCODING:
+            return self.get_encoding(DEFAULT_ENCODING)
+
+        with self.lock:
+            if self.approximate_encoding is None:
+                logger.warning(f'Tokenizer encoding {name} not available, token counts will be approximate')
+                self.approximate_encoding = ApproximateEncoding()
+            return self.approximate_encoding
+
+    def get_token_counter(self, model: str) -> TokenCounter:
+        """
+        Get the (memoized) token counter for the model.
+
+        :param model: model name, optionally with the provider prefix
+        """
+        encoding = self.get_encoding(get_encoding_name(model))
+        with self.lock:
+            if encoding.name not in self.token_counters:
+                self.token_counters[encoding.name] = TokenCounter(encoding)
+            return self.token_counters[encoding.name]
+
+    def _load(self, name: str):
+        try:
+            import tiktoken
+        except ImportError as err:
+            logger.warning(f'Error loading tokenizer encoding {name}: {err}')
+            return None
+
+        url = ENCODING_URLS.get(name)
+        if url is None:
+            if name not in tiktoken.list_encoding_names():
+                logger.warning(f'Tokenizer encoding {name} is not known')
+                return None
+            if self.offline:
+                # tiktoken would need to download it
+                logger.warning(f'Tokenizer encoding {name} is not known to be available offline')
+                return None
+            try:
+                return tiktoken.get_encoding(name)
+            except Exception as err:
+                logger.warning(f'Error loading tokenizer encoding {name}: {err}')
+                return None
+
+        cache_path = self._prepare_cache_file(name, url)
+        if cache_path is None:
+            return None
+        try:
+            # Same format as `tiktoken.load.load_tiktoken_bpe()`, which would look for the file in the
+            # directory from the TIKTOKEN_CACHE_DIR environment variable
+            mergeable_ranks = {
+                base64.b64decode(token): int(rank)
+                for token, rank in (line.split() for line in cache_path.read_bytes().splitlines() if line)
+            }
+            return tiktoken.Encoding(name, mergeable_ranks=mergeable_ranks, **ENCODING_PARAMS[name])
+        except Exception as err:
+            logger.warning(f'Error loading tokenizer encoding {name}: {err}')
+            return None
+
+    def _prepare_cache_file(self, name: str, url: str) -> Optional[Path]:
+        """
+        Make sure the BPE file is in the cache: copy it from the pre-seeded
+        `<name>.tiktoken` file or download it (with a timeout, unless offline).
+
+        :return: path of the cache file, None if it's not available
+        """
+        cache_path = self.cache_dir / sha1(url.encode()).hexdigest()
+        if cache_path.exists():
+            return cache_path
+
+        seeded_path = self.cache_dir / f'{name}.tiktoken'
+        try:
+            if seeded_path.exists():
+                contents = seeded_path.read_bytes()
+            elif self.offline:
+                return None
+            else:
+                logger.info(f'Downloading tokenizer encoding {name} from {url}')
+                response = requests.get(url, timeout=TOKENIZER_DOWNLOAD_TIMEOUT)
+                response.raise_for_status()
+                contents = response.content
+
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(f'{cache_path.name}.{uuid4()}.tmp')
+            tmp_path.write_bytes(contents)
+            os.replace(tmp_path, cache_path)
+            return cache_path
+        except (OSError, requests.RequestException) as err:
+            logger.warning(f'Error preparing tokenizer encoding {name}: {err}')
+            return None
+
+
+tokenizer_registry = TokenizerRegistry()
@@ -8,17 +8,165 @@ import distro
 import json
 import hashlib
 import re
-import copy
-from jinja2 import Environment, FileSystemLoader
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, meta
+from jinja2.runtime import Context
 from .style import color_green
 
 from const.llm import MAX_QUESTIONS, END_RESPONSE
-from const.common import ROLES, STEPS
+from const.common import ROLES, STEPS, PROMPT_CACHE_DIR, PROMPT_COMPONENT_CACHE_SIZE
 from logger.logger import logger
+from utils.copy_on_write import copy_on_write, freeze
+from utils.settings import loader
+
+COMPONENTS_DIR = 'components'
+
+
+class PromptBytecodeCache(FileSystemBytecodeCache):
+    """
+    Persistent cache of compiled prompt templates, so they're only compiled once, not in every run.
+
+    The cache directory is only created when the first template is compiled (not when the
+    module is imported). If it can't be created, the templates are compiled every run.
+    """
+
+    def __init__(self, directory: str):
+        super().__init__(directory)
+        self.writable = None
+
+    def load_bytecode(self, bucket):
+        try:
+            super().load_bytecode(bucket)
+        except OSError:
+            # eg. the cache location isn't a directory, the template is compiled
+            pass
+
+    def dump_bytecode(self, bucket):
+        if self.writable is None:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                self.writable = True
+            except OSError as err:
+                logger.warning(f'Error creating prompt cache directory {self.directory}, '
+                               f'prompts will be compiled every run: {err}')
+                self.writable = False
+        if self.writable:
+            super().dump_bytecode(bucket)
+
+
+def get_bytecode_cache(cache_dir: Optional[str] = PROMPT_CACHE_DIR) -> PromptBytecodeCache:
+    """
+    Get the persistent cache of compiled prompt templates (see `PromptBytecodeCache`).
+
+    :param cache_dir: cache location (default: `prompt_cache` in the config directory)
+    :return: bytecode cache
+    """
+    return PromptBytecodeCache(cache_dir or os.path.join(loader.config_dir, 'prompt_cache'))
+
+
+class PromptContext(Context):
+    """
+    Template context that renders the prompt components (`prompts/components/*.prompt`) when a
+    template references them, instead of rendering all of them for each prompt.
+
+    As before, prompt data takes precedence over template globals, components take precedence
+    over prompt data, and components can't reference other components.
+    """
+
+    def resolve_or_missing(self, key):
+        if key not in self.vars and not self.name.startswith(COMPONENTS_DIR + '/'):
+            component = prompt_components.get_template_name(key)
+            if component is not None:
+                return prompt_components.render(component, self.parent)
+        return super().resolve_or_missing(key)
+
+
+class PromptComponents:
+    """
+    Renders prompt components, memoized by the values of the variables each component uses.
+
+    Components that modify the prompt data while rendering (eg. `steps_list` shortens the
+    steps it lists) are rendered every time, so the changes are still made.
+
+    >>> prompt_components.render('components/file_naming.prompt', {'MAX_QUESTIONS': 5})
+    """
+
+    def __init__(self, environment: Environment, max_size: int = PROMPT_COMPONENT_CACHE_SIZE):
+        self.env = environment
+        self.max_size = max_size
+        self.template_names = None  # component name -> template name
+        self.variables = {}  # template name -> names of the variables the component uses
+        self.impure = set()  # template names of the components modifying the prompt data
+        self.cache = OrderedDict()
+        self.lock = Lock()
+
+    def get_template_names(self) -> dict[str, str]:
+        """
+        Get the template names of all components, by component name (the file name without the extension).
+        """
+        if self.template_names is None:
+            self.template_names = {
+                os.path.splitext(os.path.basename(name))[0]: name
+                for name in self.env.list_templates()
+                if name.startswith(COMPONENTS_DIR + '/')
+            }
+        return self.template_names
+
+    def get_template_name(self, name: str) -> Optional[str]:
+        return self.get_template_names().get(name)
+
+    def get_variables(self, template_name: str) -> tuple[str, ...]:
+        if template_name not in self.variables:
+            source = self.env.loader.get_source(self.env, template_name)[0]
+            self.variables[template_name] = tuple(sorted(meta.find_undeclared_variables(self.env.parse(source))))
+        return self.variables[template_name]
+
+    def get_signature(self, template_name: str, data: dict) -> tuple:
+        # A snapshot sharing the values (file contents aren't copied or serialized)
+        return tuple((name, freeze(data[name])) for name in self.get_variables(template_name) if name in data)
+
+    def render(self, template_name: str, data: dict) -> str:
+        """
+        Render a component with the prompt data.
+
+        :param template_name: template name of the component (eg. "components/files_list.prompt")
+        :param data: prompt data
+        :return: rendered component
+        """
+        if template_name in self.impure:
+            return self.env.get_template(template_name).render(data)
+
+        key = (template_name, self.get_signature(template_name, data))
+        try:
+            hash(key)
+        except TypeError:
+            # Unhashable values, can't be memoized
+            return self.env.get_template(template_name).render(data)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        output = self.env.get_template(template_name).render(data)
+
+        if self.get_signature(template_name, data) != key[1]:
+            # The component changed the data, the changes must be made every time
+            self.impure.add(template_name)
+            return output
+        with self.lock:
+            self.cache[key] = output
+            if len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        return output
+
 
 prompts_path = os.path.join(os.path.dirname(__file__), '..', 'prompts')
 file_loader = FileSystemLoader(prompts_path)
-env = Environment(loader=file_loader)
+env = Environment(loader=file_loader, bytecode_cache=get_bytecode_cache())
+env.context_class = PromptContext
+prompt_components = PromptComponents(env)
 
 
 def capitalize_first_word_with_underscores(s):
@@ -35,23 +183,27 @@ def capitalize_first_word_with_underscores(s):
 
 
 def get_prompt(prompt_name, original_data=None):
-    data = copy.deepcopy(original_data) if original_data is not None else {}
-
-    get_prompt_components(data)
+    # Components may modify the data (see PromptComponents), so they get a copy
+    data = copy_on_write(original_data) if original_data is not None else {}
+    data.update({
+        'MAX_QUESTIONS': MAX_QUESTIONS,
+        'END_RESPONSE': END_RESPONSE
+    })
 
     logger.info(f"Getting prompt for {prompt_name}")
 
     # Load the template
     template = env.get_template(prompt_name)
 
-    # Render the template with the provided data
+    # Render the template with the provided data, components are rendered as they're referenced
     output = template.render(data)
 
     return output
 
 
 def get_prompt_components(data):
-    # This function reads and renders all prompts inside /prompts/components and returns them in dictionary
+    # This function renders all prompts inside /prompts/components and adds them to the data
+    # Note: `get_prompt()` renders only the components the prompt references, when it references them
 
     # Create an empty dictionary to store the file contents.
     prompts_components = {}
@@ -60,26 +212,9 @@ def get_prompt_components(data):
         'END_RESPONSE': END_RESPONSE
     })
 
-    # Create a FileSystemLoader
-    prompts_path = os.path.join(os.path.dirname(__file__), '..', 'prompts/components')
-    file_loader = FileSystemLoader(prompts_path)
-
-    # Create the Jinja2 environment
-    env = Environment(loader=file_loader)
-
-    # Get the list of template names
-    template_names = env.list_templates()
-
-    # For each template, load and store its content
-    for template_name in template_names:
-        # Get the filename without extension as the dictionary key.
-        file_key = os.path.splitext(template_name)[0]
-
-        # Load the template and render it with no variables
-        file_content = env.get_template(template_name).render(data)
-
-        # Store the file content in the dictionary
-        prompts_components[file_key] = file_content
+    for file_key, template_name in sorted(prompt_components.get_template_names().items(),
+                                          key=lambda item: item[1]):
+        prompts_components[file_key] = prompt_components.render(template_name, data)
 
     return data.update(prompts_components)
 
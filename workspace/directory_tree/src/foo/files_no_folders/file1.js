@@ -0,0 +1 @@
+console.log("Hello World!");
\ No newline at end of file
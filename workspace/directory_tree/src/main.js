@@ -0,0 +1 @@
+console.log("Changed!");
\ No newline at end of file